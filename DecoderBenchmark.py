@@ -0,0 +1,104 @@
+# Measures the throughput of EDMOPacketDecoder against the per byte loop it replaced, and checks that both find the same packets
+#
+# A stream of SEND_ALL_DATA sized packets is split into random chunks, as a serial port delivers them.
+#
+# Usage:
+#   python DecoderBenchmark.py --packets 5000 --max-chunk 256
+
+import argparse
+import random
+import sys
+import time
+
+from EDMOCommands import EDMOCommands, EDMOPacket, EDMOPacketDecoder
+
+# The size of the data of a SEND_ALL_DATA packet, before escaping
+PACKET_DATA_SIZE = 150
+
+
+class PerByteDecoder:
+    """The decoder SerialProtocol.data_received used to be, appending and checking the buffer one byte at a time"""
+
+    def __init__(self):
+        self.receiveBuffer = bytearray()
+        self.receivingData = False
+
+    def feed(self, data: bytes):
+        packets = list[bytes]()
+
+        for i in range(0, len(data)):
+            self.receiveBuffer.append(data[i])
+
+            if len(self.receiveBuffer) >= 2 and self.receiveBuffer.endswith(EDMOPacket.HEADER):
+                self.receiveBuffer = self.receiveBuffer[:2]
+                self.receivingData = True
+
+            if not self.receivingData:
+                if len(self.receiveBuffer) >= 2:
+                    self.receiveBuffer = bytearray()
+                continue
+
+            if not self.receiveBuffer.endswith(EDMOPacket.FOOTER):
+                continue
+
+            self.receivingData = False
+            packets.append(bytes(self.receiveBuffer))
+            self.receiveBuffer = bytearray()
+
+        return packets
+
+
+def createStream(packetCount: int, maxChunk: int, rng: random.Random):
+    """Packets sent back to back, and the chunks they are received in"""
+    packets = [
+        EDMOPacket.create(EDMOCommands.SEND_ALL_DATA, rng.randbytes(PACKET_DATA_SIZE))
+        for _ in range(packetCount)
+    ]
+    stream = b"".join(packets)
+
+    chunks = list[bytes]()
+    offset = 0
+    while offset < len(stream):
+        size = rng.randint(1, maxChunk)
+        chunks.append(stream[offset : offset + size])
+        offset += size
+
+    return packets, chunks, len(stream)
+
+
+def measure(decoder, chunks: list[bytes]):
+    packets = list[bytes]()
+    start = time.perf_counter()
+
+    for chunk in chunks:
+        packets.extend(decoder.feed(chunk))
+
+    return packets, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the packet decoder against the per byte loop")
+    parser.add_argument("--packets", type=int, default=5000)
+    parser.add_argument("--max-chunk", type=int, default=256, help="Chunks are between 1 and this many bytes")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    expected, chunks, size = createStream(args.packets, args.max_chunk, rng)
+
+    reference, referenceTime = measure(PerByteDecoder(), chunks)
+    decoded, decoderTime = measure(EDMOPacketDecoder(), chunks)
+
+    print(f"{len(expected)} packets, {size / 1e6:.2f} MB in {len(chunks)} chunks")
+    print(f"  per byte loop  {size / referenceTime / 1e6:6.1f} MB/s")
+    print(f"  decoder        {size / decoderTime / 1e6:6.1f} MB/s ({referenceTime / decoderTime:.1f}x)")
+
+    if decoded != expected or reference != expected:
+        print("The decoders didn't find the packets that were sent")
+        sys.exit(1)
+
+    print("  both decoders found every packet")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@
 
 import asyncio
 from asyncio import tasks
+import itertools
 from typing import AsyncIterator
 from aiohttp import web
 from aiohttp.web_middlewares import normalize_path_middleware
@@ -13,14 +14,24 @@ from aiortc.contrib.signaling import object_from_string, object_to_string
 
 from aiortc import RTCSessionDescription
 
+from Utilities import Metrics
+from Utilities.PeriodicTask import PeriodicTask
 from WebRTCPeer import WebRTCPeer
 
 
 # flake8: noqa: F811
 class EDMOBackend:
+    # The rate (in Hz) at which each session updates its EDMO
+    # Every session has its own timer, so a slow session doesn't delay the others
+    SESSION_UPDATE_RATE = 10
+
+    # The interval (in seconds) at which we search for new EDMOs
+    DISCOVERY_INTERVAL = 1.0
+
     def __init__(self):
         self.activeEDMOs: dict[str, FusedCommunicationProtocol] = {}
         self.activeSessions: dict[str, EDMOSession] = {}
+        self.sessionTimers: dict[str, PeriodicTask] = {}
 
         self.fusedCommunication = FusedCommunication()
         self.fusedCommunication.onEdmoConnected.append(self.onEDMOConnected)
@@ -28,6 +39,10 @@ class EDMOBackend:
 
         self.simpleViewEnabled = False
 
+        self.discoveryTimer = PeriodicTask(
+            self.fusedCommunication.update, self.DISCOVERY_INTERVAL, "discovery"
+        )
+
     # region EDMO MANAGEMENT
 
     def onEDMOConnected(self, protocol: FusedCommunicationProtocol):
@@ -61,16 +76,55 @@ class EDMOBackend:
 
         session.setSimpleView(self.simpleViewEnabled)
 
+        self.sessionTimers[identifier] = PeriodicTask(
+            session.update, 1 / self.SESSION_UPDATE_RATE, "session"
+        ).start()
+
         return session
 
     def removeSession(self, session: EDMOSession):
         identifier = session.protocol.identifier
+        if identifier in self.sessionTimers:
+            self.sessionTimers[identifier].stop()
+            del self.sessionTimers[identifier]
+
         if identifier in self.activeSessions:
             asyncio.create_task(self.activeSessions[identifier].close())
             del self.activeSessions[identifier]
 
     # endregion
 
+    # region METRICS
+
+    def collectMetrics(self, exposition: Metrics.Exposition):
+        sessions = list(self.activeSessions.values())
+
+        exposition.family("edmo_edmos", "gauge", "EDMOs that are connected to the server")
+        exposition.sample("edmo_edmos", len(self.activeEDMOs))
+
+        exposition.family("edmo_sessions", "gauge", "Active sessions")
+        exposition.sample("edmo_sessions", len(sessions))
+
+        exposition.family("edmo_players", "gauge", "Players in a session, by whether their connection is established")
+        exposition.sample("edmo_players", sum(len(s.activePlayers) for s in sessions), {"state": "active"})
+        exposition.sample("edmo_players", sum(len(s.waitingPlayers) for s in sessions), {"state": "waiting"})
+
+        exposition.family("edmo_overriders", "gauge", "Overriders in a session")
+        exposition.sample("edmo_overriders", sum(len(s.activeOverriders) for s in sessions))
+
+        exposition.family(
+            "edmo_datachannel_buffered_bytes", "gauge", "Bytes waiting to be sent over the data channels of a session"
+        )
+        for session in sessions:
+            players = itertools.chain(session.activePlayers, session.waitingPlayers, session.activeOverriders)
+            exposition.sample(
+                "edmo_datachannel_buffered_bytes",
+                sum(player.rtc.bufferedAmount() for player in players),
+                {"session": session.protocol.identifier},
+            )
+
+    # endregion
+
     async def onPlayerConnect(self, request: web.Request):
         """Attempts to handle a connecting player. Will establish a Websocket response if valid attempt."""
         """Otherwise it'll return 404 or 401 depending on what is wrong"""
@@ -91,6 +145,9 @@ class EDMOBackend:
             username = data["playerName"]
             sessionDescription = object_from_string(data["handshake"])
             hasOverrideID = "overrideID" in data
+
+            # Clients that understand snapshots and deltas of the session state ask for them (see SessionState)
+            syncState = data.get("stateSync", False) is True
             if isinstance(sessionDescription, RTCSessionDescription):
                 player = WebRTCPeer(request.remote)
 
@@ -99,11 +156,11 @@ class EDMOBackend:
                 if session is not None:
                     if hasOverrideID:
                         if not session.registerOverrider(
-                            player, int(data["overrideID"])
+                            player, int(data["overrideID"]), syncState
                         ):
                             return web.Response(status=401)
 
-                    elif not session.registerPlayer(player, username):
+                    elif not session.registerPlayer(player, username, syncState):
                         return web.Response(status=401)
 
                 answer = await player.initiateConnection(sessionDescription)
@@ -112,26 +169,6 @@ class EDMOBackend:
 
         return ws
 
-    async def update(self):
-        """Standard update loop to be performed at most 10 times a second"""
-        # Update the serial stuff
-        serialUpdateTask = asyncio.create_task(self.fusedCommunication.update())
-
-        # Update all sessions
-        sessionUpdates = []
-
-        for sessionID in self.activeSessions:
-            session = self.activeSessions[sessionID]
-            sessionUpdates.append(asyncio.create_task(session.update()))
-
-        # Ensure that the update cycle runs at most 10 times a second
-        minUpdateDuration = asyncio.create_task(asyncio.sleep(0.1))
-
-        await serialUpdateTask
-        if len(sessionUpdates) > 0:
-            await asyncio.wait(sessionUpdates)
-        await minUpdateDuration
-
     # region ENDPOINT HANDLERS
 
     async def getActiveEDMOs(self, _: web.Request):
@@ -142,9 +179,10 @@ class EDMOBackend:
 
     # This returns the available sessions and their capacities in a json list
     async def getActiveSessions(self, request: web.Request):
-        return web.json_response(
-            [self.activeSessions[s].getSessionInfo() for s in self.activeSessions]
-        )
+        # Each session keeps its info serialized until it changes, only the list around them is built here
+        sessions = [self.activeSessions[s].getSessionInfoJson() for s in self.activeSessions]
+
+        return web.Response(body=b"[" + b",".join(sessions) + b"]", content_type="application/json")
 
     async def getSessionInfo(self, request: web.Request) -> web.Response:
         identifier = request.match_info["identifier"]
@@ -152,7 +190,51 @@ class EDMOBackend:
         if identifier not in self.activeSessions:
             return web.Response(status=404)
 
-        return web.json_response(self.activeSessions[identifier].getDetailedInfo())
+        return web.Response(
+            body=self.activeSessions[identifier].getDetailedInfoJson(), content_type="application/json"
+        )
+
+    async def getSessionStats(self, request: web.Request) -> web.Response:
+        identifier = request.match_info["identifier"]
+
+        if identifier not in self.activeSessions:
+            return web.Response(status=404)
+
+        stats = self.activeSessions[identifier].getTelemetryStats()
+
+        # The session's own timer, to tell which session is slow (/metrics adds every session together)
+        timer = self.sessionTimers.get(identifier)
+        stats["timer"] = timer.stats() if timer is not None else None
+
+        return web.json_response(stats)
+
+    async def streamTelemetry(self, request: web.Request):
+        """Streams the live telemetry of a session over a Websocket. Use ?decimation=n to only receive every nth sample."""
+        identifier = request.match_info["identifier"]
+
+        if identifier not in self.activeSessions:
+            return web.Response(status=404)
+
+        try:
+            decimation = int(request.query.get("decimation", 1))
+        except ValueError:
+            return web.Response(status=400)
+
+        if decimation < 1:
+            return web.Response(status=400)
+
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+
+        await self.activeSessions[identifier].telemetryStream.serve(ws, decimation)
+
+        return ws
+
+    async def getMetrics(self, _: web.Request) -> web.Response:
+        return web.Response(
+            body=Metrics.render(self.collectMetrics),
+            headers={"Content-Type": Metrics.CONTENT_TYPE},
+        )
 
     async def sendFeedback(self, request: web.Request) -> web.Response:
         identifier = request.match_info["identifier"]
@@ -250,6 +332,14 @@ class EDMOBackend:
         app.router.add_route("GET", "/edmos", self.getActiveEDMOs)
         app.router.add_route("GET", "/sessions", self.getActiveSessions)
         app.router.add_route("GET", "/sessions/{identifier}", self.getSessionInfo)
+        app.router.add_route(
+            "GET", "/sessions/{identifier}/stats", self.getSessionStats
+        )
+        app.router.add_route(
+            "GET", "/sessions/{identifier}/telemetry", self.streamTelemetry
+        )
+
+        app.router.add_route("GET", "/metrics", self.getMetrics)
 
         app.router.add_route("PUT", "/simpleView", self.setSimpleView)
         app.router.add_route("GET", "/simpleView", self.getSimpleView)
@@ -273,11 +363,11 @@ class EDMOBackend:
 
         await self.fusedCommunication.initialize()
 
-        closed = False
+        self.discoveryTimer.start()
 
         try:
-            while not closed:
-                await self.update()
+            # Discovery and sessions are updated by their own timers from here on
+            await asyncio.Event().wait()
         except (asyncio.exceptions.CancelledError, KeyboardInterrupt):
             pass
         finally:
@@ -288,10 +378,16 @@ class EDMOBackend:
 
         print("Cleaning up")
         """Shuts down existing connections gracefully to prevent a minor deadlock when shutting down the server"""
+        self.discoveryTimer.stop()
+        for timer in self.sessionTimers.values():
+            timer.stop()
+
         self.fusedCommunication.close()
         for s in [sess for sess in self.activeSessions]:
-            session = self.activeSessions[s]
-            await session.close()
+            # Closing a session disconnects its players, which may remove (and close) other sessions in the meantime
+            session = self.activeSessions.get(s)
+            if session is not None:
+                await session.close()
         pass
 
 
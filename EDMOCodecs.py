@@ -0,0 +1,216 @@
+import struct
+from typing import Any, Callable
+
+from EDMOCommands import EDMOCommand, EDMOCommands
+
+
+class MotorState:
+    """The state of a single motor, as reported by the EDMO"""
+
+    __slots__ = ("motor", "frequency", "amplitude", "offset", "phaseShift", "phase")
+
+    VALUE_NAMES = ("frequency", "amplitude", "offset", "phaseShift", "phase")
+
+    def __init__(
+        self,
+        motor: int,
+        frequency: float,
+        amplitude: float,
+        offset: float,
+        phaseShift: float,
+        phase: float,
+    ):
+        self.motor = motor
+        self.frequency = frequency
+        self.amplitude = amplitude
+        self.offset = offset
+        self.phaseShift = phaseShift
+        self.phase = phase
+
+    def values(self):
+        return (self.frequency, self.amplitude, self.offset, self.phaseShift, self.phase)
+
+    def __str__(self):
+        return f"Frequency: {self.frequency}, Amplitude: {self.amplitude}, Offset: {self.offset}, Phase Shift: {self.phaseShift}, Phase: {self.phase}"
+
+
+class ImuReading:
+    """A single reading of one of the IMU sensors"""
+
+    __slots__ = ("time", "status", "value")
+
+    def __init__(self, time: int, status: int, value: tuple[float, ...]):
+        self.time = time
+        self.status = status
+        self.value = value
+
+    def __str__(self):
+        x, y, z, *w = self.value
+        value = f"{x},{y},{z}" if not w else f"{x},{y},{z}, {w[0]}"
+
+        return f"{{Time: {self.time}, Status: {self.status}, Value: ({value})}}"
+
+
+class ImuSample:
+    """The readings of every IMU sensor, as reported by the EDMO"""
+
+    __slots__ = ("acceleration", "gyroscope", "magnetic", "gravity", "rotation")
+
+    VALUE_NAMES = tuple(
+        f"{sensor}_{component}"
+        for sensor in __slots__
+        for component in ("xyzw" if sensor == "rotation" else "xyz")
+    )
+
+    def __init__(
+        self,
+        acceleration: ImuReading,
+        gyroscope: ImuReading,
+        magnetic: ImuReading,
+        gravity: ImuReading,
+        rotation: ImuReading,
+    ):
+        self.acceleration = acceleration
+        self.gyroscope = gyroscope
+        self.magnetic = magnetic
+        self.gravity = gravity
+        self.rotation = rotation
+
+    def values(self):
+        """The values of every sensor, without the time and status of the readings"""
+        return (
+            self.acceleration.value
+            + self.gyroscope.value
+            + self.magnetic.value
+            + self.gravity.value
+            + self.rotation.value
+        )
+
+    def __str__(self):
+        return f"{{Acceleration: {self.acceleration},Gyroscope: {self.gyroscope},Magnetic: {self.magnetic},Gravity: {self.gravity}, Rotation: {self.rotation}}}"
+
+
+class AllData:
+    """The state of all motors and the IMU, as reported by the EDMO at a single point in time"""
+
+    __slots__ = ("time", "motors", "imu")
+
+    def __init__(self, time: int, motors: tuple[MotorState, ...], imu: ImuSample):
+        self.time = time
+        self.motors = motors
+        self.imu = imu
+
+
+class EDMOCodec:
+    """Decodes the data of a command into a typed record, using a precompiled struct"""
+
+    __slots__ = ("name", "fields", "struct", "build")
+
+    def __init__(
+        self, name: str, fields: list[tuple[str, str]], build: Callable[[tuple], Any]
+    ):
+        self.name = name
+        self.fields = fields
+        self.struct = struct.Struct("<" + "".join(format for _, format in fields))
+        self.build = build
+
+    def decode(self, data: bytes | memoryview):
+        return self.build(self.struct.unpack(data))
+
+    def layout(self):
+        """The name, struct format and byte offset of every field, excluding padding"""
+        offset = 0
+        layout = list[tuple[str, str, int]]()
+
+        for name, format in self.fields:
+            if name != "":
+                layout.append((name, format, offset))
+
+            offset += struct.calcsize("<" + format)
+
+        return layout
+
+
+# Layout of the individual parts of the EDMO packets
+# Each motor is reported as frequency, amplitude, offset, phase shift and phase
+# Each IMU sensor is reported as time, status and a 3 component value (4 for rotation)
+MOTOR_COUNT = 4
+MOTOR_FIELD_COUNT = 5
+
+IMU_SENSORS = ("acceleration", "gyroscope", "magnetic", "gravity", "rotation")
+
+
+def motorFields(prefix: str = ""):
+    return [
+        (f"{prefix}frequency", "f"),
+        (f"{prefix}amplitude", "f"),
+        (f"{prefix}offset", "f"),
+        (f"{prefix}phaseShift", "f"),
+        (f"{prefix}phase", "f"),
+    ]
+
+
+def imuFields():
+    fields = list[tuple[str, str]]()
+
+    for sensor in IMU_SENSORS:
+        components = "xyzw" if sensor == "rotation" else "xyz"
+
+        fields += [(f"{sensor}_time", "L"), (f"{sensor}_status", "B"), ("", "3x")]
+        fields += [(f"{sensor}_{component}", "f") for component in components]
+
+    return fields
+
+
+def buildImuSample(fields: tuple, start: int = 0):
+    return ImuSample(
+        ImuReading(fields[start], fields[start + 1], fields[start + 2 : start + 5]),
+        ImuReading(fields[start + 5], fields[start + 6], fields[start + 7 : start + 10]),
+        ImuReading(fields[start + 10], fields[start + 11], fields[start + 12 : start + 15]),
+        ImuReading(fields[start + 15], fields[start + 16], fields[start + 17 : start + 20]),
+        ImuReading(fields[start + 20], fields[start + 21], fields[start + 22 : start + 26]),
+    )
+
+
+def buildAllData(fields: tuple):
+    motors = tuple(
+        MotorState(i, *fields[1 + MOTOR_FIELD_COUNT * i : 1 + MOTOR_FIELD_COUNT * (i + 1)])
+        for i in range(MOTOR_COUNT)
+    )
+
+    return AllData(
+        fields[0], motors, buildImuSample(fields, 1 + MOTOR_FIELD_COUNT * MOTOR_COUNT)
+    )
+
+
+CODECS: dict[int, EDMOCodec] = {
+    EDMOCommands.GET_TIME: EDMOCodec("Time", [("time", "L")], lambda fields: fields[0]),
+    EDMOCommands.SEND_MOTOR_DATA: EDMOCodec(
+        "MotorState",
+        [("motor", "B")] + motorFields(),
+        lambda fields: MotorState(*fields),
+    ),
+    EDMOCommands.SEND_IMU_DATA: EDMOCodec("ImuSample", imuFields(), buildImuSample),
+    EDMOCommands.SEND_ALL_DATA: EDMOCodec(
+        "AllData",
+        [("time", "L")]
+        + [field for i in range(MOTOR_COUNT) for field in motorFields(f"motor{i}_")]
+        + imuFields(),
+        buildAllData,
+    ),
+}
+
+
+def decode(command: EDMOCommand):
+    """
+    Decodes the data of a command into its typed record.
+
+    None is returned if the command doesn't carry data, or if the data doesn't match the expected layout.
+    """
+
+    codec = CODECS.get(command.Instruction)
+
+    if codec is None or len(command.Data) != codec.struct.size:
+        return None
+
+    return codec.decode(command.Data)
@@ -1,5 +1,24 @@
+import re
 from attr import dataclass
 
+from Utilities import Metrics
+
+# Shared by every kind of link, each link counts under its own label
+LINK_PACKETS_RECEIVED = Metrics.counter(
+    "edmo_link_packets_received_total", "Packets received from EDMOs", ("link",)
+)
+LINK_PACKETS_SENT = Metrics.counter(
+    "edmo_link_packets_sent_total", "Packets sent to EDMOs", ("link",)
+)
+
+PACKET_ERRORS = Metrics.counter(
+    "edmo_packet_errors_total", "Packets from EDMOs that were discarded or damaged", ("reason",)
+)
+MALFORMED_PACKETS = PACKET_ERRORS.labels("malformed")
+UNKNOWN_INSTRUCTIONS = PACKET_ERRORS.labels("unknown_instruction")
+DANGLING_ESCAPES = PACKET_ERRORS.labels("dangling_escape")
+INCOMPLETE_PACKETS = PACKET_ERRORS.labels("incomplete")
+
 
 class EDMOCommands:
     (
@@ -9,51 +28,96 @@ class EDMOCommands:
         UPDATE_OSCILLATOR,
         SEND_MOTOR_DATA,
         SEND_IMU_DATA,
-    ) = range(6)
+        UPDATE_ALL_OSCILLATORS,
+    ) = range(7)
 
     SEND_ALL_DATA = 69
     INVALID = -1
 
     @classmethod
     def sanitize(cls, instruction: int):
-        if instruction not in range(6) and instruction != cls.SEND_ALL_DATA:
+        if instruction not in range(7) and instruction != cls.SEND_ALL_DATA:
             return cls.INVALID
 
         return instruction
 
 
+class EDMOCapabilities:
+    """Optional features that an EDMO advertises in its response to IDENTIFY"""
+
+    NONE = 0
+    BATCHED_OSCILLATORS = 1 << 0
+
+    @classmethod
+    def parseIdentity(cls, data: bytes | memoryview) -> tuple[str, int]:
+        """
+        Splits the data of an IDENTIFY response into the identifier and the capabilities of the EDMO.
+
+        The identifier may be followed by a null byte and a capability bitmask. EDMOs that don't send one have no optional capabilities.
+        """
+
+        identifier, _, capabilities = bytes(data).partition(b"\0")
+
+        return identifier.decode(), capabilities[0] if capabilities else cls.NONE
+
+
 @dataclass
 class EDMOCommand:
     Instruction: int
-    Data: bytes
+    Data: bytes | memoryview
 
 
 class EDMOPacket:
     HEADER = b"ED"
     FOOTER = b"MO"
+    ESCAPE = b"\\"
+
+    # The first byte of every sequence that needs escaping
+    ESCAPE_SENSITIVE_BYTES = (ESCAPE[0], HEADER[0], FOOTER[0])
+
+    # Matches an escape character, along with the (optional) byte it escapes
+    ESCAPE_PATTERN = re.compile(rb"\\(.?)", re.DOTALL)
+
+    # Packets without any data never change, so they only need to be created once
+    _constantPackets: dict[int, bytes] = {}
 
     @classmethod
-    def create(cls, *args: bytes | int) -> bytes:
+    def create(cls, *args: bytes | memoryview | int) -> bytes:
         """
         Creates a command packet, escaping the data bytes in the process.
         """
 
-        output = bytearray()
-        output.extend(cls.HEADER)
+        data = b"".join(
+            bytes((arg,)) if isinstance(arg, int) else arg for arg in args
+        )
+
+        return cls.frame(data)
+
+    @classmethod
+    def frame(cls, data: bytes | bytearray) -> bytes:
+        """
+        Wraps already serialized command data into a packet. Escaping is skipped if the data doesn't contain any escape sensitive bytes.
+        """
+
+        # Looking for single bytes is much cheaper than looking for the sequences themselves
+        # Data that doesn't contain any of them can't contain a sequence that needs escaping
+        escape, header, footer = cls.ESCAPE_SENSITIVE_BYTES
+        if escape in data or header in data or footer in data:
+            data = cls.escape(data)
 
-        data = bytearray()
-        for arg in args:
-            if isinstance(arg, int):
-                data.append(arg)
-            elif isinstance(arg, bytes):
-                data.extend(arg)
+        return b"".join((cls.HEADER, data, cls.FOOTER))
 
-        data = cls.escape(data)
+    @classmethod
+    def constant(cls, instruction: int) -> bytes:
+        """
+        Returns the cached packet for an instruction that doesn't carry any data.
+        """
 
-        output.extend(data)
-        output.extend(cls.FOOTER)
+        packet = cls._constantPackets.get(instruction)
+        if packet is None:
+            packet = cls._constantPackets[instruction] = cls.create(instruction)
 
-        return bytes(output)
+        return packet
 
     @classmethod
     def fromCommand(cls, command: EDMOCommand):
@@ -65,18 +129,35 @@ class EDMOPacket:
         Attempts to parse a command packet, checking command validity and unescaping the data in the process.
         """
 
-        if not packet.startswith(cls.HEADER) or not packet.endswith(cls.FOOTER):
-            return EDMOCommand(EDMOCommands.INVALID, None)  # type:ignore
+        if (
+            len(packet) < 5
+            or not packet.startswith(cls.HEADER)
+            or not packet.endswith(cls.FOOTER)
+        ):
+            MALFORMED_PACKETS.inc()
+            return EDMOCommand(EDMOCommands.INVALID, b"")
+
+        instruction = EDMOCommands.sanitize(packet[2])
+        if instruction == EDMOCommands.INVALID:
+            UNKNOWN_INSTRUCTIONS.inc()
 
-        command = packet[2:-2]
+        # Most packets don't contain any escaped bytes
+        # In that case the data can be used as is, without copying it out of the packet
+        if packet.find(cls.ESCAPE, 3, -2) < 0:
+            data = memoryview(packet)[3:-2]
+        else:
+            escaped = packet[3:-2]
 
-        instruction = EDMOCommands.sanitize(command[0])
-        data = cls.unescape(command[1:])
+            # An escape character at the very end doesn't escape anything, the packet was damaged on the way
+            if (len(escaped) - len(escaped.rstrip(cls.ESCAPE))) % 2 == 1:
+                DANGLING_ESCAPES.inc()
+
+            data = cls.unescape(escaped)
 
         return EDMOCommand(instruction, data)
 
     @classmethod
-    def escape(cls, data: bytearray):
+    def escape(cls, data: bytes | bytearray):
         """
         This method escapes an arbitrary datastream to avoid ED and MO appearing within the stream, and being parsed as the communication header and footer
 
@@ -94,16 +175,58 @@ class EDMOPacket:
         This method unescapes an escaped datastream by removing backslashes used to escape the data.
         """
 
-        unescaped = bytearray()
+        return cls.ESCAPE_PATTERN.sub(rb"\1", data)
+
+
+class EDMOPacketDecoder:
+    """
+    Incrementally extracts complete packets from a stream of bytes.
+
+    Chunks can be fed in as they arrive, partial packets are retained until the rest of the packet is received.
+    This is used for stream based communication (Serial), but works for any source of bytes.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.receivingData = False
+
+    def feed(self, data: bytes) -> list[bytes]:
+        """Adds a chunk of data to the decoder, returning every packet that is completed by it."""
+        packets = list[bytes]()
+        buffer = self.buffer
+        buffer.extend(data)
+
+        header = EDMOPacket.HEADER
+        footer = EDMOPacket.FOOTER
+
+        while True:
+            if not self.receivingData:
+                start = buffer.find(header)
+
+                # No header present, we only need to hold onto the final byte
+                #  as it may be the first half of a header in the next chunk
+                if start < 0:
+                    del buffer[:-1]
+                    return packets
+
+                del buffer[:start]
+                self.receivingData = True
+
+            end = buffer.find(footer, 2)
 
-        i = 0
-        while i < len(data):
-            if data[i] == int.from_bytes(b"\\"):
-                i += 1
-                if i >= len(data):
-                    break
+            # A header received before the footer means that the previous packet was incomplete
+            # We discard the partial packet, and start over from the new header
+            restart = buffer.find(header, 2, len(buffer) if end < 0 else end + 1)
+            if restart >= 0:
+                INCOMPLETE_PACKETS.inc()
+                del buffer[:restart]
+                continue
 
-            unescaped.append(data[i])
-            i += 1
+            # As long as we haven't received the footer, we will not proceed
+            if end < 0:
+                return packets
 
-        return unescaped
+            end += len(footer)
+            packets.append(bytes(buffer[:end]))
+            del buffer[:end]
+            self.receivingData = False
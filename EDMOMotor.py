@@ -4,29 +4,44 @@ from EDMOCommands import EDMOCommands, EDMOPacket
 
 
 class EDMOMotor:
+    OSCILLATOR_STRUCT = struct.Struct("<Bffff")
+
+    # The parameters of a single motor within a batched oscillator command
+    BATCHED_OSCILLATOR_STRUCT = struct.Struct("<ffff")
+
     def __init__(self, id: int) -> None:
         self._amp: float = 0
         self._offset: float = 90
         self._freq: float = 0
         self._phaseShift: float = 0
         self._id = id
+
+        # The oscillator command is packed into the same buffer every time
+        # The resulting packet is cached until one of the parameters change
+        self._commandBuffer = bytearray(1 + self.OSCILLATOR_STRUCT.size)
+        self._commandBuffer[0] = EDMOCommands.UPDATE_OSCILLATOR
+        self._command: bytes | None = None
+
+        # Whether the parameters changed since the oscillator command was last sent
+        self.dirty = True
         pass
 
     def adjustFrom(self, input: str):
         """Takes an input str, and adjusts the parameters of the associated motor"""
         splits = input.split(" ")
-        command = splits[0].lower()
-        value = float(splits[1])
+        self.adjust(splits[0].lower(), float(splits[1]))
 
-        match (command):
+    def adjust(self, parameter: str, value: float):
+        """Sets a parameter by the name players use for it, unknown parameters are ignored"""
+        match (parameter):
             case "amp":
-                self._amp = value
+                self.amplitude = value
             case "off":
-                self._offset = value
+                self.offset = value
             case "freq":
-                self._freq = value
+                self.frequency = value
             case "phb":
-                self._phaseShift = value
+                self.phaseShift = value
             case _:
                 pass
 
@@ -34,17 +49,88 @@ class EDMOMotor:
     def motorNumber(self):
         return self._id
 
+    @property
+    def amplitude(self):
+        return self._amp
+
+    @amplitude.setter
+    def amplitude(self, value: float):
+        if self._amp != value:
+            self._amp = value
+            self.parametersChanged()
+
+    @property
+    def offset(self):
+        return self._offset
+
+    @offset.setter
+    def offset(self, value: float):
+        if self._offset != value:
+            self._offset = value
+            self.parametersChanged()
+
+    @property
+    def frequency(self):
+        return self._freq
+
+    @frequency.setter
+    def frequency(self, value: float):
+        if self._freq != value:
+            self._freq = value
+            self.parametersChanged()
+
+    @property
+    def phaseShift(self):
+        return self._phaseShift
+
+    @phaseShift.setter
+    def phaseShift(self, value: float):
+        if self._phaseShift != value:
+            self._phaseShift = value
+            self.parametersChanged()
+
+    def parametersChanged(self):
+        self._command = None
+        self.dirty = True
+
     def __str__(self):
         return f"EDMOMotor(id={self._id}, frequency={self._freq},  amplitude={self._amp}, offset={self._offset}, phaseShift={self._phaseShift})"
 
     def asCommand(self):
-        command = struct.pack(
-            "<Bffff",
-            self._id,
-            self._freq,
-            self._amp,
-            self._offset,
-            self._phaseShift,
-        )
-
-        return EDMOPacket.create(EDMOCommands.UPDATE_OSCILLATOR, command)
+        if self._command is None:
+            self.OSCILLATOR_STRUCT.pack_into(
+                self._commandBuffer,
+                1,
+                self._id,
+                self._freq,
+                self._amp,
+                self._offset,
+                self._phaseShift,
+            )
+
+            self._command = EDMOPacket.frame(self._commandBuffer)
+
+        return self._command
+
+    @classmethod
+    def asBatchedCommand(cls, motors: list["EDMOMotor"]):
+        """
+        Creates a single command that carries the parameters of all the given motors, in the order they are given.
+        The EDMO applies the parameters to its motors by position, so the motors must be ordered by their ids.
+        """
+        size = cls.BATCHED_OSCILLATOR_STRUCT.size
+        buffer = bytearray(2 + size * len(motors))
+        buffer[0] = EDMOCommands.UPDATE_ALL_OSCILLATORS
+        buffer[1] = len(motors)
+
+        for i, motor in enumerate(motors):
+            cls.BATCHED_OSCILLATOR_STRUCT.pack_into(
+                buffer,
+                2 + size * i,
+                motor._freq,
+                motor._amp,
+                motor._offset,
+                motor._phaseShift,
+            )
+
+        return EDMOPacket.frame(buffer)
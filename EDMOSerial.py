@@ -6,7 +6,18 @@ from serial.tools.list_ports import comports
 from serial_asyncio import SerialTransport
 from typing import Self
 
-from EDMOCommands import EDMOCommand, EDMOCommands, EDMOPacket
+from EDMOCommands import (
+    EDMOCapabilities,
+    EDMOCommand,
+    EDMOCommands,
+    EDMOPacket,
+    EDMOPacketDecoder,
+    LINK_PACKETS_RECEIVED,
+    LINK_PACKETS_SENT,
+)
+
+PACKETS_RECEIVED = LINK_PACKETS_RECEIVED.labels("serial")
+PACKETS_SENT = LINK_PACKETS_SENT.labels("serial")
 
 
 class SerialProtocol(asyncio.Protocol):
@@ -16,19 +27,22 @@ class SerialProtocol(asyncio.Protocol):
         self.identifying = True
         self.receivedData = list[bytes]()
         self.identifier = ""
+        self.capabilities = EDMOCapabilities.NONE
         self.closed = False
         self.device = ""
 
-        self.receivingData = False
-        self.receiveBuffer = bytearray()
+        self.decoder = EDMOPacketDecoder()
 
         self.onMessageReceived: Optional[Callable[[EDMOCommand], None]] = None
 
+        # Every packet as it was received, before it is parsed (used for capturing the link)
+        self.onPacketReceived: Optional[Callable[[bytes], None]] = None
+
     def connection_made(self, transport: SerialTransport):  # type: ignore
         self.transport = transport
 
         # Send out the identification command
-        transport.write(EDMOPacket.create(EDMOCommands.IDENTIFY))
+        transport.write(EDMOPacket.constant(EDMOCommands.IDENTIFY))
 
         print("port opened: ", transport)
 
@@ -37,45 +51,25 @@ class SerialProtocol(asyncio.Protocol):
             callback(self)
 
     def data_received(self, data):
-        for i in range(0, len(data)):
-            self.receiveBuffer.append(data[i])
-
-            # Do we have a header?
-            if len(self.receiveBuffer) >= 2 and self.receiveBuffer.endswith(
-                EDMOPacket.HEADER
-            ):
-                self.receiveBuffer = self.receiveBuffer[:2]
-                self.receivingData = True
-
-            # If we aren't actively receiving data, then we actually don't have to do anything with the data that comes in
-            if not self.receivingData:
-                # Make discard every two bytes to ensure we don't overflow the buffer
-                # (We need at least two bytes to determine if a header is received)
-                if len(self.receiveBuffer) >= 2:
-                    self.receiveBuffer = bytearray()
-                continue
-
-            # As long as we haven't received the data, we will not proceed with parsing
-            if not self.receiveBuffer.endswith(EDMOPacket.FOOTER):
-                continue
-
-            # Data transmission successful at this point
-            # Relinquish control to packet handler
-            self.receivingData = False
-
-            self.handlePacket(bytes(self.receiveBuffer))
-            self.receiveBuffer = bytearray()
+        for packet in self.decoder.feed(data):
+            self.handlePacket(packet)
 
     def handlePacket(self, data: bytes):
+        PACKETS_RECEIVED.inc()
         command = EDMOPacket.tryParse(data)
 
         if self.identifying:
             if command.Instruction == EDMOCommands.IDENTIFY:
-                self.identifier = command.Data.decode()
+                self.identifier, self.capabilities = EDMOCapabilities.parseIdentity(
+                    command.Data
+                )
                 self.identifying = False
                 self.deviceIdentified()
             return
 
+        if self.onPacketReceived is not None:
+            self.onPacketReceived(data)
+
         if self.onMessageReceived is not None:
             self.onMessageReceived(command)
 
@@ -108,6 +102,7 @@ class SerialProtocol(asyncio.Protocol):
         if self.closed:
             return
 
+        PACKETS_SENT.inc()
         self.transport.write(data)
 
     def close(self):
@@ -121,6 +116,9 @@ class EDMOSerial:
     onConnect: list[Callable[[SerialProtocol], None]] = []
     onDisconnect: list[Callable[[SerialProtocol], None]] = []
 
+    # Devices that are connected to in addition to the detected ports, such as the pseudo terminals of a simulator (see Simulator.py)
+    EXTRA_PORTS: list[str] = []
+
     def __init__(self):
         pass
 
@@ -128,7 +126,8 @@ class EDMOSerial:
         await self.searchForConnections()
 
     async def searchForConnections(self):
-        ports: list[ListPortInfo] = comports(True)  # type: ignore
+        # Scanning the ports can be slow, so it is done off the event loop
+        ports: list[ListPortInfo] = await asyncio.to_thread(comports, True)  # type: ignore
 
         connectionTasks = []
 
@@ -137,15 +136,18 @@ class EDMOSerial:
             # This can be expanded if we ever use other boards
             if ("USB" in port.description) or (port.description == "Feather M0"):
                 connectionTasks.append(
-                    asyncio.create_task(self.initializeConnection(port))
+                    asyncio.create_task(self.initializeConnection(port.device))
                 )
 
+        for device in self.EXTRA_PORTS:
+            connectionTasks.append(asyncio.create_task(self.initializeConnection(device)))
+
         if len(connectionTasks) > 0:
             await asyncio.wait(connectionTasks)
 
-    async def initializeConnection(self, port: ListPortInfo):
+    async def initializeConnection(self, device: str):
         # This device is still being used, we don't need to init
-        if port.device in self.devices:
+        if device in self.devices:
             return
 
         # This creates a serial connection for the port
@@ -153,7 +155,7 @@ class EDMOSerial:
         # SerialProtocol contains the general management code
         loop = asyncio.get_event_loop()
         _, protocol = await serial_asyncio.create_serial_connection(
-            loop, SerialProtocol, port.device, baudrate=115200
+            loop, SerialProtocol, device, baudrate=115200
         )
 
         # For typing purposes, no actual effect
@@ -161,8 +163,8 @@ class EDMOSerial:
 
         # We need to keep track of the device used
         #  so we don't create a new connection later
-        serialProtocol.device = port.device
-        self.devices[port.device] = serialProtocol
+        serialProtocol.device = device
+        self.devices[device] = serialProtocol
 
         serialProtocol.disconnectCallbacks.append(self.onConnectionLost)
         serialProtocol.connectionCallbacks.append(self.onConnectionEstablished)
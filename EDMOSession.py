@@ -6,21 +6,51 @@ import heapq
 import itertools
 import json
 import struct
+import time
 from typing import TYPE_CHECKING, Callable, Self
 
-from EDMOCommands import EDMOCommand, EDMOCommands, EDMOPacket
+import EDMOCodecs
+from EDMOCodecs import AllData, ImuSample, MotorState
+from EDMOCommands import EDMOCapabilities, EDMOCommand, EDMOCommands, EDMOPacket
 from EDMOMotor import EDMOMotor
 from FusedCommunication import FusedCommunicationProtocol
+from LatencyTrace import LatencyTracer
 
+import LinkCapture
+import PlayerProtocol
 from Logger import SessionLogger
+from PlayerProtocol import Document, Flag, LegacyText, Number, Parameter, PlayerMessage, Players
+from SessionState import SessionState
+from TelemetryBus import TelemetryBus
+from TelemetryStream import TelemetryStream
+from Utilities import Metrics
 from Utilities.Helpers import removeIfExist
+from Utilities.RingBuffer import RingBuffer
+from Utilities.Versioned import Versioned
 from WebRTCPeer import WebRTCPeer
 
 if TYPE_CHECKING:
     from EDMOSession import EDMOSession
 
+PLAYER_INPUTS = Metrics.counter(
+    "edmo_player_inputs_total", "Slider messages received from players"
+).labels()
+COALESCED_INPUTS = Metrics.counter(
+    "edmo_player_inputs_coalesced_total", "Slider messages replaced by a later value before they were applied"
+).labels()
+
+OSCILLATOR_UPDATES = Metrics.counter(
+    "edmo_oscillator_updates_total", "Motor oscillator updates, sent or suppressed because the motor didn't change", ("result",)
+)
+OSCILLATOR_UPDATES_SENT = OSCILLATOR_UPDATES.labels("sent")
+OSCILLATOR_UPDATES_SUPPRESSED = OSCILLATOR_UPDATES.labels("suppressed")
+
 class EDMOPlayer:
-    def __init__(self, rtcPeer: WebRTCPeer, name: str,  edmoSession: "EDMOSession"):
+    LOG_CHANNEL = "Input_Player"
+    CAPTURE_KIND = LinkCapture.PLAYER_INPUT
+    BINARY_CAPTURE_KIND = LinkCapture.PLAYER_BINARY_INPUT
+
+    def __init__(self, rtcPeer: WebRTCPeer, name: str,  edmoSession: "EDMOSession", syncState: bool = False):
         self.rtc = rtcPeer
         self.session = edmoSession
 
@@ -30,35 +60,63 @@ class EDMOPlayer:
 
         self.name = name
 
+        # Whether the client receives the session state as a snapshot and deltas (see SessionState), rather than a message per change
+        self.syncState = syncState
+
         rtcPeer.onMessage.append(self.onMessage)
         rtcPeer.onConnectCallbacks.append(self.onConnect)
         rtcPeer.onDisconnectCallbacks.append(self.onDisconnect)
 
-    def onMessage(self, message: str):
-        self.session.sessionLog.write(f"Input_Player{self.number}", message=message)
-        parts = message.split(" ")
-        if(parts[0] == "vote"):
-            self.voted = (int(parts[1]) == 1)
-            self.session.broadcastPlayerList()
+    def onMessage(self, message: str | bytes):
+        if isinstance(message, bytes):
+            self.session.captureEvent(self.BINARY_CAPTURE_KIND, self.number, message)
+            decoded = PlayerProtocol.decode(message)
+
+            if decoded is None:
+                self.session.sessionLog.write(f"{self.LOG_CHANNEL}{self.number}", message=f"Unknown message {message.hex()}")
+                return
+
+            command, value = decoded
+        else:
+            self.session.captureEvent(self.CAPTURE_KIND, self.number, message)
+            parts = message.split(" ")
+            command = parts[0]
+
+            if command not in PlayerProtocol.COMMANDS:
+                self.session.sessionLog.write(f"{self.LOG_CHANNEL}{self.number}", message=message)
+                return
+
+            # A sync without a version asks for a snapshot
+            value = float(parts[1]) if len(parts) > 1 else -1
+
+        if command == "sync":
+            self.session.resync(self, int(value))
             return
-    
-        if(parts[0] == "freq"):
-            self.session.setFreq(float(parts[1]))
+
+        # Slider input is collected by the session, and applied along with the rest of the input of this tick
+        if command in PlayerProtocol.PARAMETERS:
+            self.session.queueInput(self, command, value)
             return
-        
-        if(parts[0] == "phb"):
-            self.session.setPhb(self.number, float(parts[1]))
 
-        self.session.updateMotor(self.number, message)
-                
-        for c in [c for c in  self.session.activeOverriders if c.number == self.number and c != self]:
-            self.session.sendMotorParams(c)
+        self.session.sessionLog.write(f"{self.LOG_CHANNEL}{self.number}", message=f"vote {int(value)}")
+        self.voted = (int(value) == 1)
+        self.session.playerList.changed()
+        self.session.broadcastPlayerList()
+
+    def parameterRecipients(self):
+        """The others that are shown the parameters of our motor when we change them"""
+        return [c for c in self.session.activeOverriders if c.number == self.number and c != self]
 
-    def sendMessage(self, message: str):
+    def sendMessage(self, message: str | PlayerMessage):
         try:
             self.rtc.send(message)
         except (Exception):
             asyncio.create_task(self.rtc.close())
+
+    def sendState(self, message: PlayerMessage):
+        """Sends a change of the session state, unless the client is kept up to date with deltas instead"""
+        if not self.syncState:
+            self.sendMessage(message)
     
 
     def onConnect(self):
@@ -68,9 +126,9 @@ class EDMOPlayer:
         self.session.playerDisconnected(self)
 
     def assignNumber(self, number: int):
-        self.rtc.send(f"sys.number {number}")
+        self.rtc.send(LegacyText(f"sys.number {number}"))
         self.number = number
-        self.sendMessage(f"ID {self.number}")
+        self.sendMessage(Number(self.number))
 
     def dict(self):
         dict = {}
@@ -85,37 +143,24 @@ class EDMOPlayer:
         return json.dumps(self.dict())
     
 class EDMOOveridePlayer(EDMOPlayer):
-    def __init__(self, rtcPeer: WebRTCPeer, id: int,  edmoSession: "EDMOSession"):
-        super().__init__( rtcPeer, "Overrider" , edmoSession)
-        self.assignNumber(id)
-
-    def onMessage(self, message: str):
-        self.session.sessionLog.write(f"Input_Override{self.number}", message=message)
-        parts = message.split(" ")
-        if(parts[0] == "vote"):
-            self.voted = (int(parts[1]) == 1)
-            self.session.broadcastPlayerList()
-            return
-    
-        if(parts[0] == "freq"):
-            self.session.setFreq(float(parts[1]))
-            return
-        
-        if(parts[0] == "phb"):
-            self.session.setPhb(self.number, float(parts[1]))
+    LOG_CHANNEL = "Input_Override"
+    CAPTURE_KIND = LinkCapture.OVERRIDER_INPUT
+    BINARY_CAPTURE_KIND = LinkCapture.OVERRIDER_BINARY_INPUT
 
-        self.session.updateMotor(self.number, message)
+    def __init__(self, rtcPeer: WebRTCPeer, id: int,  edmoSession: "EDMOSession", syncState: bool = False):
+        super().__init__( rtcPeer, "Overrider" , edmoSession, syncState)
+        self.assignNumber(id)
 
+    def parameterRecipients(self):
         combined = itertools.chain(self.session.activePlayers, self.session.activeOverriders)
-        for c in [c for c in combined if c.number == self.number and c != self]:
-            self.session.sendMotorParams(c)
+        return [c for c in combined if c.number == self.number and c != self]
 
     def onConnect(self):
         self.session.overriderConnected(self)
-        self.sendMessage(f"ID {self.number}")
+        self.sendMessage(Number(self.number))
 
     def onDisconnect(self):
-        self.session.playerDisconnected(self)
+        self.session.overriderDisconnected(self)
 
 
 class TaskEntry:
@@ -123,11 +168,77 @@ class TaskEntry:
         self.strings = strings
         self.completed = completed
 
+class PendingInput:
+    """The latest message that changed a parameter, waiting to be applied"""
+
+    __slots__ = ("sender", "value", "receivedAt", "count")
+
+    def __init__(self, sender: EDMOPlayer, value: float, receivedAt: float | None):
+        self.sender = sender
+        self.value = value
+
+        # When the first of the messages was received, which is how long the change has been waiting
+        self.receivedAt = receivedAt
+        self.count = 1
+
+def taskMessage(tasks: list[dict]):
+    return Document("TaskInfo", json.dumps(tasks))
+
+
+def helpEnabledMessage(value: bool):
+    return Flag("HelpEnabled", value)
+
+
+def simpleModeMessage(value: bool):
+    return Flag("SimpleMode", value)
+
+
+def encodeJson(value: object):
+    return json.dumps(value).encode()
+
+
 # flake8: noqa: F811
 class EDMOSession:
     TASK_LIST: list[dict[str, str]] | None = None
     MAX_PLAYER_COUNT = 4
 
+    # Only motors that changed are sent to the EDMO every update
+    # The state of every motor is still sent at this interval (in seconds), so that the EDMO converges even if a packet is lost
+    KEYFRAME_INTERVAL = 1.0
+
+    # When enabled, changed motors are sent to the EDMO as soon as a player adjusts them, instead of waiting for the next update
+    # Updates then only resend everything when a keyframe is due
+    IMMEDIATE_UPDATES = False
+
+    # The minimum time (in seconds) between two sends of changed motors to the EDMO
+    # Changes made in between are sent together once the interval has passed
+    MIN_SEND_INTERVAL = 0.1
+
+    # Telemetry reported by the EDMO is logged in a binary format
+    # Enabling this additionally logs it as text in the Motor and IMU channels
+    TEXT_TELEMETRY = False
+
+    # The number of recent samples kept in memory for each motor and the IMU, for the rolling telemetry statistics
+    TELEMETRY_BUFFER_SIZE = 1024
+
+    # Publishes telemetry into shared memory for analysis processes on the same machine (see TelemetryBus)
+    SHARED_MEMORY_TELEMETRY = False
+
+    # Records everything that crosses the link, along with the input of the players, so the session can be replayed (see LinkCapture)
+    CAPTURE_LINK = False
+
+    # The slider messages of players, of which only the latest value for each motor is applied every tick
+    # A slider sends many messages while it is dragged, applying them one by one only adds work and chatter
+    INPUT_PARAMETERS = PlayerProtocol.PARAMETERS
+    COALESCE_INPUT = True
+
+    # The frequency is shared, changing it changes every motor
+    ALL_MOTORS = -1
+
+    # One in this many player inputs is traced from the data channel to the EDMO's report of the motor (see LatencyTrace)
+    # Set to 0 to disable tracing
+    LATENCY_TRACE_INTERVAL = 16
+
     # A one time method to load task info from a file
     @classmethod
     def loadTasks(cls) -> dict[str, TaskEntry]:
@@ -159,6 +270,11 @@ class EDMOSession:
         sessionRemoval: Callable[[Self], None],
     ):
         self.sessionLog = SessionLogger(protocol.identifier)
+
+        if self.CAPTURE_LINK:
+            protocol.startCapture(
+                f"{self.sessionLog.directoryName}/Link.{LinkCapture.FILE_EXTENSION}"
+            )
         self.removeSelf = sessionRemoval
 
         self.usedNumbers = 0
@@ -179,25 +295,74 @@ class EDMOSession:
         self.helpEnabled = False
         self.simpleMode = True
 
+        # What players and dashboards are shown, rebuilt and serialized only after it changed
+        self.playerList = Versioned(lambda: [p.dict() for p in self.activePlayers])
+        self.taskList = Versioned(self.buildTasks)
+        self.helpState = Versioned(lambda: self.helpEnabled)
+        self.simpleState = Versioned(lambda: self.simpleMode)
+        self.sessionInfo = Versioned(self.buildSessionInfo, (self.playerList,))
+        self.detailedInfo = Versioned(self.buildDetailedInfo, (self.playerList, self.taskList, self.helpState))
+
+        self.keyframeRequested = True
+        self.lastKeyframeTime = 0.0
+        self.lastSendTime = 0.0
+        self.pendingSend: asyncio.TimerHandle | None = None
+        self.oscillatorUpdatesSent = 0
+        self.oscillatorUpdatesSuppressed = 0
+
+        # Slider input waiting to be applied, by motor and parameter
+        self.pendingInputs = dict[tuple[int, str], PendingInput]()
+        self.pendingApply: asyncio.Handle | None = None
+        self.inputsReceived = 0
+        self.inputsCoalesced = 0
+
         protocol.onConnectionEstablished = self.onEDMOReconnect
         self.onEDMOReconnect()
 
         # These motors represent the canonical state of the edmo robot
         self.motors = [EDMOMotor(i) for i in range(numberPlayers)]
+
+        # What players are shown, for the clients that sync it rather than receive a message per change
+        self.state = SessionState()
+        self.state.set("TaskInfo", self.getTasks())
+        self.state.set("HelpEnabled", self.helpEnabled)
+        self.state.set("SimpleMode", self.simpleMode)
+        self.state.set("PlayerInfo", [])
+
+        for motor in self.motors:
+            self.updateMotorState(motor)
+
+        # The most recent telemetry reported by the edmo
+        self.motorTelemetry = [
+            RingBuffer(MotorState.VALUE_NAMES, self.TELEMETRY_BUFFER_SIZE)
+            for _ in range(numberPlayers)
+        ]
+        self.imuTelemetry = RingBuffer(ImuSample.VALUE_NAMES, self.TELEMETRY_BUFFER_SIZE)
+
+        self.telemetryStream = TelemetryStream()
+        self.telemetryBus = (
+            TelemetryBus(protocol.identifier) if self.SHARED_MEMORY_TELEMETRY else None
+        )
+
+        self.latencyTracer = (
+            LatencyTracer(protocol.identifier, self.LATENCY_TRACE_INTERVAL)
+            if self.LATENCY_TRACE_INTERVAL > 0
+            else None
+        )
         pass
 
     # Registered players are not officially active yet
     # A registered player only becomes active when the connection is established
-    def registerPlayer(self, rtcPeer: WebRTCPeer, username: str):
+    def registerPlayer(self, rtcPeer: WebRTCPeer, username: str, syncState: bool = False):
         if(len(self.playerNumbers) == 0):
             return False
-        player = EDMOPlayer(rtcPeer, username, self)
+        player = EDMOPlayer(rtcPeer, username, self, syncState)
         self.waitingPlayers.append(player)
 
         return True
 
-    def registerOverrider(self, rtcPeer : WebRTCPeer, overrideID: int):
-        overrider = EDMOOveridePlayer(rtcPeer, overrideID, self)
+    def registerOverrider(self, rtcPeer : WebRTCPeer, overrideID: int, syncState: bool = False):
+        overrider = EDMOOveridePlayer(rtcPeer, overrideID, self, syncState)
 
         self.activeOverriders.append(overrider)
 
@@ -210,32 +375,48 @@ class EDMOSession:
         player.assignNumber(heapq.heappop(self.playerNumbers))
         self.waitingPlayers.remove(player)
         self.activePlayers.append(player)
+        self.playerList.changed()
         self.sessionLog.write("Session", message=f"Player {player.number} connected. ({player.name})")
+        self.captureEvent(LinkCapture.PLAYER_CONNECTED, player.number, player.name)
 
         self.broadcastPlayerList()
-        player.sendMessage(f"TaskInfo {json.dumps(self.getTasks())}")
-        self.sendMotorParams(player)
-        player.sendMessage(f"HelpEnabled {"1" if self.helpEnabled else "0"}")
-        player.sendMessage(f"SimpleMode {"1" if self.simpleMode else "0"}")
+        self.sendInitialState(player)
         
         pass
 
     def overriderConnected(self, overrider : EDMOOveridePlayer):
         self.sessionLog.write("Session", message=f"Overrider for {overrider.number} connected.")
+        self.captureEvent(LinkCapture.OVERRIDER_CONNECTED, overrider.number, overrider.name)
 
         self.broadcastPlayerList()
-        overrider.sendMessage(f"TaskInfo {json.dumps(self.getTasks())}")
-        self.sendMotorParams(overrider)
-        overrider.sendMessage(f"HelpEnabled {"1" if self.helpEnabled else "0"}")
-        overrider.sendMessage(f"SimpleMode {"1" if self.simpleMode else "0"}")
+        self.sendInitialState(overrider)
+
+    # Everything a client is shown when it connects, in one message if it syncs the session state
+    def sendInitialState(self, recipient: EDMOPlayer):
+        if recipient.syncState:
+            recipient.sendMessage(self.state.snapshot())
+            return
+
+        recipient.sendMessage(self.taskList.derive("message", taskMessage))
+        self.sendMotorParams(recipient)
+        recipient.sendMessage(self.helpState.derive("message", helpEnabledMessage))
+        recipient.sendMessage(self.simpleState.derive("message", simpleModeMessage))
+
+    # A client asked for the session state since the given version, after missing a delta or reconnecting
+    # From then on, it is kept up to date with deltas
+    def resync(self, recipient: EDMOPlayer, version: int):
+        recipient.syncState = True
+        recipient.sendMessage(self.state.since(version))
 
 
     # The player has disconnected (due to network faults)
     # A reconnection may happen so we place them into the waiting list
     def playerDisconnected(self, player: EDMOPlayer):
         self.sessionLog.write("Session", f"Player {player.number} disconnected. ({player.name})")
+        self.captureEvent(LinkCapture.PLAYER_DISCONNECTED, player.number, player.name)
 
         self.activePlayers.remove(player)
+        self.playerList.changed()
 
         self.broadcastPlayerList()
 
@@ -257,20 +438,138 @@ class EDMOSession:
     # A reconnection may happen so we place them into the waiting list
     def overriderDisconnected(self, overrider: EDMOPlayer):
         self.sessionLog.write("Session", f"Overrider for {overrider.number} disconnected.")
+        self.captureEvent(LinkCapture.OVERRIDER_DISCONNECTED, overrider.number, overrider.name)
 
         removeIfExist(self.activeOverriders, overrider)
 
     # If the edmo associated with this session is reconnected
     # We realign the edmo timestamp back with the session timestamp
+    # The edmo may have lost the motor state, so every motor is resent on the next update
     def onEDMOReconnect(self):
         self.protocol.write(
             EDMOPacket.create(
                 EDMOCommands.SESSION_START, struct.pack("<L", self.offsetTime)
             )
         )
+        self.keyframeRequested = True
+
+    def updateMotor(self, motorNumber: int, parameter: str, value: float, receivedAt: float | None = None):
+        self.motors[motorNumber].adjust(parameter, value)
+
+        if self.latencyTracer is not None:
+            self.latencyTracer.inputApplied(motorNumber, receivedAt)
+
+    # Collects a slider message, replacing any earlier value of the same parameter that wasn't applied yet
+    def queueInput(self, sender: EDMOPlayer, parameter: str, value: float):
+        motor = self.ALL_MOTORS if parameter == "freq" else sender.number
+        pending = self.pendingInputs.get((motor, parameter))
+
+        self.inputsReceived += 1
+        PLAYER_INPUTS.inc()
+
+        if pending is None:
+            self.pendingInputs[(motor, parameter)] = PendingInput(
+                sender, value, sender.rtc.lastMessageTime
+            )
+        else:
+            pending.sender = sender
+            pending.value = value
+            pending.count += 1
+
+            self.inputsCoalesced += 1
+            COALESCED_INPUTS.inc()
+
+        if not self.COALESCE_INPUT:
+            self.applyInputs()
+        elif self.IMMEDIATE_UPDATES and self.pendingApply is None:
+            # Without waiting for the next update, input that arrives together is still applied together
+            self.pendingApply = asyncio.get_running_loop().call_soon(self.applyInputs)
+
+    # Applies the latest value of every parameter changed since the last time
+    # Those who need to know are told once, and the input of each player is logged as a single entry
+    def applyInputs(self):
+        if self.pendingApply is not None:
+            self.pendingApply.cancel()
+            self.pendingApply = None
+
+        if len(self.pendingInputs) == 0:
+            return
+
+        inputs = self.pendingInputs
+        self.pendingInputs = {}
+
+        logged = dict[EDMOPlayer, list[tuple[str, PendingInput]]]()
+        senders = list[EDMOPlayer]()
+
+        for (motor, parameter), input in inputs.items():
+            logged.setdefault(input.sender, []).append((parameter, input))
+            value = input.value
+
+            if parameter == "freq":
+                self.setFreq(value)
+                continue
+
+            # The player no longer has a motor
+            if motor < 0 or motor >= len(self.motors):
+                continue
+
+            self.updateMotor(motor, parameter, value, input.receivedAt)
+            self.updateMotorState(self.motors[motor])
+
+            if parameter == "phb":
+                self.setPhb(motor, value)
+
+            if input.sender not in senders:
+                senders.append(input.sender)
+
+        for sender, entries in logged.items():
+            summary = "; ".join(f"{parameter} {entry.value}" for parameter, entry in entries)
+            count = sum(entry.count for _, entry in entries)
+
+            if count > len(entries):
+                summary += f" ({count} messages)"
 
-    def updateMotor(self, motorNumber: int, command: str):
-        self.motors[motorNumber].adjustFrom(command)
+            self.sessionLog.write(f"{sender.LOG_CHANNEL}{sender.number}", message=summary)
+
+        recipients = list[EDMOPlayer]()
+        for sender in senders:
+            for recipient in sender.parameterRecipients():
+                if recipient not in senders and recipient not in recipients:
+                    recipients.append(recipient)
+
+        for recipient in recipients:
+            self.sendMotorParams(recipient)
+
+        self.motorsChanged()
+
+    # Sends the changed motors right away if immediate updates are enabled
+    # If motors were sent too recently, the send is delayed until the minimum interval has passed
+    def motorsChanged(self):
+        if not self.IMMEDIATE_UPDATES or self.pendingSend is not None:
+            return
+
+        if not self.protocol.hasConnection():
+            return
+
+        delay = self.lastSendTime + self.MIN_SEND_INTERVAL - time.monotonic()
+
+        if delay <= 0:
+            self.sendMotorUpdates()
+            return
+
+        self.pendingSend = asyncio.get_running_loop().call_later(
+            delay, self.sendPendingMotorUpdates
+        )
+
+    def sendPendingMotorUpdates(self):
+        self.pendingSend = None
+
+        if self.protocol.hasConnection():
+            self.sendMotorUpdates()
+
+    def captureEvent(self, kind: int, number: int, data: str):
+        if self.protocol.capture is not None:
+            self.protocol.capture.record(kind, number, data)
 
     def hasPlayers(self):
         return len(self.activePlayers) > 0 or len(self.waitingPlayers) > 0
@@ -278,67 +577,163 @@ class EDMOSession:
 
     # Notify all players about changes in the task list
     def broadcastTaskList(self):
-        jsonDump = json.dumps(self.getTasks())
+        self.state.set("TaskInfo", self.taskList.get())
+        message = self.taskList.derive("message", taskMessage)
 
         for player in self.activePlayers:
-            player.sendMessage(f"TaskInfo {jsonDump}")
+            player.sendState(message)
 
     # Notify all players about changes in the player list
     def broadcastPlayerList(self):
-        playerList = [s.dict() for s in self.activePlayers]
-
-        jsonDump = json.dumps(playerList)
+        self.state.set("PlayerInfo", self.playerList.get())
+        message = self.playerList.derive("message", Players)
 
         for player in self.activePlayers:
-            player.sendMessage(f"PlayerInfo {jsonDump}")
+            player.sendState(message)
 
     # Notify all players that help button is enabled
     def broadcastHelpEnabled(self):
+        self.state.set("HelpEnabled", self.helpEnabled)
+        message = self.helpState.derive("message", helpEnabledMessage)
+
         for p in self.activePlayers:
-            p.sendMessage(f"HelpEnabled {"1" if self.helpEnabled else "0"}")
+            p.sendState(message)
 
     # Sends the current parameter of a motor associated with a player
     def sendMotorParams(self, recipient: EDMOPlayer):
+        # Clients that sync the session state receive the parameters with the next delta
+        if recipient.syncState:
+            return
+
         motor = self.motors[recipient.number]
-        recipient.sendMessage(f"amp {motor._amp}")
-        recipient.sendMessage(f"freq {motor._freq}")
-        recipient.sendMessage(f"off {motor._offset}")
+        recipient.sendMessage(Parameter("amp", motor._amp))
+        recipient.sendMessage(Parameter("freq", motor._freq))
+        recipient.sendMessage(Parameter("off", motor._offset))
 
         for motor in self.motors:
-            recipient.sendMessage(f"phb {motor._id} {motor._phaseShift}")
+            recipient.sendMessage(Parameter("phb", motor._phaseShift, motor._id))
 
     def setFreq(self,newValue:float):
         for motor in self.motors:
-            motor._freq = newValue
+            motor.frequency = newValue
+
+        self.state.set("freq", newValue)
+        message = Parameter("freq", newValue)
 
         for player in self.activePlayers:
-            player.sendMessage(f"freq {newValue}")
+            player.sendState(message)
 
     def setPhb(self, id : int, newValue:float):
+        message = Parameter("phb", newValue, id)
+
         for player in self.activePlayers:
             if(player.number == id):
                 continue
-            player.sendMessage(f"phb {id} {newValue}")
+            player.sendState(message)
+
+    def updateMotorState(self, motor: EDMOMotor):
+        self.state.set(f"amp.{motor._id}", motor._amp)
+        self.state.set(f"off.{motor._id}", motor._offset)
+        self.state.set(f"phb.{motor._id}", motor._phaseShift)
+        self.state.set("freq", motor._freq)
+
+    # Sends the changes to the session state made since the last update, as one delta to every client that syncs it
+    def broadcastStateChanges(self):
+        delta = self.state.flush()
+        if delta is None:
+            return
+
+        for p in itertools.chain(self.activePlayers, self.activeOverriders):
+            if p.syncState:
+                p.sendMessage(delta)
 
 
     # Update the state of the actual edmo robot
     # All motors are sent through the serial protocol
     async def update(self):
+        self.applyInputs()
+        self.broadcastStateChanges()
+
         if not self.protocol.hasConnection():
             return
 
-        motor = self.motors[0]
+        # With immediate updates, changes have already been sent as they happened
+        # A due keyframe is held to the same minimum interval, and joins a send that is already pending
+        if not self.IMMEDIATE_UPDATES:
+            self.sendMotorUpdates()
+        elif self.keyframeDue(time.monotonic()):
+            self.motorsChanged()
 
-        for motor in self.motors:
-            command = motor.asCommand()
-            # print(command)
-            self.protocol.write(command)
+        self.protocol.write(EDMOPacket.constant(EDMOCommands.GET_TIME))
+
+    def keyframeDue(self, now: float):
+        return (
+            self.keyframeRequested
+            or now - self.lastKeyframeTime >= self.KEYFRAME_INTERVAL
+        )
+
+    # Sends the oscillator state of the motors that changed since the last send
+    # All motors are sent if a keyframe is due
+    def sendMotorUpdates(self):
+        now = time.monotonic()
+        keyframe = self.keyframeDue(now)
 
-        self.protocol.write(EDMOPacket.create(EDMOCommands.GET_TIME))
-        await self.sessionLog.update()
+        if keyframe:
+            self.keyframeRequested = False
+            self.lastKeyframeTime = now
+
+        changed = [m for m in self.motors if keyframe or m.dirty]
+        self.oscillatorUpdatesSuppressed += len(self.motors) - len(changed)
+        OSCILLATOR_UPDATES_SUPPRESSED.inc(len(self.motors) - len(changed))
+
+        if len(changed) == 0:
+            return
+
+        # EDMOs that support it receive all motors in a single packet, instead of one packet per motor
+        if self.protocol.supports(EDMOCapabilities.BATCHED_OSCILLATORS):
+            written = self.motors
+            self.protocol.write(EDMOMotor.asBatchedCommand(self.motors))
+        else:
+            written = changed
+            for motor in changed:
+                self.protocol.write(motor.asCommand())
+
+        if self.latencyTracer is not None:
+            self.latencyTracer.motorsWritten(written)
+
+        for motor in changed:
+            motor.dirty = False
+
+        self.oscillatorUpdatesSent += len(changed)
+        OSCILLATOR_UPDATES_SENT.inc(len(changed))
+        self.lastSendTime = now
 
     async def close(self):
-        await self.sessionLog.flush()
+        if self.pendingSend is not None:
+            self.pendingSend.cancel()
+            self.pendingSend = None
+
+        if self.pendingApply is not None:
+            self.pendingApply.cancel()
+            self.pendingApply = None
+
+        self.sessionLog.write(
+            "Session",
+            f"Oscillator updates sent: {self.oscillatorUpdatesSent}, suppressed: {self.oscillatorUpdatesSuppressed}",
+        )
+        self.sessionLog.write(
+            "Session",
+            f"Player inputs received: {self.inputsReceived}, coalesced: {self.inputsCoalesced}",
+        )
+        await self.sessionLog.close()
+        await self.telemetryStream.close()
+
+        capture = self.protocol.stopCapture()
+        if capture is not None:
+            await asyncio.to_thread(capture.close)
+
+        if self.telemetryBus is not None:
+            self.telemetryBus.close()
 
         for p in self.activePlayers:
             await p.rtc.close()
@@ -354,77 +749,67 @@ class EDMOSession:
         if command.Instruction == EDMOCommands.INVALID:
             return
 
-        if command.Instruction == EDMOCommands.GET_TIME:
-            self.offsetTime = struct.unpack("<L", command.Data)[0]
-        elif command.Instruction == EDMOCommands.SEND_MOTOR_DATA:
-            self.parseMotorPacket(command.Data)
-            # log motor data
-            pass
-        elif command.Instruction == EDMOCommands.SEND_IMU_DATA:
-            self.parseIMUPacket(command.Data)
-            # log IMU data
-            pass
-        elif command.Instruction == EDMOCommands.SEND_ALL_DATA:
-            self.parseDataPacket(command.Data)
-        pass
-
-    def parseDataPacket(self, data:bytes):
-        parsedContent = struct.unpack("<LffffffffffffffffffffLB3xfffLB3xfffLB3xfffLB3xfffLB3xffff", data)
-        self.offsetTime = parsedContent[0]
+        record = EDMOCodecs.decode(command)
 
-        for i in range(0, 4):
-            start = 1 + 5 * i
-            motorData = parsedContent[start:]
-            stringified = f"Frequency: {motorData[1]}, Amplitude: {motorData[2]}, Offset: {motorData[3]}, Phase Shift: {motorData[4]}, Phase: {motorData[5]}"
-            self.sessionLog.write(f"Motor{i}", stringified)
-
-        imuData = parsedContent[21:]
-
-        accelaration = f"Acceleration: {{Time: {imuData[0]}, Status: {imuData[1]}, Value: ({imuData[2]},{imuData[3]},{imuData[4]})}}"
-        gyroscope = f"Gyroscope: {{Time: {imuData[5]}, Status: {imuData[6]}, Value: ({imuData[7]},{imuData[8]},{imuData[9]})}}"
-        magnetic = f"Magnetic: {{Time: {imuData[10]}, Status: {imuData[11]}, Value: ({imuData[12]},{imuData[13]},{imuData[14]})}}"
-        gravity = f"Gravity: {{Time: {imuData[15]}, Status: {imuData[16]}, Value: ({imuData[17]},{imuData[18]},{imuData[19]})}}"
-        rotation = f"Rotation: {{Time: {imuData[20]}, Status: {imuData[21]}, Value: ({imuData[22]},{imuData[23]},{imuData[24]}, {imuData[25]})}}"
+        if record is None:
+            return
 
-        final = f"{{{accelaration},{gyroscope},{magnetic},{gravity}, {rotation}}}"
+        # Every other command with data is telemetry
+        if command.Instruction != EDMOCommands.GET_TIME:
+            self.sessionLog.writeTelemetry(command.Instruction, command.Data)
+            self.telemetryStream.publish(command.Instruction, command.Data)
 
-        self.sessionLog.write("IMU", final)
+            if self.telemetryBus is not None:
+                self.telemetryBus.publish(command.Instruction, command.Data)
 
+        if command.Instruction == EDMOCommands.GET_TIME:
+            self.offsetTime = record
+        elif command.Instruction == EDMOCommands.SEND_MOTOR_DATA:
+            self.onMotorState(record)
+        elif command.Instruction == EDMOCommands.SEND_IMU_DATA:
+            self.onImuSample(record)
+        elif command.Instruction == EDMOCommands.SEND_ALL_DATA:
+            self.onAllData(record)
         pass
 
+    def onAllData(self, data: AllData):
+        self.offsetTime = data.time
 
+        for motor in data.motors:
+            self.onMotorState(motor)
 
-    def parseMotorPacket(self, data:bytes):
-        """We've received the motor state from the edmo, we log it."""
-
-        parsedContent = struct.unpack("<Bfffff", data)
-
-        stringified = f"Frequency: {parsedContent[1]}, Amplitude: {parsedContent[2]}, Offset: {parsedContent[3]}, Phase Shift: {parsedContent[4]}, Phase: {parsedContent[5]}"
+        self.onImuSample(data.imu)
 
-        self.sessionLog.write(f"Motor{parsedContent[0]}", stringified)
+    def onMotorState(self, motor: MotorState):
+        """We've received the motor state from the edmo, we keep it and log it as text if enabled."""
+        if motor.motor < len(self.motorTelemetry):
+            self.motorTelemetry[motor.motor].append(time.monotonic(), motor.values())
 
+        if self.latencyTracer is not None:
+            self.latencyTracer.motorReported(motor)
 
-    def parseIMUPacket(self, data: bytes):
-        """We've received the IMU state from the edmo, we log it."""
+        if self.TEXT_TELEMETRY:
+            # The record is only formatted when the log is written
+            self.sessionLog.write(f"Motor{motor.motor}", motor)
 
-        parsedContent = struct.unpack("<LB3xfffLB3xfffLB3xfffLB3xfffLB3xffff", data)
+    def onImuSample(self, imu: ImuSample):
+        """We've received the IMU state from the edmo, we keep it and log it as text if enabled."""
+        self.imuTelemetry.append(time.monotonic(), imu.values())
 
-        accelaration = f"Acceleration: {{Time: {parsedContent[0]}, Status: {parsedContent[1]}, Value: ({parsedContent[2]},{parsedContent[3]},{parsedContent[4]})}}"
-        gyroscope = f"Gyroscope: {{Time: {parsedContent[5]}, Status: {parsedContent[6]}, Value: ({parsedContent[7]},{parsedContent[8]},{parsedContent[9]})}}"
-        magnetic = f"Magnetic: {{Time: {parsedContent[10]}, Status: {parsedContent[11]}, Value: ({parsedContent[12]},{parsedContent[13]},{parsedContent[14]})}}"
-        gravity = f"Gravity: {{Time: {parsedContent[15]}, Status: {parsedContent[16]}, Value: ({parsedContent[17]},{parsedContent[18]},{parsedContent[19]})}}"
-        rotation = f"Rotation: {{Time: {parsedContent[20]}, Status: {parsedContent[21]}, Value: ({parsedContent[22]},{parsedContent[23]},{parsedContent[24]}, {parsedContent[25]})}}"
-
-        final = f"{{{accelaration},{gyroscope},{magnetic},{gravity}, {rotation}}}"
-
-        self.sessionLog.write("IMU", final)
-        pass
+        if self.TEXT_TELEMETRY:
+            self.sessionLog.write("IMU", imu)
 #endregion
 
 #region API ENDPOINT HANDLERS
 # Functions in this region are meant to be used by the backed to respond to Rest API calls
 
     def getSessionInfo(self):
+        return self.sessionInfo.get()
+
+    def getSessionInfoJson(self):
+        return self.sessionInfo.derive("json", encodeJson)
+
+    def buildSessionInfo(self):
         object = {}
 
         robotID = self.protocol.identifier
@@ -438,6 +823,9 @@ class EDMOSession:
         return object
     
     def getTasks(self):
+        return self.taskList.get()
+
+    def buildTasks(self):
         tasks = []
 
         for t in self.tasks:
@@ -452,6 +840,12 @@ class EDMOSession:
 
 
     def getDetailedInfo(self):
+        return self.detailedInfo.get()
+
+    def getDetailedInfoJson(self):
+        return self.detailedInfo.derive("json", encodeJson)
+
+    def buildDetailedInfo(self):
         object = {}
         players = []
 
@@ -471,6 +865,24 @@ class EDMOSession:
         object["helpEnabled"] = self.helpEnabled
 
         return object
+
+    def getTelemetryStats(self):
+        """Rolling statistics of the recent telemetry, computed from the in memory buffers"""
+        object = {}
+
+        object["robotID"] = self.protocol.identifier
+        object["motors"] = [buffer.stats() for buffer in self.motorTelemetry]
+        object["imu"] = self.imuTelemetry.stats()
+        object["subscribers"] = self.telemetryStream.stats()
+        object["inputs"] = {"received": self.inputsReceived, "coalesced": self.inputsCoalesced}
+        object["oscillatorUpdates"] = {
+            "sent": self.oscillatorUpdatesSent,
+            "suppressed": self.oscillatorUpdatesSuppressed,
+        }
+        object["latency"] = self.latencyTracer.stats() if self.latencyTracer is not None else None
+        object["state"] = self.state.stats()
+
+        return object
     
 
     def setTasks(self, taskKey: str, value: bool):
@@ -478,6 +890,7 @@ class EDMOSession:
             return False
 
         self.tasks[taskKey].completed = value
+        self.taskList.changed()
 
         self.broadcastTaskList()
 
@@ -488,16 +901,24 @@ class EDMOSession:
             return
 
         self.helpEnabled = value
+        self.helpState.changed()
+
         if not value:
             for p in self.activePlayers:
                 p.voted = False
 
+            # The reset votes reach players, and the PlayerInfo state synced clients hold, like any other vote
+            self.playerList.changed()
+            self.broadcastPlayerList()
+
         self.broadcastHelpEnabled()
 
     # A teacher has sent feedback/guide to this session, broadcast to all player
     def sendFeedback(self, message: str):
+        feedback = Document("Feedback", message)
+
         for p in self.activePlayers:
-            p.sendMessage(f"Feedback {message}")
+            p.sendMessage(feedback)
 
         print(f"feedback {message} is sent to group {self.protocol.identifier}")
         self.sessionLog.write("Session", f"Teacher sent feedback: {message}")
@@ -505,7 +926,11 @@ class EDMOSession:
 
     def setSimpleView(self, value):
         self.simpleMode = value
+        self.simpleState.changed()
+        self.state.set("SimpleMode", value)
+        message = self.simpleState.derive("message", simpleModeMessage)
+
         for p in self.activePlayers:
-            p.sendMessage(f"SimpleMode {"1" if value else "0"}")
+            p.sendState(message)
 
 #endregion
@@ -2,32 +2,55 @@ from asyncio import DatagramProtocol, DatagramTransport, get_event_loop
 from datetime import datetime
 from typing import Any, Callable, Optional
 
-from EDMOCommands import EDMOCommand, EDMOCommands, EDMOPacket
+from EDMOCommands import (
+    EDMOCapabilities,
+    EDMOCommand,
+    EDMOCommands,
+    EDMOPacket,
+    LINK_PACKETS_RECEIVED,
+    LINK_PACKETS_SENT,
+)
 
 
 IPAddress = tuple[str | Any, int]
 
+PACKETS_RECEIVED = LINK_PACKETS_RECEIVED.labels("udp")
+PACKETS_SENT = LINK_PACKETS_SENT.labels("udp")
+
 
 class UdpProtocol:
-    def __init__(self, identifier: str, ip: IPAddress, transport: DatagramTransport):
+    def __init__(
+        self,
+        identifier: str,
+        ip: IPAddress,
+        transport: DatagramTransport,
+        capabilities: int = EDMOCapabilities.NONE,
+    ):
         self.identifier = identifier
+        self.capabilities = capabilities
         self.lastResponseTime: datetime = datetime.now()
         self.ip = ip
         self.transport = transport
 
         self.onMessageReceived: Optional[Callable[[EDMOCommand], None]] = None
 
+        # Every packet as it was received, before it is parsed (used for capturing the link)
+        self.onPacketReceived: Optional[Callable[[bytes], None]] = None
+
         pass
 
-    def data_received(self, data):
-        # print("UDP loopback: ", data)
+    def messageReceived(self, command: EDMOCommand, packet: bytes):
         self.lastResponseTime = datetime.now()
 
+        if self.onPacketReceived is not None:
+            self.onPacketReceived(packet)
+
         if self.onMessageReceived is not None:
-            self.onMessageReceived(EDMOPacket.tryParse(data))
+            self.onMessageReceived(command)
 
     def write(self, data: bytes):
         # print("UDP send: ", data)
+        PACKETS_SENT.inc()
         self.transport.sendto(data, self.ip)
 
     def isStale(self):
@@ -40,6 +63,10 @@ class EDMOUdp(DatagramProtocol):
     onConnect: list[Callable[[UdpProtocol], None]] = []
     onDisconnect: list[Callable[[UdpProtocol], None]] = []
 
+    # Where the identify command is sent to, EDMOs listen on port 2121
+    # Other addresses can be added, such as a simulator on another machine, or on this machine (see Simulator.py)
+    DISCOVERY_ADDRESSES: list[IPAddress] = [("255.255.255.255", 2121)]
+
     def __init__(self):
         self.transport: DatagramTransport
         self.peers: dict[IPAddress, UdpProtocol] = {}
@@ -61,9 +88,9 @@ class EDMOUdp(DatagramProtocol):
     def searchForConnections(self):
         # Broadcast the id command to all peers
         # If an EDMO exist, we'll receive their identifier along with their IP
-        self.transport.sendto(
-            EDMOPacket.create(EDMOCommands.IDENTIFY), ("255.255.255.255", 2121)
-        )
+        for address in self.DISCOVERY_ADDRESSES:
+            PACKETS_SENT.inc()
+            self.transport.sendto(EDMOPacket.constant(EDMOCommands.IDENTIFY), address)
 
     # We want to ensure that if an EDMO doesn't respond
     #  (Due to shutdown, network fault, or Derrick's code)
@@ -85,19 +112,20 @@ class EDMOUdp(DatagramProtocol):
 
     def datagram_received(self, data: bytes, addr):
         # Received the identifier, potentially replying to a broadcast
+        PACKETS_RECEIVED.inc()
         command = EDMOPacket.tryParse(data)
 
         if addr not in self.peers:
             if command.Instruction == EDMOCommands.IDENTIFY:
-                identifier = command.Data.decode()
-                udpProto = UdpProtocol(identifier, addr, self.transport)
+                identifier, capabilities = EDMOCapabilities.parseIdentity(command.Data)
+                udpProto = UdpProtocol(identifier, addr, self.transport, capabilities)
                 self.peers[addr] = udpProto
 
                 self.onConnectionEstablished(udpProto)
 
             return
 
-        self.peers[addr].data_received(data)
+        self.peers[addr].messageReceived(command, data)
         pass
 
     def onConnectionEstablished(self, protocol: UdpProtocol):
@@ -4,6 +4,7 @@ from typing import Callable, Optional
 from EDMOCommands import EDMOCommand
 from EDMOSerial import EDMOSerial, SerialProtocol
 from EDMOUdp import EDMOUdp, UdpProtocol
+from LinkCapture import INBOUND, OUTBOUND, LinkCapture
 
 
 class FusedCommunicationProtocol:
@@ -20,9 +21,15 @@ class FusedCommunicationProtocol:
 
         self.connected = False
 
+        # When capturing, every packet to and from the EDMO is recorded
+        self.capture: Optional[LinkCapture] = None
+
         pass
 
     def write(self, message: bytes):
+        if self.capture is not None:
+            self.capture.record(OUTBOUND, 0, message)
+
         # Prioritize serial communication if present
         if self.serialCommunication is not None:
             self.serialCommunication.write(message)
@@ -32,6 +39,16 @@ class FusedCommunicationProtocol:
             self.udpCommunication.write(message)
             return
 
+    def supports(self, capability: int):
+        """Whether the EDMO supports the given capability over the link that is currently used for writing"""
+        link = (
+            self.serialCommunication
+            if self.serialCommunication is not None
+            else self.udpCommunication
+        )
+
+        return link is not None and (link.capabilities & capability) != 0
+
     def bind(self, protocol: SerialProtocol | UdpProtocol):
         hasPreviousConnection = self.hasConnection()
 
@@ -43,6 +60,7 @@ class FusedCommunicationProtocol:
             raise TypeError("Only serial or UDP protocol is accepted")
 
         protocol.onMessageReceived = self.messageReceived
+        protocol.onPacketReceived = self.packetReceived
         self.connected = self.hasConnection()
 
         if not hasPreviousConnection and self.connected:
@@ -58,8 +76,14 @@ class FusedCommunicationProtocol:
             return
 
         protocol.onMessageReceived = None
+        protocol.onPacketReceived = None
         self.connected = self.hasConnection()
 
+    def packetReceived(self, packet: bytes):
+        # Packets are recorded as they were received, malformed ones included, so replays go through the same parsing
+        if self.capture is not None:
+            self.capture.record(INBOUND, 0, packet)
+
     def messageReceived(self, command: EDMOCommand):
         if self.onMessageReceived is not None:
             self.onMessageReceived(command)
@@ -67,6 +91,23 @@ class FusedCommunicationProtocol:
     def hasConnection(self):
         return self.serialCommunication is not None or self.udpCommunication is not None
 
+    def startCapture(self, path: str):
+        link = (
+            self.serialCommunication
+            if self.serialCommunication is not None
+            else self.udpCommunication
+        )
+        capabilities = link.capabilities if link is not None else 0
+
+        self.capture = LinkCapture(path, self.identifier, capabilities)
+
+    def stopCapture(self):
+        """Stops capturing, returning the capture so it can be closed"""
+        capture = self.capture
+        self.capture = None
+
+        return capture
+
 
 class FusedCommunication:
     """This class is the central management class for all supported communication methods"""
@@ -0,0 +1,155 @@
+# Traces a sample of player inputs along the control path, to find out where the time between input and actuation goes
+#
+#   received   the data channel delivered the message (WebRTCPeer.onMessageReceived)
+#   applied    the motor was adjusted (EDMOSession.updateMotor, once slider input is applied for the tick)
+#   written    the oscillator command carrying the change was written to the link
+#   echoed     the EDMO reported a motor state matching the command
+#
+# Time spent in the browser and on the network before the message reaches the server can't be seen from here.
+
+import time
+
+from EDMOCodecs import MotorState
+from EDMOMotor import EDMOMotor
+from Utilities import Metrics
+
+# Spans from microseconds (handling a message) to seconds (a struggling link)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+INPUT_LATENCY = Metrics.histogram(
+    "edmo_input_latency_seconds",
+    "Time between stages of the control path, for a sample of player inputs",
+    ("edmo", "stage"),
+    LATENCY_BUCKETS,
+)
+
+# Each stage is measured between two of the stamps of a trace
+STAGES = {
+    "handling": ("received", "applied"),
+    "waiting": ("applied", "written"),
+    "link": ("written", "echoed"),
+    "server": ("received", "written"),
+    "total": ("received", "echoed"),
+}
+
+
+class Trace:
+    __slots__ = ("received", "applied", "written", "echoed", "expected")
+
+    def __init__(self, received: float, applied: float):
+        self.received = received
+        self.applied = applied
+        self.written = 0.0
+        self.echoed = 0.0
+
+        # The oscillator parameters written since the input, any of which the EDMO may report back
+        # A later write can reach the EDMO before it reports the earlier one, which still proves the earlier one arrived
+        self.expected = list[tuple[float, float, float, float]]()
+
+
+class LatencyTracer:
+    # Traces that the EDMO didn't confirm within this time (in seconds) are given up on
+    # This happens when a newer change is written before the echo arrives, or when the EDMO doesn't report motor states
+    ECHO_TIMEOUT = 2.0
+
+    # The echoed parameters are 32 bit floats, and won't be exactly equal to what was sent
+    TOLERANCE = 1e-4
+
+    # The number of writes following a traced input that are still matched against the echo
+    MAX_EXPECTED_STATES = 8
+
+    def __init__(self, identifier: str, sampleInterval: int):
+        self.sampleInterval = sampleInterval
+        self.inputs = 0
+
+        # Sampled inputs waiting to be written, and written inputs waiting to be echoed, by motor
+        self.pending = dict[int, Trace]()
+        self.inFlight = dict[int, Trace]()
+
+        self.completed = 0
+        self.abandoned = 0
+
+        # The histograms of this session, and those on /metrics, which add up every session of the EDMO
+        self.histograms = {stage: Metrics.Histogram(LATENCY_BUCKETS) for stage in STAGES}
+        self.metrics = {stage: INPUT_LATENCY.labels(identifier, stage) for stage in STAGES}
+
+    def inputApplied(self, motor: int, received: float | None):
+        """A player adjusted a motor, the input is traced if it is sampled"""
+        if received is None:
+            return
+
+        self.inputs += 1
+        if self.inputs % self.sampleInterval != 0:
+            return
+
+        # An earlier sampled input is carried by the same write, and has waited longer
+        if motor not in self.pending:
+            self.pending[motor] = Trace(received, time.perf_counter())
+
+    def motorsWritten(self, motors: list[EDMOMotor]):
+        """The oscillator commands of the given motors were written to the link"""
+        now = time.perf_counter()
+
+        for motor in motors:
+            parameters = (motor.frequency, motor.amplitude, motor.offset, motor.phaseShift)
+            trace = self.pending.pop(motor.motorNumber, None)
+
+            if trace is None:
+                trace = self.inFlight.get(motor.motorNumber)
+
+                if trace is not None and trace.expected[-1] != parameters and len(trace.expected) < self.MAX_EXPECTED_STATES:
+                    trace.expected.append(parameters)
+                continue
+
+            trace.written = now
+            trace.expected.append(parameters)
+
+            # Only one trace per motor is waiting for an echo, newer inputs are traced instead of older ones
+            if self.inFlight.get(motor.motorNumber) is not None:
+                self.abandoned += 1
+
+            self.inFlight[motor.motorNumber] = trace
+
+    def motorReported(self, state: MotorState):
+        """The EDMO reported the state of a motor, completing its trace if the state matches what was written"""
+        trace = self.inFlight.get(state.motor)
+        if trace is None:
+            return
+
+        now = time.perf_counter()
+        reported = (state.frequency, state.amplitude, state.offset, state.phaseShift)
+
+        if not any(
+            all(abs(r - e) <= self.TOLERANCE * max(1.0, abs(e)) for r, e in zip(reported, expected))
+            for expected in trace.expected
+        ):
+            if now - trace.written > self.ECHO_TIMEOUT:
+                del self.inFlight[state.motor]
+                self.abandoned += 1
+            return
+
+        del self.inFlight[state.motor]
+        trace.echoed = now
+        self.completed += 1
+
+        for stage, (start, end) in STAGES.items():
+            latency = getattr(trace, end) - getattr(trace, start)
+            self.histograms[stage].observe(latency)
+            self.metrics[stage].observe(latency)
+
+    def stats(self):
+        return {
+            "sampleInterval": self.sampleInterval,
+            "completed": self.completed,
+            "abandoned": self.abandoned,
+            "stages": {
+                stage: {
+                    "count": histogram.count,
+                    "mean": histogram.sum / histogram.count if histogram.count > 0 else None,
+                    "p50": histogram.quantile(0.5),
+                    "p95": histogram.quantile(0.95),
+                    "p99": histogram.quantile(0.99),
+                }
+                for stage, histogram in self.histograms.items()
+            },
+        }
@@ -0,0 +1,213 @@
+# Converts the Motor and IMU text logs of sessions into columnar NumPy arrays, one .npz file per session
+# The text logs are those written before telemetry was logged in binary (or with EDMOSession.TEXT_TELEMETRY enabled)
+#
+# Usage:
+#   python LegacyLogConverter.py [--workers N] [--force] [--fix-all-data-labels]
+#
+# Converted sessions are skipped when run again, so an interrupted conversion can simply be restarted.
+
+import argparse
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from EDMOCodecs import MOTOR_COUNT, imuFields, motorFields
+from SessionIndex import LOG_DIRECTORY, parseSegmentName, sessionDirectories
+from Utilities.Compression import openFile
+
+OUTPUT_FILE = "Legacy.npz"
+
+# Files are parsed in blocks of whole lines, to bound the memory used by the matches
+BLOCK_SIZE = 8 * 1024 * 1024
+
+# The session time ("H:MM:SS.ffffff"), followed by the message in the layout written by EDMOSession
+TIME = rb"^(\d+):(\d+):(\d+(?:\.\d+)?): "
+VALUE = rb"([^,\s)]+)"
+IMU_READING = rb"%s: \{Time: (\d+), Status: (\d+), Value: \(" + rb",".join([VALUE] * 3) + rb"\)\}"
+
+MOTOR_LINE = re.compile(
+    TIME + rb"Frequency: %s, Amplitude: %s, Offset: %s, Phase Shift: %s, Phase: %s$" % ((VALUE,) * 5),
+    re.MULTILINE,
+)
+IMU_LINE = re.compile(
+    TIME
+    + rb"\{"
+    + rb",".join(IMU_READING % name for name in (b"Acceleration", b"Gyroscope", b"Magnetic", b"Gravity"))
+    + rb", Rotation: \{Time: (\d+), Status: (\d+), Value: \(%s,%s,%s, %s\)\}\}$" % ((VALUE,) * 4),
+    re.MULTILINE,
+)
+
+MOTOR_COLUMNS = [name for name, _ in motorFields()]
+IMU_COLUMNS = [name for name, _ in imuFields() if name != ""]
+
+
+def textSegments(directory: str):
+    """Groups the text log files of a session by channel, in the order they were written"""
+    channels = dict[str, list[tuple[float, str]]]()
+
+    for fileName in os.listdir(directory):
+        parsed = parseSegmentName(fileName)
+        if parsed is None or parsed[1] != "text":
+            continue
+
+        channel, _, position = parsed
+        channels.setdefault(channel, []).append((position, os.path.join(directory, fileName)))
+
+    return {channel: [path for _, path in sorted(paths)] for channel, paths in channels.items()}
+
+
+def parseChannel(paths: list[str], pattern: re.Pattern, columnCount: int):
+    """Parses the lines of a channel into rows of the session time (in seconds) followed by the logged values"""
+    import numpy as np
+
+    blocks = list[np.ndarray]()
+
+    for path in paths:
+        with openFile(path) as file:
+            remainder = b""
+
+            while True:
+                chunk = file.read(BLOCK_SIZE)
+                content = remainder + chunk
+
+                # The last line of a block is parsed along with the next block, unless the file has ended
+                if chunk:
+                    content, _, remainder = content.rpartition(b"\n")
+
+                # Matching whole blocks and converting the values in bulk is much faster than handling each line
+                # Lines that don't match the layout (such as partially written lines) are skipped
+                matches = pattern.findall(content)
+                if len(matches) > 0:
+                    values = np.array(matches, dtype=np.bytes_).astype(np.float64)
+                    sessionTime = values[:, 0] * 3600 + values[:, 1] * 60 + values[:, 2]
+                    blocks.append(np.column_stack([sessionTime, values[:, 3:]]))
+
+                if not chunk:
+                    break
+
+    if len(blocks) == 0:
+        return np.empty((0, 1 + columnCount))
+
+    return np.concatenate(blocks)
+
+
+def fixAllDataLabels(motors: dict[int, "np.ndarray"]):
+    """
+    Motor lines logged from SEND_ALL_DATA packets were labelled one field off: "Frequency" held the amplitude, and so on, with "Phase" holding the frequency of the next motor.
+    The frequency of the first motor wasn't logged at all.
+
+    Rows can only be matched across motors if every motor logged the same number of lines.
+    """
+    import numpy as np
+
+    if len(motors) != MOTOR_COUNT or len({len(rows) for rows in motors.values()}) != 1:
+        return False
+
+    fixed = dict[int, np.ndarray]()
+    for i, rows in motors.items():
+        frequency = motors[i - 1][:, 5] if i > 0 else np.full(len(rows), np.nan)
+        fixed[i] = np.column_stack([rows[:, 0], frequency, rows[:, 1:5]])
+
+    motors.update(fixed)
+    return True
+
+
+def convertSession(directory: str, force: bool = False, fixLabels: bool = False):
+    """Converts a single session, returning the number of rows converted (0 when the session is up to date)"""
+    import numpy as np
+
+    output = os.path.join(directory, OUTPUT_FILE)
+    channels = textSegments(directory)
+
+    motorPaths = {i: channels[f"Motor{i}"] for i in range(MOTOR_COUNT) if f"Motor{i}" in channels}
+    imuPaths = channels.get("IMU", [])
+
+    sources = [path for paths in motorPaths.values() for path in paths] + imuPaths
+    if len(sources) == 0:
+        return 0
+
+    # The output is up to date if it was written after every log it was converted from
+    if not force and os.path.exists(output):
+        if os.path.getmtime(output) >= max(os.path.getmtime(path) for path in sources):
+            return 0
+
+    arrays = dict[str, np.ndarray]()
+    motors = {
+        i: parseChannel(paths, MOTOR_LINE, len(MOTOR_COLUMNS))
+        for i, paths in motorPaths.items()
+    }
+
+    if fixLabels and not fixAllDataLabels(motors):
+        print(f"{directory}: motor logs don't line up, labels were left as logged")
+
+    for i, rows in motors.items():
+        arrays[f"motor{i}_sessionTime"] = rows[:, 0]
+        for column, name in enumerate(MOTOR_COLUMNS):
+            arrays[f"motor{i}_{name}"] = rows[:, column + 1].astype(np.float32)
+
+    if len(imuPaths) > 0:
+        rows = parseChannel(imuPaths, IMU_LINE, len(IMU_COLUMNS))
+
+        arrays["imu_sessionTime"] = rows[:, 0]
+        for column, name in enumerate(IMU_COLUMNS):
+            dtype = np.uint32 if name.endswith("_time") else np.uint8 if name.endswith("_status") else np.float32
+            arrays[f"imu_{name}"] = rows[:, column + 1].astype(dtype)
+
+    # Written under a temporary name, so an interrupted conversion never leaves a partial output behind
+    temporary = output + ".tmp"
+    with open(temporary, "wb") as file:
+        np.savez(file, **arrays)  # type: ignore
+    os.replace(temporary, output)
+
+    return sum(len(rows) for rows in motors.values()) + len(arrays.get("imu_sessionTime", ()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Converts Motor and IMU text logs into per session .npz files")
+    parser.add_argument("--root", default=LOG_DIRECTORY)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--force", action="store_true", help="Convert sessions that are already up to date")
+    parser.add_argument(
+        "--fix-all-data-labels",
+        action="store_true",
+        help="Correct the shifted motor labels of logs written from SEND_ALL_DATA packets",
+    )
+    args = parser.parse_args()
+
+    directories = [os.path.join(args.root, path) for path in sessionDirectories(args.root)]
+
+    startTime = time.perf_counter()
+    totalRows = converted = 0
+
+    # Sessions are independent, and parsing is CPU bound, so each session is converted in its own process
+    with ProcessPoolExecutor(args.workers) as executor:
+        futures = {
+            executor.submit(convertSession, directory, args.force, args.fix_all_data_labels): directory
+            for directory in directories
+        }
+
+        for future in as_completed(futures):
+            try:
+                rows = future.result()
+            except (OSError, ValueError) as e:
+                print(f"{futures[future]}: failed ({e!r})")
+                continue
+
+            if rows == 0:
+                continue
+
+            converted += 1
+            totalRows += rows
+
+            elapsed = time.perf_counter() - startTime
+            print(f"{futures[future]}: {rows} rows ({totalRows / elapsed:.0f} rows/s overall)")
+
+    elapsed = time.perf_counter() - startTime
+    print(
+        f"Converted {converted} of {len(directories)} sessions, {totalRows} rows in {elapsed:.1f}s ({totalRows / max(elapsed, 1e-9):.0f} rows/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+# Records everything that crosses the link of an EDMO (and the input of its players), and replays it through a session
+#
+#   MAGIC | header length (uint32) | JSON header | records...
+#
+# Each record is a monotonic timestamp in nanoseconds, the kind of record, the number of the player (if any), and the data
+#
+# Usage (replaying):
+#   python LinkCapture.py <capture> [--realtime]
+
+import argparse
+import asyncio
+import json
+import os
+import queue
+import struct
+import threading
+import time
+from datetime import datetime
+from typing import Iterator
+
+from EDMOCommands import EDMOPacket
+from PlayerProtocol import PlayerMessage
+
+MAGIC = b"EDMOCAP1"
+HEADER_LENGTH = struct.Struct("<I")
+RECORD = struct.Struct("<QBBI")
+
+FILE_EXTENSION = "cap"
+
+# Packets received from the EDMO, and written to the EDMO
+INBOUND = 0
+OUTBOUND = 1
+
+# Messages and (dis)connections of players and overriders
+PLAYER_INPUT = 2
+PLAYER_CONNECTED = 3
+PLAYER_DISCONNECTED = 4
+OVERRIDER_INPUT = 5
+OVERRIDER_CONNECTED = 6
+OVERRIDER_DISCONNECTED = 9
+
+# Messages of players and overriders using the binary protocol (see PlayerProtocol.py)
+PLAYER_BINARY_INPUT = 7
+OVERRIDER_BINARY_INPUT = 8
+
+CaptureRecord = tuple[int, int, int, bytes]
+
+
+class LinkCapture:
+    """Writes capture records on a dedicated thread, so capturing doesn't slow down the link"""
+
+    FILE_BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, path: str, identifier: str, capabilities: int):
+        self.path = path
+        self.header = json.dumps(
+            {
+                "identifier": identifier,
+                "capabilities": capabilities,
+                "startTime": datetime.now().isoformat(),
+                "startMonotonicNs": time.monotonic_ns(),
+            }
+        ).encode()
+
+        # Unlike the session log, a capture is useless with holes in it, so nothing is dropped
+        self.queue = queue.SimpleQueue[CaptureRecord | None]()
+        self.writer = threading.Thread(
+            target=self.writeLoop, name=f"LinkCapture {identifier}", daemon=True
+        )
+        self.writer.start()
+
+    def record(self, kind: int, number: int, data: bytes | memoryview | str):
+        if isinstance(data, str):
+            data = data.encode()
+
+        self.queue.put((time.monotonic_ns(), kind, number & 0xFF, bytes(data)))
+
+    def writeLoop(self):
+        # The file is opened here rather than on the event loop, records are queued in the meantime
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path, "wb", buffering=self.FILE_BUFFER_SIZE)
+        self.file.write(MAGIC + HEADER_LENGTH.pack(len(self.header)) + self.header)
+
+        while (entry := self.queue.get()) is not None:
+            timestamp, kind, number, data = entry
+            self.file.write(RECORD.pack(timestamp, kind, number, len(data)))
+            self.file.write(data)
+
+        self.file.close()
+
+    def close(self):
+        """Writes the remaining records and closes the file. Blocks until done."""
+        self.queue.put(None)
+        self.writer.join()
+
+
+def readCapture(path: str):
+    """Reads the header and all records of a capture"""
+    with open(path, "rb") as file:
+        content = file.read()
+
+    if not content.startswith(MAGIC):
+        raise ValueError(f"{path} is not a link capture")
+
+    (length,) = HEADER_LENGTH.unpack_from(content, len(MAGIC))
+    offset = len(MAGIC) + HEADER_LENGTH.size
+    header = json.loads(content[offset : offset + length])
+
+    return header, list(iterateRecords(content, offset + length))
+
+
+def iterateRecords(content: bytes, offset: int) -> Iterator[CaptureRecord]:
+    view = memoryview(content)
+
+    # A record may have been partially written if the server was stopped abruptly
+    while offset + RECORD.size <= len(content):
+        timestamp, kind, number, length = RECORD.unpack_from(content, offset)
+        offset += RECORD.size
+
+        if offset + length > len(content):
+            return
+
+        yield timestamp, kind, number, bytes(view[offset : offset + length])
+        offset += length
+
+
+# region REPLAY
+
+
+class ReplayTransport:
+    """Stands in for the serial transport, counting what the session writes to the EDMO"""
+
+    def __init__(self):
+        self.writes = 0
+        self.bytesWritten = 0
+
+    def write(self, data: bytes):
+        self.writes += 1
+        self.bytesWritten += len(data)
+
+
+class ReplayPeer:
+    """Stands in for the WebRTC peer of a player, counting what the session sends to it"""
+
+    def __init__(self):
+        self.onMessage = list()
+        self.onConnectCallbacks = list()
+        self.onDisconnectCallbacks = list()
+        self.onClosedCallbacks = list()
+
+        self.messagesSent = 0
+        self.bytesSent = 0
+        self.lastMessageTime: float | None = None
+
+    def send(self, message: str | PlayerMessage):
+        if isinstance(message, PlayerMessage):
+            message = message.text()
+
+        self.messagesSent += 1
+        self.bytesSent += len(message)
+
+    def receive(self, message: str | bytes):
+        self.lastMessageTime = time.perf_counter()
+
+        for callback in self.onMessage:
+            callback(message)
+
+    def connect(self):
+        for callback in self.onConnectCallbacks:
+            callback()
+
+    def disconnect(self):
+        for callback in self.onDisconnectCallbacks:
+            callback()
+
+    async def close(self):
+        pass
+
+
+async def replay(path: str, realtime: bool = False):
+    """
+    Feeds a capture through a session: packets from the EDMO go through the serial protocol's parsing, and player messages through the player input path.
+
+    Every update of a session ends with a GET_TIME packet, so the session is updated wherever the capture contains one.
+    This keeps the order of updates and inputs the same as in the capture, regardless of how fast the replay runs.
+    With realtime, records are fed at the pace they were captured, otherwise as fast as possible.
+    """
+    from EDMOCommands import EDMOCommands
+    from EDMOSerial import SerialProtocol
+    from EDMOSession import EDMOSession
+    from FusedCommunication import FusedCommunicationProtocol
+
+    header, records = readCapture(path)
+
+    transport = ReplayTransport()
+    serial = SerialProtocol()
+    serial.transport = transport  # type: ignore
+    serial.identifier = header["identifier"]
+    serial.capabilities = header["capabilities"]
+    serial.identifying = False
+
+    protocol = FusedCommunicationProtocol(serial.identifier)
+    protocol.bind(serial)
+
+    session = EDMOSession(protocol, EDMOSession.MAX_PLAYER_COUNT, lambda _: None)
+    # Sessions remove themselves once the last player leaves, a replay keeps going until the end of the capture
+    session.removeSelf = lambda _: None
+
+    players = dict[tuple[bool, int], ReplayPeer]()
+    peers = list[ReplayPeer]()
+    counts = dict[int, int]()
+
+    if len(records) == 0:
+        await session.close()
+        return {}
+
+    loop = asyncio.get_running_loop()
+    captureStart = records[0][0]
+    replayStart = loop.time()
+    startTime = time.perf_counter()
+
+    updateMarker = EDMOPacket.constant(EDMOCommands.GET_TIME)
+
+    for index, (timestamp, kind, number, data) in enumerate(records):
+        counts[kind] = counts.get(kind, 0) + 1
+
+        if realtime:
+            delay = replayStart + (timestamp - captureStart) / 1e9 - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elif index % 1000 == 0:
+            # Lets the session's own tasks (such as throttled sends) run
+            await asyncio.sleep(0)
+
+        if kind == INBOUND:
+            serial.data_received(data)
+        elif kind == OUTBOUND:
+            if data == updateMarker:
+                await session.update()
+        elif kind in (PLAYER_CONNECTED, OVERRIDER_CONNECTED):
+            peer = players[(kind == OVERRIDER_CONNECTED, number)] = ReplayPeer()
+            peers.append(peer)
+
+            if kind == PLAYER_CONNECTED:
+                session.registerPlayer(peer, data.decode())  # type: ignore
+            else:
+                session.registerOverrider(peer, number)  # type: ignore
+
+            peer.connect()
+        elif kind in (PLAYER_INPUT, OVERRIDER_INPUT):
+            peer = players.get((kind == OVERRIDER_INPUT, number))
+            if peer is not None:
+                peer.receive(data.decode())
+        elif kind in (PLAYER_BINARY_INPUT, OVERRIDER_BINARY_INPUT):
+            peer = players.get((kind == OVERRIDER_BINARY_INPUT, number))
+            if peer is not None:
+                peer.receive(data)
+        elif kind in (PLAYER_DISCONNECTED, OVERRIDER_DISCONNECTED):
+            peer = players.pop((kind == OVERRIDER_DISCONNECTED, number), None)
+            if peer is not None:
+                peer.disconnect()
+
+    elapsed = time.perf_counter() - startTime
+    await session.close()
+
+    return {
+        "records": len(records),
+        "captureDuration": (records[-1][0] - captureStart) / 1e9,
+        "replayDuration": elapsed,
+        "recordsPerSecond": len(records) / elapsed if elapsed > 0 else 0,
+        "inbound": counts.get(INBOUND, 0),
+        "inputs": sum(
+            counts.get(kind, 0) for kind in (PLAYER_INPUT, OVERRIDER_INPUT, PLAYER_BINARY_INPUT, OVERRIDER_BINARY_INPUT)
+        ),
+        "capturedWrites": counts.get(OUTBOUND, 0),
+        "replayedWrites": transport.writes,
+        "messagesToPlayers": sum(peer.messagesSent for peer in peers),
+    }
+
+
+# endregion
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays a link capture through a session")
+    parser.add_argument("capture")
+    parser.add_argument(
+        "--realtime", action="store_true", help="Replay at the pace of the capture, rather than as fast as possible"
+    )
+    args = parser.parse_args()
+
+    result = asyncio.run(replay(args.capture, args.realtime))
+
+    for key, value in result.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
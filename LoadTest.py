@@ -0,0 +1,164 @@
+# Measures how the server holds up as the number of EDMOs grows, using a simulated fleet (see Simulator.py)
+#
+# The server runs in this process, the fleet in a separate one, so the CPU used by each can be told apart.
+# A session is started for every EDMO, as if a player had joined it.
+#
+# Usage:
+#   python LoadTest.py --robots 10,50,100,200 --rate 50 --transport udp --duration 10
+
+import argparse
+import asyncio
+import multiprocessing
+import time
+from multiprocessing.connection import Connection
+
+from EDMOBackend import EDMOBackend
+from EDMOSerial import EDMOSerial
+from EDMOUdp import EDMOUdp
+from Simulator import DISCOVERY_PORT, SimulatedFleet
+
+
+# region SIMULATOR PROCESS
+
+
+def runFleet(connection: Connection, count: int, rate: float, transport: str, prefix: str):
+    asyncio.run(serveFleet(connection, count, rate, transport, prefix))
+
+
+async def serveFleet(connection: Connection, count: int, rate: float, transport: str, prefix: str):
+    """Runs a fleet, answering the requests of the load test over the connection"""
+    fleet = SimulatedFleet(count, rate, prefix)
+
+    if transport == "udp":
+        await fleet.startUdp("127.0.0.1")
+        connection.send([])
+    else:
+        connection.send(fleet.startPty())
+
+    stopped = asyncio.Event()
+
+    def onRequest():
+        request = connection.recv()
+
+        if request == "reset":
+            fleet.resetStats()
+        elif request == "stats":
+            connection.send(fleet.stats())
+        elif request == "stop":
+            stopped.set()
+
+    asyncio.get_running_loop().add_reader(connection.fileno(), onRequest)
+
+    await stopped.wait()
+    fleet.close()
+
+
+# endregion
+
+
+def sessionCounters(backend: EDMOBackend):
+    """The telemetry received by each session, and the ticks of their timers"""
+    return {
+        identifier: {
+            "received": session.imuTelemetry.total,
+            "timer": backend.sessionTimers[identifier].stats(),
+        }
+        for identifier, session in backend.activeSessions.items()
+    }
+
+
+async def measure(
+    backend: EDMOBackend, count: int, rate: float, transport: str, duration: float
+):
+    prefix = f"Sim{count}_"
+    connection, child = multiprocessing.Pipe()
+    simulator = multiprocessing.Process(
+        target=runFleet, args=(child, count, rate, transport, prefix), daemon=True
+    )
+    simulator.start()
+
+    devices = await asyncio.to_thread(connection.recv)
+    EDMOSerial.EXTRA_PORTS = devices
+
+    # Wait for the server to find every EDMO
+    deadline = time.monotonic() + 30
+    while True:
+        identifiers = [i for i in backend.activeEDMOs if i.startswith(prefix)]
+
+        if len(identifiers) == count:
+            break
+
+        if time.monotonic() > deadline:
+            print(f"Only found {len(identifiers)} of {count} EDMOs")
+            break
+
+        await asyncio.sleep(0.1)
+
+    for identifier in identifiers:
+        backend.getEDMOSession(identifier)
+
+    # Let the sessions settle before measuring
+    await asyncio.sleep(1)
+
+    connection.send("reset")
+    before = sessionCounters(backend)
+    startCpu = time.process_time()
+    startTime = time.monotonic()
+
+    await asyncio.sleep(duration)
+
+    elapsed = time.monotonic() - startTime
+    serverCpu = (time.process_time() - startCpu) / elapsed
+    after = sessionCounters(backend)
+
+    connection.send("stats")
+    fleet = await asyncio.to_thread(connection.recv)
+
+    sent = sum(robot["telemetrySent"] for robot in fleet["robots"].values())
+    received = sum(after[i]["received"] - before[i]["received"] for i in after)
+    ticks = sum(after[i]["timer"]["ticks"] - before[i]["timer"]["ticks"] for i in after)
+    timeRequests = sum(robot["timeRequests"] for robot in fleet["robots"].values())
+    overruns = sum(after[i]["timer"]["overruns"] - before[i]["timer"]["overruns"] for i in after)
+    skipped = sum(after[i]["timer"]["skippedTicks"] - before[i]["timer"]["skippedTicks"] for i in after)
+    lateness = max((after[i]["timer"]["maxLateness"] for i in after), default=0)
+
+    print(
+        f"{len(identifiers):>5} robots | server CPU {serverCpu:6.1%} ({serverCpu / max(len(identifiers), 1) * 1000:5.2f} ms/s per robot)"
+        f" | telemetry loss {1 - received / max(sent, 1):6.2%} ({received}/{sent})"
+        f" | GET_TIME loss {1 - timeRequests / max(ticks, 1):6.2%}"
+        f" | tick overruns {overruns} (skipped {skipped}, max lateness {lateness * 1000:.1f} ms)"
+        f" | simulator CPU {fleet['cpu']:.1%}"
+    )
+
+    for identifier in identifiers:
+        backend.removeSession(backend.activeSessions[identifier])
+
+    connection.send("stop")
+    await asyncio.to_thread(simulator.join, 10)
+    EDMOSerial.EXTRA_PORTS = []
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Load tests the server with simulated EDMOs")
+    parser.add_argument("--robots", default="10,50,100", help="Comma separated fleet sizes")
+    parser.add_argument("--rate", type=float, default=50, help="SEND_ALL_DATA packets per second, per robot")
+    parser.add_argument("--transport", choices=("udp", "pty"), default="udp")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds measured per fleet size")
+    args = parser.parse_args()
+
+    EDMOUdp.DISCOVERY_ADDRESSES = [("127.0.0.1", DISCOVERY_PORT)]
+
+    backend = EDMOBackend()
+    await backend.fusedCommunication.initialize()
+    backend.discoveryTimer.start()
+
+    try:
+        for count in (int(c) for c in args.robots.split(",")):
+            await measure(backend, count, args.rate, args.transport, args.duration)
+    finally:
+        backend.discoveryTimer.stop()
+        backend.fusedCommunication.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
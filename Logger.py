@@ -1,53 +1,316 @@
-from datetime import datetime
-import aiofiles
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import asyncio
 import os
+import queue
+import threading
+import time
+from typing import IO
+
+from EDMOCodecs import CODECS
+from SessionIndex import LOG_DIRECTORY, addToIndex
+from TelemetryLog import FILE_EXTENSION, TIMESTAMP, createHeader
+from Utilities import Metrics
+from Utilities.Compression import compressFile
+
+# An entry is the monotonic time it was written, the channel, and the message
+# Text channels are named, telemetry channels are identified by their instruction
+LogEntry = tuple[int, str | int, object]
+
+
+class LogSegment:
+    """An open log file, which is rotated once it becomes too large or too old"""
+
+    def __init__(self, path: str, file: IO):
+        self.path = path
+        self.file = file
+        self.size = 0
+        self.openedAt = time.monotonic()
+
+    def write(self, data: str | bytes | memoryview):
+        self.file.write(data)  # type: ignore
+
+        # Text is counted in bytes as it ends up on disk (UTF-8), most of it is ASCII and needs no encoding to count
+        if isinstance(data, str) and not data.isascii():
+            self.size += len(data.encode())
+        else:
+            self.size += len(data)
 
 
 class SessionLogger:
+    # The maximum number of entries waiting to be written, which caps the memory used by the logger (roughly 300 bytes per entry)
+    # Entries written while the queue is full are dropped and counted, rather than growing without bound
+    MAX_QUEUED_ENTRIES = 100_000
+
+    # The interval (in seconds) at which written entries are flushed to disk
+    FLUSH_INTERVAL = 5
+
+    FILE_BUFFER_SIZE = 64 * 1024
+
+    # A log file is rotated once it reaches either limit (in bytes, and seconds respectively)
+    # Rotated files are numbered in order, and compressed in the background (as is the last file of each channel, once the logger is closed)
+    MAX_SEGMENT_SIZE = 16 * 1024 * 1024
+    MAX_SEGMENT_AGE = 15 * 60
+
+    # Compression is shared by all loggers, and done on its own thread so it doesn't hold up writing
+    compressor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="LogCompression")
+
+    # Loggers that haven't been closed yet, and what was written and dropped by those that have (for /metrics)
+    openLoggers = set["SessionLogger"]()
+    closedBytesWritten = 0
+    closedDroppedEntries = 0
+
     def __init__(self, name: str):
         self.name = name
-        self.channels = dict[str, list[str]]()
         self.sessionStartTime = datetime.now()
-        self.lastFlushTime = self.sessionStartTime
-        path = self.directoryName = f"./SessionLogs/{self.sessionStartTime.strftime(f"%Y.%m.%d/{self.name}/%H.%M.%S")}"
+        self.sessionStartMonotonicNs = time.monotonic_ns()
+        self.directoryName = f"{LOG_DIRECTORY}/{self.sessionStartTime.strftime(f"%Y.%m.%d/{self.name}/%H.%M.%S")}"
 
-        if not os.path.exists(path):
-            os.makedirs(path)
+        # Only cheap tuples are created by the writers
+        # Formatting and writing happens on a dedicated thread, keeping it off the event loop
+        self.queue = queue.Queue[LogEntry | None](self.MAX_QUEUED_ENTRIES)
+        self.droppedEntries = dict[str | int, int]()
+        self.closed = False
 
-        pass
+        # Only updated by the writer thread
+        self.bytesWritten = 0
+        self.writeErrors = 0
+        self.failedChannels = set[str | int]()
+        self.openLoggers.add(self)
 
-    def write(self, channel: str, message: str):
-        if channel not in self.channels:
-            self.channels[channel] = []
+        self.writer = threading.Thread(
+            target=self.writeLoop, name=f"SessionLogger {name}", daemon=True
+        )
+        self.writer.start()
 
-        sessionTime = datetime.now() - self.sessionStartTime
-        self.channels[channel].append(f"{str(sessionTime)}: {message}\n")
         pass
 
-    async def flush(self):
-        for channel in list(self.channels.keys()):
-            channelContent = self.channels[channel]
+    def write(self, channel: str, message: object):
+        """Adds a message to the channel. The message is only converted to a string by the writer thread."""
+        self.enqueue((time.monotonic_ns(), channel, message))
+
+    def writeTelemetry(self, instruction: int, data: bytes | memoryview):
+        """Adds the raw data of a packet to the binary telemetry file of its kind, along with the time it was received"""
+        self.enqueue((time.monotonic_ns(), instruction, data))
+
+    def enqueue(self, entry: LogEntry):
+        if self.closed:
+            return
+
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            channel = entry[1]
+            self.droppedEntries[channel] = self.droppedEntries.get(channel, 0) + 1
+
+    async def close(self):
+        """Writes all remaining entries and closes the log files"""
+        if self.closed:
+            return
+
+        self.closed = True
+        await asyncio.to_thread(self.drain)
+
+        SessionLogger.closedBytesWritten += self.bytesWritten
+        SessionLogger.closedDroppedEntries += sum(self.droppedEntries.values())
+        self.openLoggers.discard(self)
+
+        # Indexing is queued behind the compression of the segments, so the index refers to the compressed files
+        self.compressor.submit(addToIndex, self.directoryName)
+
+    def drain(self):
+        # If the writer thread died, nothing will make room in a full queue
+        while self.writer.is_alive():
+            try:
+                self.queue.put(None, timeout=1)
+                break
+            except queue.Full:
+                continue
+
+        self.writer.join()
+
+        if self.writeErrors > 0:
+            print(f"Session log {self.name} failed to write {self.writeErrors} times")
+
+    # region WRITER THREAD
+
+    def writeLoop(self):
+        os.makedirs(self.directoryName, exist_ok=True)
+
+        segments = dict[str | int, LogSegment]()
+        segmentCounts = dict[str | int, int]()
+        reportedDrops = dict[str | int, int]()
+        lastFlushTime = time.monotonic()
+
+        while True:
+            try:
+                entry = self.queue.get(timeout=self.FLUSH_INTERVAL)
 
-            if len(channelContent) == 0:
+                if entry is None:
+                    break
+
+                try:
+                    segment = self.writeEntry(segments, entry)
+
+                    if segment.size >= self.MAX_SEGMENT_SIZE:
+                        self.rotate(segments, segmentCounts, entry[1])
+                except Exception as e:
+                    self.writeFailed(entry[1], e)
+            except queue.Empty:
+                pass
+
+            # Let's not constantly write to disk
+            currTime = time.monotonic()
+            if currTime - lastFlushTime < self.FLUSH_INTERVAL:
+                continue
+
+            lastFlushTime = currTime
+
+            try:
+                self.reportDrops(segments, reportedDrops)
+            except Exception as e:
+                self.writeFailed("Session", e)
+
+            for channel, segment in list(segments.items()):
+                try:
+                    if currTime - segment.openedAt >= self.MAX_SEGMENT_AGE:
+                        self.rotate(segments, segmentCounts, channel)
+                    else:
+                        segment.file.flush()
+                except Exception as e:
+                    self.writeFailed(channel, e)
+
+        try:
+            self.reportDrops(segments, reportedDrops)
+        except Exception as e:
+            self.writeFailed("Session", e)
+
+        for channel, segment in segments.items():
+            try:
+                segment.file.close()
+            except Exception as e:
+                self.writeFailed(channel, e)
                 continue
 
-            async with aiofiles.open(
-                f"{self.directoryName}/{channel}.log", "a+"
-            ) as log:
-                await log.writelines(channelContent)
+            self.compressor.submit(compressFile, segment.path)
+
+    def writeFailed(self, channel: str | int, error: Exception):
+        """Counts an entry that couldn't be written (a full disk, a message that can't be formatted), the writer carries on regardless"""
+        self.writeErrors += 1
+
+        # Only the first failure of each channel is reported, a full disk would otherwise report every entry
+        if channel not in self.failedChannels:
+            self.failedChannels.add(channel)
+            print(f"Session log {self.name} failed to write to {self.channelName(channel)}: {error!r}")
+
+    def writeEntry(self, segments: dict[str | int, LogSegment], entry: LogEntry):
+        timestamp, channel, message = entry
+
+        segment = segments.get(channel)
+        if segment is None:
+            segment = segments[channel] = self.openSegment(channel)
+
+        size = segment.size
+
+        if isinstance(channel, int):
+            segment.write(TIMESTAMP.pack(timestamp))
+            segment.write(message)  # type: ignore
+        else:
+            sessionTime = timedelta(
+                microseconds=(timestamp - self.sessionStartMonotonicNs) // 1000
+            )
+            segment.write(f"{sessionTime}: {message}\n")
+
+        self.bytesWritten += segment.size - size
 
-            channelContent.clear()
+        return segment
 
-    async def update(self):
-        currTime  = datetime.now()
-        deltaTime = (currTime - self.lastFlushTime).total_seconds()
+    def reportDrops(
+        self, segments: dict[str | int, LogSegment], reportedDrops: dict[str | int, int]
+    ):
+        """Notes the entries dropped since the last report in the session log"""
+        # Copying is atomic, the dictionary may be modified by the event loop in the meantime
+        dropped = dict(self.droppedEntries)
 
-        # Let's not constantly write to file
-        if deltaTime < 5:
+        newDrops = {
+            channel: count - reportedDrops.get(channel, 0)
+            for channel, count in dropped.items()
+            if count != reportedDrops.get(channel, 0)
+        }
+
+        if len(newDrops) == 0:
             return
 
-        await self.flush()
+        reportedDrops.update(dropped)
+
+        summary = ", ".join(
+            f"{self.channelName(channel)}: {count}" for channel, count in newDrops.items()
+        )
+        self.writeEntry(
+            segments,
+            (time.monotonic_ns(), "Session", f"Log queue full, dropped entries ({summary})"),
+        )
+
+    def rotate(
+        self,
+        segments: dict[str | int, LogSegment],
+        segmentCounts: dict[str | int, int],
+        channel: str | int,
+    ):
+        segment = segments.pop(channel)
+        segment.file.close()
+
+        index = segmentCounts[channel] = segmentCounts.get(channel, 0) + 1
+        base, extension = os.path.splitext(segment.path)
+        rotatedPath = f"{base}.{index}{extension}"
+
+        os.replace(segment.path, rotatedPath)
+        self.compressor.submit(compressFile, rotatedPath)
+
+    def channelName(self, channel: str | int):
+        return channel if isinstance(channel, str) else CODECS[channel].name
+
+    def openSegment(self, channel: str | int):
+        if isinstance(channel, str):
+            path = f"{self.directoryName}/{channel}.log"
+            return LogSegment(
+                path, open(path, "a", buffering=self.FILE_BUFFER_SIZE, encoding="utf-8")
+            )
+
+        codec = CODECS[channel]
+        path = f"{self.directoryName}/{codec.name}.{FILE_EXTENSION}"
+        segment = LogSegment(path, open(path, "ab", buffering=self.FILE_BUFFER_SIZE))
 
-        self.lastFlushTime = currTime
+        # Every segment is a new file, so the header is always written as the start of the file
+        segment.write(
+            createHeader(
+                channel, codec, self.sessionStartTime, self.sessionStartMonotonicNs
+            )
+        )
+
+        return segment
+
+    # endregion
 
     pass
+
+
+@Metrics.register
+def collectMetrics(exposition: Metrics.Exposition):
+    loggers = list(SessionLogger.openLoggers)
+
+    exposition.family("edmo_log_bytes_written_total", "counter", "Bytes written to session logs (before compression)")
+    exposition.sample(
+        "edmo_log_bytes_written_total",
+        SessionLogger.closedBytesWritten + sum(logger.bytesWritten for logger in loggers),
+    )
+
+    exposition.family("edmo_log_queued_entries", "gauge", "Log entries waiting to be written")
+    exposition.sample("edmo_log_queued_entries", sum(logger.queue.qsize() for logger in loggers))
+
+    exposition.family("edmo_log_dropped_entries_total", "counter", "Log entries dropped because the queue was full")
+    exposition.sample(
+        "edmo_log_dropped_entries_total",
+        SessionLogger.closedDroppedEntries
+        + sum(sum(logger.droppedEntries.values()) for logger in loggers),
+    )
@@ -0,0 +1,161 @@
+# Checks that batched oscillator updates leave an EDMO in the same state as one update per motor
+#
+# Two sessions receive the same random slider input, one talking to a simulated EDMO that supports batched oscillators,
+#  and one to a simulated EDMO that doesn't. After every tick, both EDMOs must run the same oscillators as the session.
+#
+# The sessions log as they would on a server, into a temporary directory that is removed afterwards.
+#
+# Usage:
+#   python OscillatorCheck.py --ticks 2000 --seed 1
+
+import argparse
+import asyncio
+import os
+import random
+import struct
+import sys
+import tempfile
+
+from EDMOCommands import EDMOCapabilities
+from EDMOSerial import SerialProtocol
+from EDMOSession import EDMOSession
+from FusedCommunication import FusedCommunicationProtocol
+from Logger import SessionLogger
+from Simulator import SimulatedEDMO
+
+# Motor parameters are sent as 32 bit floats
+FLOAT_STRUCT = struct.Struct("<f")
+
+
+class SimulatedLink:
+    """Carries the bytes written to a serial protocol straight to a simulated EDMO, and its answers back"""
+
+    def __init__(self, edmo: SimulatedEDMO):
+        self.edmo = edmo
+
+    def write(self, data: bytes):
+        self.edmo.dataReceived(data)
+
+
+def connect(identifier: str, capabilities: int):
+    """A session bound to a simulated EDMO, identified over the link as a real one would be"""
+    edmo = SimulatedEDMO(identifier, capabilities)
+
+    serial = SerialProtocol()
+    edmo.write = serial.data_received
+    serial.connection_made(SimulatedLink(edmo))  # type: ignore
+
+    protocol = FusedCommunicationProtocol(identifier)
+    protocol.bind(serial)
+
+    session = EDMOSession(protocol, 4, lambda _: None)
+    return session, edmo
+
+
+def expectedOscillators(session: EDMOSession):
+    def single(value: float):
+        return FLOAT_STRUCT.unpack(FLOAT_STRUCT.pack(value))[0]
+
+    return [
+        [single(motor._freq), single(motor._amp), single(motor._offset), single(motor._phaseShift)]
+        for motor in session.motors
+    ]
+
+
+def randomInput(rng: random.Random, motorCount: int):
+    """The slider changes made during a tick, a tick may not change anything"""
+    changes = list[tuple[int, str, float]]()
+
+    for _ in range(rng.choice((0, 1, 1, 2, 4))):
+        parameter = rng.choice(("amp", "off", "phb", "freq"))
+        match parameter:
+            case "amp":
+                value = rng.uniform(0, 90)
+            case "off":
+                value = rng.uniform(0, 180)
+            case "phb":
+                value = rng.uniform(0, 360)
+            case _:
+                value = rng.uniform(0, 2)
+
+        changes.append((rng.randrange(motorCount), parameter, round(value, rng.choice((0, 1, 3)))))
+
+    return changes
+
+
+async def check(ticks: int, rng: random.Random):
+    """Runs the sessions for a number of ticks, returning the number of ticks after which the EDMOs didn't match"""
+    batched, batchedEDMO = connect("BatchedCheck", EDMOCapabilities.BATCHED_OSCILLATORS)
+    perMotor, perMotorEDMO = connect("PerMotorCheck", EDMOCapabilities.NONE)
+
+    mismatches = 0
+
+    for tick in range(ticks):
+        changes = randomInput(rng, len(batched.motors))
+
+        # Now and then the EDMO reconnects, which resends every motor
+        keyframe = rng.random() < 0.02
+
+        for session in (batched, perMotor):
+            for motor, parameter, value in changes:
+                if parameter == "freq":
+                    session.setFreq(value)
+                else:
+                    session.motors[motor].adjustFrom(f"{parameter} {value}")
+
+            if keyframe:
+                session.keyframeRequested = True
+
+            await session.update()
+
+        expected = expectedOscillators(batched)
+
+        if expectedOscillators(perMotor) != expected:
+            print(f"tick {tick}: the sessions diverged")
+            mismatches += 1
+        elif batchedEDMO.oscillators != expected or perMotorEDMO.oscillators != expected:
+            if mismatches < 10:
+                print(f"tick {tick}: expected {expected}")
+                print(f"  batched   {batchedEDMO.oscillators}")
+                print(f"  per motor {perMotorEDMO.oscillators}")
+            mismatches += 1
+
+    print(f"{ticks} ticks")
+    print(f"  batched:   {batchedEDMO.oscillatorUpdates} packets, {batched.oscillatorUpdatesSent} motor updates")
+    print(f"  per motor: {perMotorEDMO.oscillatorUpdates} packets, {perMotor.oscillatorUpdatesSent} motor updates")
+
+    await batched.close()
+    await perMotor.close()
+
+    return mismatches
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Checks batched oscillator updates against one update per motor")
+    parser.add_argument("--ticks", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    # Session logs are written relative to the working directory, the tasks are loaded before leaving it
+    EDMOSession.loadTasks()
+    workingDirectory = os.getcwd()
+
+    with tempfile.TemporaryDirectory() as logDirectory:
+        os.chdir(logDirectory)
+
+        try:
+            mismatches = await check(args.ticks, random.Random(args.seed))
+        finally:
+            # Closed sessions are compressed and indexed in the background, which has to finish before the directory is removed
+            SessionLogger.compressor.submit(int).result()
+            os.chdir(workingDirectory)
+
+    if mismatches > 0:
+        print(f"{mismatches} ticks left the EDMOs in a different state")
+        sys.exit(1)
+
+    print("  both EDMOs matched the sessions after every tick")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
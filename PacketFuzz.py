@@ -0,0 +1,169 @@
+# Fuzzes the packet framing, escaping and decoding, checking that every packet survives the round trip
+#
+# Random data (biased towards the bytes that need escaping) is framed into packets, streamed through EDMOPacketDecoder
+#  in random chunks and parsed again. Unescaping is also compared against the per byte loop it replaced,
+#  and a few packets that were once mishandled are checked as regressions.
+#
+# Usage:
+#   python PacketFuzz.py --iterations 20000 --seed 1
+
+import argparse
+import random
+import sys
+
+from EDMOCommands import EDMOCommands, EDMOPacket, EDMOPacketDecoder
+
+# Bytes that are part of an escape sequence, a header or a footer
+SENSITIVE_BYTES = b"\\EDMO"
+
+VALID_INSTRUCTIONS = [i for i in range(256) if EDMOCommands.sanitize(i) != EDMOCommands.INVALID]
+
+
+def perByteUnescape(data: bytes):
+    """The unescaping EDMOPacket.unescape used to do, one byte at a time"""
+    unescaped = bytearray()
+    i = 0
+    while i < len(data):
+        if data[i] == EDMOPacket.ESCAPE[0]:
+            i += 1
+            if i >= len(data):
+                break
+
+        unescaped.append(data[i])
+        i += 1
+
+    return bytes(unescaped)
+
+
+def randomData(rng: random.Random, maxLength: int):
+    """Random bytes, roughly half of which need escaping"""
+    return bytes(
+        rng.choice(SENSITIVE_BYTES) if rng.random() < 0.5 else rng.randrange(256)
+        for _ in range(rng.randint(0, maxLength))
+    )
+
+
+def randomChunks(data: bytes, rng: random.Random, maxChunk: int):
+    offset = 0
+    while offset < len(data):
+        size = rng.randint(1, maxChunk)
+        yield data[offset : offset + size]
+        offset += size
+
+
+class Fuzzer:
+    def __init__(self, rng: random.Random, maxLength: int, maxChunk: int):
+        self.rng = rng
+        self.maxLength = maxLength
+        self.maxChunk = maxChunk
+        self.failures = list[str]()
+
+    def fail(self, message: str):
+        if len(self.failures) < 10:
+            print(f"  {message}")
+
+        self.failures.append(message)
+
+    def roundTrip(self, count: int):
+        """Packets framed back to back are decoded from a chunked stream, and parsed to the same instruction and data"""
+        sent = list[tuple[int, bytes]]()
+        stream = bytearray()
+
+        for _ in range(count):
+            instruction = self.rng.choice(VALID_INSTRUCTIONS)
+            data = randomData(self.rng, self.maxLength)
+            sent.append((instruction, data))
+            stream.extend(EDMOPacket.create(instruction, data))
+
+        decoder = EDMOPacketDecoder()
+        packets = list[bytes]()
+        for chunk in randomChunks(bytes(stream), self.rng, self.maxChunk):
+            packets.extend(decoder.feed(chunk))
+
+        if len(packets) != len(sent):
+            self.fail(f"round trip: {len(sent)} packets sent, {len(packets)} decoded")
+            return
+
+        for (instruction, data), packet in zip(sent, packets):
+            command = EDMOPacket.tryParse(packet)
+
+            if command.Instruction != instruction or bytes(command.Data) != data:
+                self.fail(
+                    f"round trip: sent {instruction} {data!r}, parsed {command.Instruction} {bytes(command.Data)!r}"
+                )
+
+    def unescape(self, count: int):
+        """Unescaping arbitrary data, including dangling escapes, matches the per byte loop"""
+        for _ in range(count):
+            data = randomData(self.rng, self.maxLength)
+
+            if self.rng.random() < 0.25:
+                data += EDMOPacket.ESCAPE
+
+            expected = perByteUnescape(data)
+            unescaped = EDMOPacket.unescape(data)
+
+            if unescaped != expected:
+                self.fail(f"unescape: {data!r} gave {unescaped!r}, expected {expected!r}")
+
+    def regressions(self):
+        # Packets too short to hold a header, an instruction and a footer are invalid, but must not raise
+        for packet in (b"", b"E", b"ED", b"EDMO", b"ED\x00M"):
+            self.expectInstruction(packet, EDMOCommands.INVALID)
+
+        # Unknown instructions are reported as invalid
+        self.expectInstruction(b"ED\x63abcMO", EDMOCommands.INVALID)
+
+        # A dangling escape is dropped, the packet still parses
+        self.expectInstruction(b"ED\x01ab\\MO", 1)
+
+        # A header split between two chunks is still found
+        decoder = EDMOPacketDecoder()
+        packet = EDMOPacket.create(EDMOCommands.GET_TIME, b"abc")
+        packets = decoder.feed(b"xyzE") + decoder.feed(packet[1:])
+        if packets != [packet]:
+            self.fail(f"split header: decoded {packets!r}")
+
+        # A packet cut short is dropped in favour of the packet after it
+        decoder = EDMOPacketDecoder()
+        packets = decoder.feed(packet[:-3] + packet)
+        if packets != [packet]:
+            self.fail(f"incomplete packet: decoded {packets!r}")
+
+    def expectInstruction(self, packet: bytes, instruction: int):
+        try:
+            command = EDMOPacket.tryParse(packet)
+        except Exception as e:
+            self.fail(f"tryParse({packet!r}) raised {e!r}")
+            return
+
+        if command.Instruction != instruction:
+            self.fail(f"tryParse({packet!r}) gave {command.Instruction}, expected {instruction}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fuzzes the packet framing, escaping and decoding")
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--max-length", type=int, default=64, help="The longest packet data generated")
+    parser.add_argument("--max-chunk", type=int, default=32, help="Streams are fed in chunks of between 1 and this many bytes")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    fuzzer = Fuzzer(random.Random(args.seed), args.max_length, args.max_chunk)
+
+    fuzzer.regressions()
+    fuzzer.unescape(args.iterations)
+
+    # Round trips are done in batches, so packets are also split across chunks
+    for _ in range(args.iterations // 100):
+        fuzzer.roundTrip(100)
+
+    if len(fuzzer.failures) > 0:
+        print(f"{len(fuzzer.failures)} failures")
+        sys.exit(1)
+
+    print(f"{args.iterations} packets round tripped, {args.iterations} unescapes matched, regressions passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+# Measures how many players the server can handle, using synthetic WebRTC players and a simulated fleet (see Simulator.py)
+#
+# The server runs in a separate process, the players and the EDMOs they control run in this one.
+# Every player completes the same handshake as the web client (/controller/{identifier}), then moves its sliders.
+#
+# The amplitude slider sweeps through distinct values, so each input can be recognised once the server writes it to the EDMO.
+# The time between sending an input and the simulated EDMO receiving it is reported as the input latency.
+# With --binary, players negotiate the binary protocol (see PlayerProtocol.py) instead of exchanging text.
+# With --sync-state, players receive snapshots and deltas of the session state (see SessionState.py).
+#
+# Usage:
+#   python PlayerLoadTest.py --players 4,16,64 --input-rate 20 --duration 10 [--binary] [--sync-state]
+
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import random
+import sys
+import time
+from multiprocessing.connection import Connection
+
+import aiohttp
+import numpy as np
+from aiortc import RTCPeerConnection
+from aiortc.contrib.signaling import object_from_string, object_to_string
+
+import PlayerProtocol
+from Simulator import DISCOVERY_PORT, SimulatedEDMO, SimulatedFleet
+from Utilities.PeriodicTask import PeriodicTask
+
+SERVER_URL = "http://127.0.0.1:8080"
+
+# How often each kind of input is sent, roughly what a player does when moving the sliders
+INPUT_WEIGHTS = {"amp": 50, "off": 15, "freq": 10, "phb": 20, "vote": 5}
+
+# The amplitude sweeps through this many distinct values before repeating
+AMPLITUDE_STEPS = 90
+
+HANDSHAKE_TIMEOUT = 20
+
+
+# region SERVER PROCESS
+
+
+def runServer(connection: Connection, immediateUpdates: bool, logPath: str):
+    # The server prints every message, which would drown out the results
+    sys.stdout = open(logPath, "w")
+    asyncio.run(serveBackend(connection, immediateUpdates))
+
+
+async def serveBackend(connection: Connection, immediateUpdates: bool):
+    """Runs a backend, answering the requests of the load test over the connection"""
+    from EDMOBackend import EDMOBackend
+    from EDMOSession import EDMOSession
+    from EDMOUdp import EDMOUdp
+
+    EDMOUdp.DISCOVERY_ADDRESSES = [("127.0.0.1", DISCOVERY_PORT)]
+    EDMOSession.IMMEDIATE_UPDATES = immediateUpdates
+
+    backend = EDMOBackend()
+    server = asyncio.create_task(backend.run())
+
+    stopped = asyncio.Event()
+    startCpu = time.process_time()
+    startTime = time.monotonic()
+
+    def onRequest():
+        nonlocal startCpu, startTime
+        request = connection.recv()
+
+        if request == "reset":
+            startCpu = time.process_time()
+            startTime = time.monotonic()
+            for timer in backend.sessionTimers.values():
+                timer.maxLateness = 0
+        elif request == "stats":
+            timers = [timer.stats() for timer in backend.sessionTimers.values()]
+            connection.send(
+                {
+                    "cpu": (time.process_time() - startCpu) / max(time.monotonic() - startTime, 1e-9),
+                    "sessions": len(backend.activeSessions),
+                    "maxLateness": max((timer["maxLateness"] for timer in timers), default=0),
+                    "overruns": sum(timer["overruns"] for timer in timers),
+                }
+            )
+        elif request == "stop":
+            stopped.set()
+
+    asyncio.get_running_loop().add_reader(connection.fileno(), onRequest)
+    connection.send("ready")
+
+    await stopped.wait()
+    server.cancel()
+
+    try:
+        await server
+    except asyncio.CancelledError:
+        pass
+
+
+# endregion
+
+
+class SyntheticPlayer:
+    """A player that connects like the web client does, and sends slider input at a steady rate"""
+
+    def __init__(self, name: str, edmo: SimulatedEDMO, binary: bool = False, syncState: bool = False):
+        self.name = name
+        self.edmo = edmo
+        self.binary = binary
+        self.syncState = syncState
+
+        self.pc = RTCPeerConnection()
+        self.channel = self.pc.createDataChannel(
+            "edmo", protocol=PlayerProtocol.BINARY_PROTOCOL if binary else ""
+        )
+        self.channel.on("message", self.onMessage)
+
+        self.number = -1
+        self.numberAssigned = asyncio.Event()
+
+        self.signallingTime: float | None = None
+        self.handshakeTime: float | None = None
+
+        self.amplitude = 0
+        self.offset = 90.0
+        self.frequency = 0.5
+        self.phaseShift = 0.0
+        self.voted = False
+
+        # Amplitudes sent but not yet seen by the EDMO, in the order they were sent
+        self.pending = dict[float, float]()
+
+        self.resetStats()
+
+    def resetStats(self):
+        self.inputsSent = 0
+        self.bytesSent = 0
+        self.messagesReceived = 0
+        self.bytesReceived = 0
+        self.latencies = list[float]()
+        self.superseded = 0
+
+    async def connect(self, http: aiohttp.ClientSession, identifier: str):
+        start = time.perf_counter()
+
+        await self.pc.setLocalDescription(await self.pc.createOffer())
+
+        async with http.ws_connect(f"{SERVER_URL}/controller/{identifier}") as ws:
+            await ws.send_str(
+                json.dumps(
+                    {
+                        "playerName": self.name,
+                        "handshake": object_to_string(self.pc.localDescription),
+                        "stateSync": self.syncState,
+                    }
+                )
+            )
+
+            answer = object_from_string(await ws.receive_str())
+            await self.pc.setRemoteDescription(answer)  # type: ignore
+            self.signallingTime = time.perf_counter() - start
+
+        # The handshake is complete once the server has assigned us a motor
+        await self.numberAssigned.wait()
+        self.handshakeTime = time.perf_counter() - start
+
+    def onMessage(self, message: str | bytes):
+        self.messagesReceived += 1
+        self.bytesReceived += len(message)
+
+        if isinstance(message, bytes):
+            if message[0] == PlayerProtocol.NUMBER:
+                _, self.number = PlayerProtocol.NUMBER_STRUCT.unpack(message)
+                self.numberAssigned.set()
+        elif message.startswith("ID "):
+            self.number = int(message[3:])
+            self.numberAssigned.set()
+
+    def nextInput(self) -> tuple[str, float]:
+        kind = random.choices(list(INPUT_WEIGHTS), list(INPUT_WEIGHTS.values()))[0]
+
+        match kind:
+            case "amp":
+                self.amplitude = (self.amplitude + 1) % AMPLITUDE_STEPS
+
+                # The value may still be pending from the previous sweep, in which case it was never written
+                if self.pending.pop(self.amplitude, None) is not None:
+                    self.superseded += 1
+
+                self.pending[self.amplitude] = time.perf_counter()
+                return "amp", self.amplitude
+            case "off":
+                self.offset = min(max(self.offset + random.uniform(-5, 5), 0), 180)
+                return "off", round(self.offset, 2)
+            case "freq":
+                self.frequency = min(max(self.frequency + random.uniform(-0.1, 0.1), 0), 2)
+                return "freq", round(self.frequency, 2)
+            case "phb":
+                self.phaseShift = (self.phaseShift + random.uniform(0, 0.5)) % (2 * math.pi)
+                return "phb", round(self.phaseShift, 2)
+            case _:
+                self.voted = not self.voted
+                return "vote", int(self.voted)
+
+    def sendInput(self):
+        if self.channel.readyState != "open":
+            return
+
+        kind, value = self.nextInput()
+
+        if not self.binary:
+            message = f"{kind} {value}"
+        elif kind == "vote":
+            message = PlayerProtocol.encodeVote(value == 1)
+        else:
+            message = PlayerProtocol.encodeParameter(kind, value)
+
+        self.channel.send(message)
+        self.inputsSent += 1
+        self.bytesSent += len(message)
+
+    def amplitudeWritten(self, amplitude: float, now: float):
+        """The server wrote the given amplitude to our motor"""
+        if amplitude not in self.pending:
+            return
+
+        # Inputs sent before this one were replaced before they reached the EDMO
+        for value in list(self.pending):
+            sentAt = self.pending.pop(value)
+
+            if value == amplitude:
+                self.latencies.append(now - sentAt)
+                return
+
+            self.superseded += 1
+
+    async def close(self):
+        await self.pc.close()
+
+
+class PlayerLoad:
+    """A fleet of simulated EDMOs, and the synthetic players controlling them"""
+
+    def __init__(
+        self,
+        playerCount: int,
+        playersPerEDMO: int,
+        edmoRate: float,
+        inputRate: float,
+        binary: bool = False,
+        syncState: bool = False,
+    ):
+        self.prefix = f"Load{playerCount}_"
+        self.fleet = SimulatedFleet(math.ceil(playerCount / playersPerEDMO), edmoRate, self.prefix)
+
+        self.players = [
+            SyntheticPlayer(f"Player{i}", self.fleet.edmos[i // playersPerEDMO], binary, syncState)
+            for i in range(playerCount)
+        ]
+        self.failedHandshakes = 0
+
+        for edmo in self.fleet.edmos:
+            edmo.onOscillatorUpdated = lambda motor, edmo=edmo: self.oscillatorUpdated(edmo, motor)
+
+        # A single timer drives the input of every player, like the fleet does for the EDMOs
+        self.inputTimer = PeriodicTask(self.sendInputs, 1 / inputRate)
+
+    def oscillatorUpdated(self, edmo: SimulatedEDMO, motor: int):
+        now = time.perf_counter()
+        amplitude = edmo.oscillators[motor][1]
+
+        for player in self.players:
+            if player.edmo is edmo and player.number == motor:
+                player.amplitudeWritten(amplitude, now)
+                return
+
+    async def sendInputs(self):
+        for player in self.players:
+            player.sendInput()
+
+    async def connect(self, http: aiohttp.ClientSession, concurrency: int):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def connectPlayer(player: SyntheticPlayer):
+            async with semaphore:
+                try:
+                    await asyncio.wait_for(
+                        player.connect(http, player.edmo.identifier), HANDSHAKE_TIMEOUT
+                    )
+                except (asyncio.TimeoutError, aiohttp.ClientError, ValueError) as e:
+                    print(f"{player.name} failed to connect: {e!r}")
+                    self.failedHandshakes += 1
+
+        await asyncio.gather(*(connectPlayer(player) for player in self.players))
+
+    def resetStats(self):
+        for player in self.players:
+            player.resetStats()
+
+        self.fleet.resetStats()
+
+    async def close(self):
+        self.inputTimer.stop()
+        await asyncio.gather(*(player.close() for player in self.players))
+        self.fleet.close()
+
+
+async def waitForEDMOs(http: aiohttp.ClientSession, identifiers: list[str]):
+    deadline = time.monotonic() + 30
+
+    while time.monotonic() < deadline:
+        try:
+            async with http.get(f"{SERVER_URL}/edmos") as response:
+                found = set(await response.json())
+
+            if found.issuperset(identifiers):
+                return True
+        except aiohttp.ClientError:
+            # The server isn't listening yet
+            pass
+
+        await asyncio.sleep(0.2)
+
+    return False
+
+
+def percentiles(values: list[float]):
+    if len(values) == 0:
+        return "n/a"
+
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+    return f"p50 {p50:.1f} / p95 {p95:.1f} / p99 {p99:.1f} / max {max(values) * 1000:.1f} ms"
+
+
+async def measure(playerCount: int, args: argparse.Namespace):
+    connection, child = multiprocessing.Pipe()
+    server = multiprocessing.Process(
+        target=runServer, args=(child, args.immediate, args.server_log), daemon=True
+    )
+    server.start()
+    await asyncio.to_thread(connection.recv)
+
+    load = PlayerLoad(
+        playerCount, args.players_per_edmo, args.edmo_rate, args.input_rate, args.binary, args.sync_state
+    )
+    await load.fleet.startUdp("127.0.0.1")
+
+    async with aiohttp.ClientSession() as http:
+        if not await waitForEDMOs(http, [edmo.identifier for edmo in load.fleet.edmos]):
+            print(f"The server didn't find all {len(load.fleet.edmos)} EDMOs")
+
+        connectStart = time.perf_counter()
+        await load.connect(http, args.connect_concurrency)
+        connectDuration = time.perf_counter() - connectStart
+
+    load.inputTimer.start()
+
+    # Let the sessions settle before measuring
+    await asyncio.sleep(1)
+
+    load.resetStats()
+    connection.send("reset")
+    startCpu = time.process_time()
+    startTime = time.monotonic()
+
+    await asyncio.sleep(args.duration)
+
+    elapsed = time.monotonic() - startTime
+    clientCpu = (time.process_time() - startCpu) / elapsed
+    connection.send("stats")
+    serverStats = await asyncio.to_thread(connection.recv)
+
+    players = load.players
+    handshakes = [p.handshakeTime for p in players if p.handshakeTime is not None]
+    signalling = [p.signallingTime for p in players if p.signallingTime is not None]
+    latencies = [latency for p in players for latency in p.latencies]
+    sent = sum(p.inputsSent for p in players)
+    received = sum(p.messagesReceived for p in players)
+    bytesSent = sum(p.bytesSent for p in players)
+    bytesReceived = sum(p.bytesReceived for p in players)
+    superseded = sum(p.superseded for p in players)
+
+    print(
+        f"{playerCount:>4} players on {len(load.fleet.edmos)} EDMOs ({serverStats['sessions']} sessions)\n"
+        f"  handshake     {percentiles(handshakes)} (signalling {percentiles(signalling)})\n"
+        f"                {len(handshakes)} connected in {connectDuration:.1f} s, {load.failedHandshakes} failed\n"
+        f"  throughput    {sent / elapsed:.0f} inputs/s sent (target {len(handshakes) * args.input_rate:.0f}/s),"
+        f" {received / elapsed:.0f} messages/s received by players\n"
+        f"                {bytesSent / max(sent, 1):.1f} bytes per input, {bytesReceived / elapsed / 1024:.1f} KiB/s received\n"
+        f"  input to EDMO {percentiles(latencies)} ({len(latencies)} written, {superseded} superseded)\n"
+        f"  server        CPU {serverStats['cpu']:.1%}, max session lateness {serverStats['maxLateness'] * 1000:.1f} ms,"
+        f" {serverStats['overruns']} overruns\n"
+        f"  load test     CPU {clientCpu:.1%}"
+    )
+
+    await load.close()
+
+    connection.send("stop")
+    await asyncio.to_thread(server.join, 10)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Load tests the server with synthetic WebRTC players")
+    parser.add_argument("--players", default="4,16,32", help="Comma separated player counts")
+    parser.add_argument("--players-per-edmo", type=int, default=4)
+    parser.add_argument("--input-rate", type=float, default=20, help="Inputs per second, per player")
+    parser.add_argument("--edmo-rate", type=float, default=10, help="SEND_ALL_DATA packets per second, per EDMO")
+    parser.add_argument("--connect-concurrency", type=int, default=8, help="Players connecting at the same time")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds measured per player count")
+    parser.add_argument(
+        "--immediate", action="store_true", help="Enable EDMOSession.IMMEDIATE_UPDATES on the server"
+    )
+    parser.add_argument("--binary", action="store_true", help="Players use the binary protocol instead of text")
+    parser.add_argument("--sync-state", action="store_true", help="Players receive snapshots and deltas of the session state")
+    parser.add_argument("--server-log", default="PlayerLoadTest.log", help="Where the output of the server goes")
+    args = parser.parse_args()
+
+    for count in (int(c) for c in args.players.split(",")):
+        await measure(count, args)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
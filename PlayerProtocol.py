@@ -0,0 +1,283 @@
+# The messages exchanged with players over the data channel
+#
+# Clients that open the data channel with BINARY_PROTOCOL as its protocol exchange fixed layout binary messages,
+# every other client exchanges the original space separated text messages. The server accepts either kind from anyone.
+#
+# From players:
+#   SET_PARAMETER   opcode, parameter, value (float)           the parameter of the player's own motor ("freq" is shared)
+#   VOTE            opcode, vote (0 or 1)
+#   CLOSE           opcode
+#   SYNC            opcode, version (uint32)                  asks for the session state since that version (see SessionState.py)
+#
+# To players:
+#   PARAMETER       opcode, parameter, motor, value (float)   motor is -1 for the recipient's own motor
+#   NUMBER          opcode, number                            the motor assigned to the player
+#   FLAG            opcode, flag, value (0 or 1)
+#   PLAYERS         opcode, count, then for each player: number, voted, name length, name (utf-8)
+#   DOCUMENT        opcode, kind, then the document (utf-8)
+#   STATE           opcode, version (uint32), then the state (JSON)
+#   DELTA           opcode, from version, to version (uint32), then the changed entries of the state (JSON)
+#
+# Clients that sync the session state (see SessionState.py) receive STATE and DELTA instead of PARAMETER, FLAG, PLAYERS
+# and TaskInfo. In text, these are "State {"version": ..., "state": {...}}" and "Delta {"from": ..., "to": ..., "changes": {...}}".
+
+from abc import ABC, abstractmethod
+import json
+import struct
+
+BINARY_PROTOCOL = "edmo-binary-1"
+
+# The parameters a player can change, in the order of their binary ids
+PARAMETERS = ("amp", "off", "freq", "phb")
+PARAMETER_IDS = {name: id for id, name in enumerate(PARAMETERS)}
+
+# Everything a player can send
+COMMANDS = PARAMETERS + ("vote", "sync")
+
+FLAGS = ("HelpEnabled", "SimpleMode")
+DOCUMENTS = ("TaskInfo", "Feedback")
+
+# region OPCODES
+
+SET_PARAMETER = 0x01
+VOTE = 0x02
+CLOSE = 0x03
+SYNC = 0x04
+
+PARAMETER = 0x10
+NUMBER = 0x11
+FLAG = 0x12
+PLAYERS = 0x13
+DOCUMENT = 0x14
+STATE = 0x15
+DELTA = 0x16
+
+# endregion
+
+SET_PARAMETER_STRUCT = struct.Struct("<BBf")
+VOTE_STRUCT = struct.Struct("<BB")
+SYNC_STRUCT = struct.Struct("<BI")
+
+PARAMETER_STRUCT = struct.Struct("<BBbf")
+NUMBER_STRUCT = struct.Struct("<Bb")
+FLAG_STRUCT = struct.Struct("<BBB")
+LIST_HEADER_STRUCT = struct.Struct("<BB")
+PLAYER_STRUCT = struct.Struct("<bBB")
+STATE_STRUCT = struct.Struct("<BI")
+DELTA_STRUCT = struct.Struct("<BII")
+
+CLOSE_MESSAGE = bytes((CLOSE,))
+
+# Snapshots and deltas are sent every tick, without the whitespace the legacy messages have
+COMPACT = (",", ":")
+
+
+# region FROM PLAYERS
+
+
+def decode(data: bytes) -> tuple[str, float] | None:
+    """Decodes a binary message from a player into the command and value of its text equivalent"""
+    if len(data) == 0:
+        return None
+
+    opcode = data[0]
+
+    if opcode == SET_PARAMETER and len(data) == SET_PARAMETER_STRUCT.size:
+        _, parameter, value = SET_PARAMETER_STRUCT.unpack(data)
+
+        if parameter < len(PARAMETERS):
+            return PARAMETERS[parameter], value
+    elif opcode == VOTE and len(data) == VOTE_STRUCT.size:
+        return "vote", float(data[1])
+    elif opcode == SYNC and len(data) == SYNC_STRUCT.size:
+        return "sync", float(SYNC_STRUCT.unpack(data)[1])
+
+    return None
+
+
+def encodeParameter(parameter: str, value: float):
+    """The binary message a client sends to change a parameter"""
+    return SET_PARAMETER_STRUCT.pack(SET_PARAMETER, PARAMETER_IDS[parameter], value)
+
+
+def encodeVote(voted: bool):
+    return VOTE_STRUCT.pack(VOTE, int(voted))
+
+
+def encodeSync(version: int):
+    return SYNC_STRUCT.pack(SYNC, version)
+
+
+# endregion
+
+# region TO PLAYERS
+
+
+class PlayerMessage(ABC):
+    """A message to players, encoded once for each protocol the first time it is needed"""
+
+    __slots__ = ("_text", "_binary")
+
+    def __init__(self):
+        self._text: str | None = None
+        self._binary: bytes | None = None
+
+    def text(self) -> str:
+        if self._text is None:
+            self._text = self.encodeText()
+
+        return self._text
+
+    def binary(self) -> bytes | None:
+        """The binary form of the message, or None if binary clients don't receive this message"""
+        if self._binary is None:
+            self._binary = self.encodeBinary()
+
+        return self._binary
+
+    @abstractmethod
+    def encodeText(self) -> str:
+        pass
+
+    @abstractmethod
+    def encodeBinary(self) -> bytes | None:
+        pass
+
+
+class Parameter(PlayerMessage):
+    __slots__ = ("parameter", "value", "motor")
+
+    def __init__(self, parameter: str, value: float, motor: int | None = None):
+        super().__init__()
+        self.parameter = parameter
+        self.value = value
+
+        # Parameters of the recipient's own motor don't mention the motor in text
+        self.motor = motor
+
+    def encodeText(self):
+        if self.motor is None:
+            return f"{self.parameter} {self.value}"
+
+        return f"{self.parameter} {self.motor} {self.value}"
+
+    def encodeBinary(self):
+        motor = -1 if self.motor is None else self.motor
+        return PARAMETER_STRUCT.pack(PARAMETER, PARAMETER_IDS[self.parameter], motor, self.value)
+
+
+class Number(PlayerMessage):
+    __slots__ = ("number",)
+
+    def __init__(self, number: int):
+        super().__init__()
+        self.number = number
+
+    def encodeText(self):
+        return f"ID {self.number}"
+
+    def encodeBinary(self):
+        return NUMBER_STRUCT.pack(NUMBER, self.number)
+
+
+class Flag(PlayerMessage):
+    __slots__ = ("flag", "value")
+
+    def __init__(self, flag: str, value: bool):
+        super().__init__()
+        self.flag = flag
+        self.value = value
+
+    def encodeText(self):
+        return f"{self.flag} {"1" if self.value else "0"}"
+
+    def encodeBinary(self):
+        return FLAG_STRUCT.pack(FLAG, FLAGS.index(self.flag), int(self.value))
+
+
+class Players(PlayerMessage):
+    __slots__ = ("players",)
+
+    def __init__(self, players: list[dict]):
+        super().__init__()
+        self.players = players
+
+    def encodeText(self):
+        return f"PlayerInfo {json.dumps(self.players)}"
+
+    def encodeBinary(self):
+        parts = [LIST_HEADER_STRUCT.pack(PLAYERS, len(self.players))]
+
+        for player in self.players:
+            name = player["name"].encode()[:255]
+            parts.append(PLAYER_STRUCT.pack(player["number"], int(player["voted"]), len(name)))
+            parts.append(name)
+
+        return b"".join(parts)
+
+
+class Document(PlayerMessage):
+    __slots__ = ("kind", "content")
+
+    def __init__(self, kind: str, content: str):
+        super().__init__()
+        self.kind = kind
+        self.content = content
+
+    def encodeText(self):
+        return f"{self.kind} {self.content}"
+
+    def encodeBinary(self):
+        return LIST_HEADER_STRUCT.pack(DOCUMENT, DOCUMENTS.index(self.kind)) + self.content.encode()
+
+
+class Snapshot(PlayerMessage):
+    __slots__ = ("version", "state")
+
+    def __init__(self, version: int, state: dict):
+        super().__init__()
+        self.version = version
+        self.state = state
+
+    def encodeText(self):
+        return f"State {json.dumps({"version": self.version, "state": self.state}, separators=COMPACT)}"
+
+    def encodeBinary(self):
+        return STATE_STRUCT.pack(STATE, self.version) + json.dumps(self.state, separators=COMPACT).encode()
+
+
+class Delta(PlayerMessage):
+    __slots__ = ("fromVersion", "toVersion", "changes")
+
+    def __init__(self, fromVersion: int, toVersion: int, changes: dict):
+        super().__init__()
+
+        # Applies to clients at any version from fromVersion up to (excluding) toVersion
+        self.fromVersion = fromVersion
+        self.toVersion = toVersion
+        self.changes = changes
+
+    def encodeText(self):
+        return f"Delta {json.dumps({"from": self.fromVersion, "to": self.toVersion, "changes": self.changes}, separators=COMPACT)}"
+
+    def encodeBinary(self):
+        return DELTA_STRUCT.pack(DELTA, self.fromVersion, self.toVersion) + json.dumps(self.changes, separators=COMPACT).encode()
+
+
+class LegacyText(PlayerMessage):
+    """A text message that binary clients have no use for"""
+
+    __slots__ = ("message",)
+
+    def __init__(self, message: str):
+        super().__init__()
+        self.message = message
+
+    def encodeText(self):
+        return self.message
+
+    def encodeBinary(self):
+        return None
+
+
+# endregion
@@ -0,0 +1,483 @@
+# Keeps an index of all sessions in the session logs, and allows them to be queried without walking the log directories
+#
+# Usage:
+#   python SessionIndex.py build
+#   python SessionIndex.py query --robot <id> --since 2024-05-01 --until 2024-05-02 --channel Session --read
+
+import argparse
+import bisect
+import errno
+import json
+import mmap
+import os
+import re
+from datetime import datetime, timedelta
+from typing import Any, Iterator, Optional
+
+from TelemetryLog import FILE_EXTENSION as TELEMETRY_EXTENSION
+from TelemetryLog import TIMESTAMP, loadTelemetry, readHeader
+from Utilities.Compression import COMPRESSED_EXTENSIONS, isCompressed, openFile
+
+# Sessions may be indexed by the server and from the command line at the same time, so appends to the index are locked across processes
+# File locks are platform specific, fcntl is only available on Unix, and msvcrt on Windows
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+LOG_DIRECTORY = "./SessionLogs"
+INDEX_FILE = "index.jsonl"
+
+# Sessions are logged in <date>/<robot>/<time> directories
+DATE_FORMAT = "%Y.%m.%d"
+TIME_FORMAT = "%H.%M.%S"
+
+# A checkpoint (time and byte offset of a line) is recorded roughly every this many bytes of a text log
+# Queries start reading from the last checkpoint before the requested time
+CHECKPOINT_INTERVAL = 64 * 1024
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+PLAYER_CONNECTED = re.compile(rb"Player \d+ connected\. \((.*)\)$")
+
+IndexEntry = dict[str, Any]
+
+
+# region INDEXING
+
+
+def parseSegmentName(fileName: str):
+    """Returns the channel, the kind of log, and the position of a log file within its channel"""
+    name = fileName
+    for extension in COMPRESSED_EXTENSIONS:
+        name = name.removesuffix(extension)
+
+    base, extension = os.path.splitext(name)
+
+    if extension == ".log":
+        kind = "text"
+    elif extension == f".{TELEMETRY_EXTENSION}":
+        kind = "telemetry"
+    else:
+        return None
+
+    # Rotated segments are numbered in order, the segment that was open last is not numbered
+    channel, _, number = base.rpartition(".")
+    if channel == "" or not number.isdigit():
+        return base, kind, float("inf")
+
+    return channel, kind, int(number)
+
+
+def parseLineTime(line: bytes) -> Optional[float]:
+    """Parses the session time (in seconds) at the start of a text log line"""
+    prefix, separator, _ = line.partition(b": ")
+    if not separator:
+        return None
+
+    try:
+        hours, minutes, seconds = prefix.split(b":")
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    except ValueError:
+        return None
+
+
+def indexTextSegment(path: str, players: set[str]):
+    checkpoints = list[list[float | int]]()
+    start = end = None
+    offset = lines = 0
+    lastCheckpoint = -CHECKPOINT_INTERVAL
+
+    with openFile(path) as file:
+        for line in file:
+            time = parseLineTime(line)
+
+            if time is not None:
+                if start is None:
+                    start = time
+                end = time
+
+                if offset - lastCheckpoint >= CHECKPOINT_INTERVAL:
+                    checkpoints.append([time, offset])
+                    lastCheckpoint = offset
+
+                match = PLAYER_CONNECTED.search(line.rstrip())
+                if match is not None:
+                    players.add(match.group(1).decode(errors="replace"))
+
+            offset += len(line)
+            lines += 1
+
+    return {
+        "count": lines,
+        "length": offset,
+        "start": start or 0,
+        "end": end or 0,
+        "checkpoints": checkpoints,
+    }
+
+
+def indexTelemetrySegment(path: str):
+    header, dataOffset = readHeader(path)
+    recordSize = header["recordSize"]
+
+    first = last = None
+    count = 0
+
+    with openFile(path) as file:
+        file.read(dataOffset)
+
+        # Compressed segments can't be seeked through, so every record is read
+        # Only the first and last timestamps are of interest
+        while True:
+            chunk = file.read(recordSize * 4096)
+            records = len(chunk) // recordSize
+            if records == 0:
+                break
+
+            if first is None:
+                first = TIMESTAMP.unpack_from(chunk, 0)[0]
+            last = TIMESTAMP.unpack_from(chunk, (records - 1) * recordSize)[0]
+            count += records
+
+    startNs = header["startMonotonicNs"]
+
+    return {
+        "count": count,
+        "recordSize": recordSize,
+        "dataOffset": dataOffset,
+        "start": (first - startNs) / 1e9 if first is not None else 0,
+        "end": (last - startNs) / 1e9 if last is not None else 0,
+    }
+
+
+def indexSession(directory: str, root: str = LOG_DIRECTORY) -> IndexEntry:
+    """Creates the index entry of a single session directory"""
+    path = os.path.relpath(directory, root).replace(os.sep, "/")
+    date, robotID, time = path.split("/")
+    start = datetime.strptime(f"{date} {time}", f"{DATE_FORMAT} {TIME_FORMAT}")
+
+    players = set[str]()
+    channels = dict[str, dict[str, Any]]()
+
+    segmentNames = [
+        (parsed, fileName)
+        for fileName in os.listdir(directory)
+        if (parsed := parseSegmentName(fileName)) is not None
+    ]
+
+    for (channel, kind, _), fileName in sorted(segmentNames):
+        filePath = os.path.join(directory, fileName)
+
+        if kind == "text":
+            segment = indexTextSegment(filePath, players)
+        else:
+            segment = indexTelemetrySegment(filePath)
+
+        segment["file"] = fileName
+        segment["size"] = os.path.getsize(filePath)
+
+        entry = channels.setdefault(channel, {"kind": kind, "segments": []})
+        entry["segments"].append(segment)
+
+    segments = [s for c in channels.values() for s in c["segments"]]
+    duration = max((s["end"] for s in segments), default=0)
+
+    return {
+        "path": path,
+        "robotID": robotID,
+        "start": start.isoformat(),
+        "end": (start + timedelta(seconds=duration)).isoformat(),
+        "players": sorted(players),
+        "channels": channels,
+        "stats": {
+            "duration": duration,
+            "bytes": sum(s["size"] for s in segments),
+            "lines": sum(
+                s["count"] for c in channels.values() if c["kind"] == "text" for s in c["segments"]
+            ),
+            "records": sum(
+                s["count"] for c in channels.values() if c["kind"] == "telemetry" for s in c["segments"]
+            ),
+            "inputs": sum(
+                s["count"] for name, c in channels.items() if name.startswith("Input_") for s in c["segments"]
+            ),
+        },
+    }
+
+
+def appendToIndex(entry: IndexEntry, root: str = LOG_DIRECTORY):
+    line = json.dumps(entry, separators=(",", ":")) + "\n"
+
+    with open(os.path.join(root, INDEX_FILE), "a") as index:
+        lockIndex(index.fileno())
+
+        try:
+            index.write(line)
+            index.flush()
+        finally:
+            unlockIndex(index.fileno())
+
+
+def lockIndex(descriptor: int):
+    """Waits until no other process (or thread) is appending to the index"""
+    if fcntl is not None:
+        fcntl.flock(descriptor, fcntl.LOCK_EX)
+        return
+
+    # Windows locks a range of bytes, every writer locks the first byte of the file (appends still go to the end)
+    os.lseek(descriptor, 0, os.SEEK_SET)
+    while True:
+        try:
+            msvcrt.locking(descriptor, msvcrt.LK_LOCK, 1)
+            return
+        except OSError as e:
+            # LK_LOCK gives up after 10 seconds, another process is still appending
+            if e.errno != errno.EDEADLOCK:
+                raise
+
+
+def unlockIndex(descriptor: int):
+    if fcntl is not None:
+        fcntl.flock(descriptor, fcntl.LOCK_UN)
+        return
+
+    os.lseek(descriptor, 0, os.SEEK_SET)
+    msvcrt.locking(descriptor, msvcrt.LK_UNLCK, 1)
+
+
+def addToIndex(directory: str, root: str = LOG_DIRECTORY):
+    """Indexes a session that has been closed. Used by the session logger, so failures are reported rather than raised."""
+    try:
+        appendToIndex(indexSession(directory, root), root)
+    except (OSError, ValueError) as e:
+        print(f"Failed to index {directory}: {e!r}")
+
+
+def sessionDirectories(root: str = LOG_DIRECTORY) -> Iterator[str]:
+    """Yields the relative path of every session directory, in chronological order per robot"""
+    for date in sorted(os.listdir(root)):
+        datePath = os.path.join(root, date)
+        if not os.path.isdir(datePath):
+            continue
+
+        for robotID in sorted(os.listdir(datePath)):
+            robotPath = os.path.join(datePath, robotID)
+            if not os.path.isdir(robotPath):
+                continue
+
+            for time in sorted(os.listdir(robotPath)):
+                if os.path.isdir(os.path.join(robotPath, time)):
+                    yield f"{date}/{robotID}/{time}"
+
+
+def buildIndex(root: str = LOG_DIRECTORY):
+    """Indexes every session directory that isn't indexed yet. Returns the number of sessions added."""
+    indexed = {entry["path"] for entry in loadIndex(root)}
+    added = 0
+
+    for path in sessionDirectories(root):
+        if path in indexed:
+            continue
+
+        addToIndex(os.path.join(root, path), root)
+        added += 1
+
+    return added
+
+
+# endregion
+
+# region QUERYING
+
+
+def loadIndex(root: str = LOG_DIRECTORY) -> list[IndexEntry]:
+    path = os.path.join(root, INDEX_FILE)
+    if not os.path.exists(path):
+        return []
+
+    # A session may be indexed more than once, the latest entry is the most complete
+    entries = dict[str, IndexEntry]()
+    with open(path) as index:
+        for line in index:
+            entry = json.loads(line)
+            entries[entry["path"]] = entry
+
+    return sorted(entries.values(), key=lambda e: e["start"])
+
+
+def findSessions(
+    index: list[IndexEntry],
+    robotID: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    channel: Optional[str] = None,
+):
+    """Filters the index to the sessions of a robot, overlapping a time range, and/or containing a channel"""
+    return [
+        entry
+        for entry in index
+        if (robotID is None or entry["robotID"] == robotID)
+        and (since is None or datetime.fromisoformat(entry["end"]) >= since)
+        and (until is None or datetime.fromisoformat(entry["start"]) <= until)
+        and (channel is None or channel in entry["channels"])
+    ]
+
+
+def sessionTimeRange(
+    entry: IndexEntry, since: Optional[datetime], until: Optional[datetime]
+):
+    """Converts an absolute time range into a time range relative to the start of the session"""
+    start = datetime.fromisoformat(entry["start"])
+
+    return (
+        (since - start).total_seconds() if since is not None else float("-inf"),
+        (until - start).total_seconds() if until is not None else float("inf"),
+    )
+
+
+def readRange(path: str, start: int, end: int) -> bytes:
+    if end <= start:
+        return b""
+
+    # Uncompressed logs are memory mapped, so only the requested range is read from disk
+    if not isCompressed(path):
+        with open(path, "rb") as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[start:end]
+
+    with openFile(path) as file:
+        while start > 0:
+            start -= len(file.read(min(start, READ_CHUNK_SIZE)))
+
+        return file.read(end - start)
+
+
+def readText(
+    entry: IndexEntry,
+    channel: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    root: str = LOG_DIRECTORY,
+) -> Iterator[str]:
+    """Yields the lines of a text channel within the time range, only reading the parts of the log that cover it"""
+    low, high = sessionTimeRange(entry, since, until)
+
+    for segment in entry["channels"][channel]["segments"]:
+        if segment["end"] < low or segment["start"] > high:
+            continue
+
+        checkpoints = segment["checkpoints"]
+        times = [time for time, _ in checkpoints]
+
+        first = bisect.bisect_right(times, low) - 1
+        last = bisect.bisect_right(times, high)
+
+        startOffset = checkpoints[first][1] if first >= 0 else 0
+        endOffset = (
+            checkpoints[last][1] if last < len(checkpoints) else segment["length"]
+        )
+
+        content = readRange(
+            os.path.join(root, entry["path"], segment["file"]), startOffset, endOffset
+        )
+
+        # Lines without a time (multi line messages) belong to the line before them
+        included = False
+        for line in content.splitlines():
+            time = parseLineTime(line)
+            if time is not None:
+                included = low <= time <= high
+
+            if included:
+                yield line.decode(errors="replace")
+
+
+def readTelemetry(
+    entry: IndexEntry,
+    channel: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    root: str = LOG_DIRECTORY,
+):
+    """Returns the records of a telemetry channel within the time range as a NumPy structured array"""
+    import numpy as np
+
+    low, high = sessionTimeRange(entry, since, until)
+    parts = []
+
+    for segment in entry["channels"][channel]["segments"]:
+        if segment["end"] < low or segment["start"] > high:
+            continue
+
+        path = os.path.join(root, entry["path"], segment["file"])
+        records = loadTelemetry(path)
+
+        # Timestamps are monotonic, so the range can be found by binary search
+        # For memory mapped segments, this only touches the records that are needed
+        header, _ = readHeader(path)
+        startNs = header["startMonotonicNs"]
+        timestamps = records["timestamp"]
+
+        first = np.searchsorted(timestamps, startNs + low * 1e9, side="left") if low > float("-inf") else 0
+        last = np.searchsorted(timestamps, startNs + high * 1e9, side="right") if high < float("inf") else len(records)
+
+        parts.append(records[first:last])
+
+    if len(parts) == 0:
+        return None
+
+    return np.concatenate(parts) if len(parts) > 1 else parts[0]
+
+
+# endregion
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Indexes and queries the session logs")
+    parser.add_argument("--root", default=LOG_DIRECTORY)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("build", help="Index all sessions that aren't indexed yet")
+
+    query = commands.add_parser("query", help="Find sessions, and optionally read a channel")
+    query.add_argument("--robot")
+    query.add_argument("--since", type=datetime.fromisoformat)
+    query.add_argument("--until", type=datetime.fromisoformat)
+    query.add_argument("--channel")
+    query.add_argument(
+        "--read", action="store_true", help="Print the contents of the channel within the time range"
+    )
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        print(f"Indexed {buildIndex(args.root)} sessions")
+        return
+
+    sessions = findSessions(
+        loadIndex(args.root), args.robot, args.since, args.until, args.channel
+    )
+
+    for entry in sessions:
+        print(
+            f"{entry['path']}  {entry['start']} - {entry['end']}  players: {', '.join(entry['players'])}  channels: {', '.join(entry['channels'])}"
+        )
+
+        if not args.read or args.channel is None:
+            continue
+
+        if entry["channels"][args.channel]["kind"] == "text":
+            for line in readText(entry, args.channel, args.since, args.until, args.root):
+                print(f"    {line}")
+        else:
+            records = readTelemetry(entry, args.channel, args.since, args.until, args.root)
+            print(f"    {0 if records is None else len(records)} records")
+            if records is not None:
+                for record in records[:10]:
+                    print(f"    {record}")
+
+
+if __name__ == "__main__":
+    main()
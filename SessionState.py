@@ -0,0 +1,99 @@
+# The state of a session as shown to players, versioned so clients can be kept up to date with deltas
+#
+# Every change increases the version. Changes are collected and sent as a single delta once per tick, and a client
+# that missed a delta (or just reconnected) asks for everything since the last version it has seen ("sync <version>").
+#
+# The state is the same for every client, entries are flat keys:
+#   amp.<motor>, off.<motor>, phb.<motor>, freq     the parameters of the motors
+#   PlayerInfo, TaskInfo, HelpEnabled, SimpleMode   as in the messages of the same name
+#
+# Values in a delta are the latest values of the entries, so applying a delta the client has partially seen is harmless.
+# A client only needs to resync when a delta starts after the version it has.
+
+from collections import deque
+
+from PlayerProtocol import Delta, Snapshot
+
+
+class SessionState:
+    # The number of flushed deltas kept for clients that resync from an older version
+    # Clients further behind than that receive a snapshot instead
+    HISTORY_LENGTH = 64
+
+    def __init__(self):
+        self.version = 0
+        self.values = dict[str, object]()
+
+        # Changes since the last flush, and the version they were made on top of
+        self.changes = dict[str, object]()
+        self.changesSince = 0
+
+        self.history = deque[Delta](maxlen=self.HISTORY_LENGTH)
+
+        self.deltasSent = 0
+        self.snapshotsSent = 0
+        self.resyncs = 0
+
+    def set(self, key: str, value: object):
+        if key in self.values and self.values[key] == value:
+            return
+
+        if len(self.changes) == 0:
+            self.changesSince = self.version
+
+        self.version += 1
+        self.values[key] = value
+        self.changes[key] = value
+
+    def flush(self):
+        """The delta of every change since the last flush, or None if nothing changed"""
+        if len(self.changes) == 0:
+            return None
+
+        delta = Delta(self.changesSince, self.version, self.changes)
+        self.changes = {}
+        self.history.append(delta)
+        self.deltasSent += 1
+
+        return delta
+
+    def snapshot(self):
+        self.snapshotsSent += 1
+
+        # Values are replaced rather than modified, so a shallow copy is enough
+        return Snapshot(self.version, dict(self.values))
+
+    def since(self, version: int):
+        """Brings a client at the given version up to date, with a single delta if the history still covers it, otherwise with a snapshot"""
+        self.resyncs += 1
+
+        if version < 0 or version > self.version:
+            return self.snapshot()
+
+        if len(self.history) > 0:
+            oldest = self.history[0].fromVersion
+        elif len(self.changes) > 0:
+            oldest = self.changesSince
+        else:
+            oldest = self.version
+
+        if version < oldest:
+            return self.snapshot()
+
+        changes = dict[str, object]()
+
+        for delta in self.history:
+            if delta.toVersion > version:
+                changes.update(delta.changes)
+
+        changes.update(self.changes)
+
+        return Delta(version, self.version, changes)
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "deltas": self.deltasSent,
+            "snapshots": self.snapshotsSent,
+            "resyncs": self.resyncs,
+        }
@@ -0,0 +1,323 @@
+# Simulates a fleet of EDMOs, for testing the server without physical robots
+#
+# Each simulated EDMO answers IDENTIFY, follows SESSION_START, GET_TIME and oscillator updates, and streams SEND_ALL_DATA at a fixed rate.
+# EDMOs can be reached over UDP (a listener on port 2121, each EDMO answering from its own socket), or over pseudo terminals.
+#
+# Usage:
+#   python Simulator.py --robots 20 --rate 50 --transport udp
+#   python Simulator.py --robots 20 --rate 50 --transport pty
+#
+# The server must be told where to find them: add ("127.0.0.1", 2121) to EDMOUdp.DISCOVERY_ADDRESSES,
+# or the printed devices to EDMOSerial.EXTRA_PORTS. LoadTest.py does this automatically.
+
+import argparse
+import asyncio
+import math
+import os
+import struct
+import time
+import tty
+from typing import Callable
+
+from EDMOCodecs import CODECS, MOTOR_COUNT
+from EDMOCommands import (
+    EDMOCapabilities,
+    EDMOCommand,
+    EDMOCommands,
+    EDMOPacket,
+    EDMOPacketDecoder,
+)
+from EDMOMotor import EDMOMotor
+from Utilities.PeriodicTask import PeriodicTask
+
+DISCOVERY_PORT = 2121
+
+TIME_STRUCT = struct.Struct("<L")
+
+
+class SimulatedEDMO:
+    """The firmware side of the protocol, enough of it to keep a server busy"""
+
+    def __init__(self, identifier: str, capabilities: int = EDMOCapabilities.BATCHED_OSCILLATORS):
+        self.identifier = identifier
+        self.capabilities = capabilities
+
+        self.decoder = EDMOPacketDecoder()
+        self.write: Callable[[bytes], None] = lambda _: None
+
+        self.startTime = time.monotonic()
+        self.timeOffset = 0
+
+        # Frequency, amplitude, offset and phase shift of each motor
+        self.oscillators = [[0.0, 0.0, 90.0, 0.0] for _ in range(MOTOR_COUNT)]
+        self.phases = [0.0] * MOTOR_COUNT
+
+        # Telemetry is only streamed once a server has found us
+        self.identified = False
+
+        # Called with the number of each motor whose oscillator was updated by the server
+        self.onOscillatorUpdated: Callable[[int], None] | None = None
+
+        self.resetStats()
+
+    def resetStats(self):
+        self.telemetrySent = 0
+        self.timeRequests = 0
+        self.oscillatorUpdates = 0
+
+    def time(self):
+        """The time in milliseconds, as kept by the EDMO"""
+        return (self.timeOffset + int((time.monotonic() - self.startTime) * 1000)) & 0xFFFFFFFF
+
+    def identity(self):
+        return EDMOPacket.create(
+            EDMOCommands.IDENTIFY, self.identifier.encode(), b"\0", bytes((self.capabilities,))
+        )
+
+    def dataReceived(self, data: bytes):
+        for packet in self.decoder.feed(data):
+            self.handle(EDMOPacket.tryParse(packet))
+
+    def handle(self, command: EDMOCommand):
+        match command.Instruction:
+            case EDMOCommands.IDENTIFY:
+                self.identified = True
+                self.write(self.identity())
+            case EDMOCommands.SESSION_START:
+                (self.timeOffset,) = TIME_STRUCT.unpack(command.Data)
+                self.startTime = time.monotonic()
+            case EDMOCommands.GET_TIME:
+                self.timeRequests += 1
+                self.write(EDMOPacket.create(EDMOCommands.GET_TIME, TIME_STRUCT.pack(self.time())))
+            case EDMOCommands.UPDATE_OSCILLATOR:
+                motor, *parameters = EDMOMotor.OSCILLATOR_STRUCT.unpack(command.Data)
+                if motor < MOTOR_COUNT:
+                    self.oscillators[motor] = parameters
+                    self.oscillatorUpdates += 1
+                    self.oscillatorUpdated(motor)
+            case EDMOCommands.UPDATE_ALL_OSCILLATORS:
+                size = EDMOMotor.BATCHED_OSCILLATOR_STRUCT.size
+                for motor in range(min(command.Data[0], MOTOR_COUNT)):
+                    self.oscillators[motor] = list(
+                        EDMOMotor.BATCHED_OSCILLATOR_STRUCT.unpack_from(command.Data, 1 + size * motor)
+                    )
+                    self.oscillatorUpdated(motor)
+                self.oscillatorUpdates += 1
+
+    def oscillatorUpdated(self, motor: int):
+        if self.onOscillatorUpdated is not None:
+            self.onOscillatorUpdated(motor)
+
+    def step(self, deltaTime: float):
+        """Advances the oscillators, and sends the state of the EDMO"""
+        if not self.identified:
+            return
+
+        fields: list[float | int] = [self.time()]
+
+        for motor, (frequency, amplitude, offset, phaseShift) in enumerate(self.oscillators):
+            self.phases[motor] = (self.phases[motor] + 2 * math.pi * frequency * deltaTime) % (2 * math.pi)
+            fields += [frequency, amplitude, offset, phaseShift, self.phases[motor]]
+
+        # The IMU sways along with the first motor
+        sway = math.sin(self.phases[0])
+        milliseconds = fields[0]
+        fields += [milliseconds, 3, sway, 0.0, 9.81]
+        fields += [milliseconds, 3, 0.0, sway, 0.0]
+        fields += [milliseconds, 3, 40.0, 0.0, -20.0]
+        fields += [milliseconds, 3, 0.0, 0.0, 9.81]
+        fields += [milliseconds, 3, 0.0, 0.0, 0.0, 1.0]
+
+        payload = CODECS[EDMOCommands.SEND_ALL_DATA].struct.pack(*fields)
+        self.write(EDMOPacket.create(EDMOCommands.SEND_ALL_DATA, payload))
+        self.telemetrySent += 1
+
+    def stats(self):
+        return {
+            "telemetrySent": self.telemetrySent,
+            "timeRequests": self.timeRequests,
+            "oscillatorUpdates": self.oscillatorUpdates,
+        }
+
+
+# region TRANSPORTS
+
+
+class UdpEDMOProtocol(asyncio.DatagramProtocol):
+    """The socket of a single simulated EDMO, which answers the server from its own port"""
+
+    def __init__(self, edmo: SimulatedEDMO):
+        self.edmo = edmo
+        self.server = None
+        self.transport: asyncio.DatagramTransport | None = None
+        edmo.write = self.write
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        self.server = addr
+        self.edmo.dataReceived(data)
+
+    def write(self, data: bytes):
+        if self.server is not None and self.transport is not None:
+            self.transport.sendto(data, self.server)
+
+
+class UdpDiscoveryProtocol(asyncio.DatagramProtocol):
+    """Listens for the IDENTIFY broadcast of the server, and lets every simulated EDMO answer it"""
+
+    def __init__(self, edmos: list[UdpEDMOProtocol]):
+        self.edmos = edmos
+
+    def datagram_received(self, data: bytes, addr):
+        if EDMOPacket.tryParse(data).Instruction != EDMOCommands.IDENTIFY:
+            return
+
+        for protocol in self.edmos:
+            protocol.server = addr
+            protocol.edmo.handle(EDMOCommand(EDMOCommands.IDENTIFY, b""))
+
+
+class PtyEDMO:
+    """A simulated EDMO behind a pseudo terminal, which the server opens like any serial port"""
+
+    def __init__(self, edmo: SimulatedEDMO):
+        self.edmo = edmo
+        self.master, self.slave = os.openpty()
+
+        # The terminal must pass bytes through untouched, before the server configures it
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+
+        self.device = os.ttyname(self.slave)
+        self.droppedWrites = 0
+
+        edmo.write = self.write
+        asyncio.get_running_loop().add_reader(self.master, self.readable)
+
+    def readable(self):
+        try:
+            self.edmo.dataReceived(os.read(self.master, 4096))
+        except OSError:
+            pass
+
+    def write(self, data: bytes):
+        # The server isn't reading fast enough, the data is lost like it would be over a real serial line
+        try:
+            os.write(self.master, data)
+        except (BlockingIOError, OSError):
+            self.droppedWrites += 1
+
+    def close(self):
+        asyncio.get_running_loop().remove_reader(self.master)
+        os.close(self.master)
+        os.close(self.slave)
+
+
+# endregion
+
+
+class SimulatedFleet:
+    def __init__(self, count: int, rate: float, prefix: str = "Sim"):
+        self.edmos = [SimulatedEDMO(f"{prefix}{i}") for i in range(count)]
+        self.rate = rate
+        self.transports = list[asyncio.BaseTransport]()
+        self.ptys = list[PtyEDMO]()
+
+        # A single timer steps every EDMO, rather than hundreds of timers
+        self.timer = PeriodicTask(self.step, 1 / rate)
+        self.startCpu = os.times()
+        self.startTime = time.monotonic()
+
+    async def step(self):
+        for edmo in self.edmos:
+            edmo.step(1 / self.rate)
+
+    async def startUdp(self, host: str = "0.0.0.0"):
+        loop = asyncio.get_running_loop()
+        protocols = list[UdpEDMOProtocol]()
+
+        for edmo in self.edmos:
+            transport, protocol = await loop.create_datagram_endpoint(
+                lambda edmo=edmo: UdpEDMOProtocol(edmo), local_addr=(host, 0)
+            )
+            self.transports.append(transport)
+            protocols.append(protocol)
+
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: UdpDiscoveryProtocol(protocols),
+            local_addr=(host, DISCOVERY_PORT),
+            allow_broadcast=True,
+        )
+        self.transports.append(transport)
+        self.timer.start()
+
+    def startPty(self):
+        self.ptys = [PtyEDMO(edmo) for edmo in self.edmos]
+        self.timer.start()
+
+        return [pty.device for pty in self.ptys]
+
+    def resetStats(self):
+        for edmo in self.edmos:
+            edmo.resetStats()
+
+        self.startCpu = os.times()
+        self.startTime = time.monotonic()
+
+    def stats(self):
+        cpu = os.times()
+        elapsed = time.monotonic() - self.startTime
+
+        return {
+            "robots": {edmo.identifier: edmo.stats() for edmo in self.edmos},
+            "cpu": (cpu.user + cpu.system - self.startCpu.user - self.startCpu.system) / max(elapsed, 1e-9),
+            "timer": self.timer.stats(),
+            "droppedWrites": sum(pty.droppedWrites for pty in self.ptys),
+        }
+
+    def close(self):
+        self.timer.stop()
+
+        for transport in self.transports:
+            transport.close()
+
+        for pty in self.ptys:
+            pty.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Simulates a fleet of EDMOs")
+    parser.add_argument("--robots", type=int, default=10)
+    parser.add_argument("--rate", type=float, default=50, help="SEND_ALL_DATA packets per second, per robot")
+    parser.add_argument("--transport", choices=("udp", "pty"), default="udp")
+    parser.add_argument("--prefix", default="Sim")
+    args = parser.parse_args()
+
+    fleet = SimulatedFleet(args.robots, args.rate, args.prefix)
+
+    if args.transport == "udp":
+        await fleet.startUdp()
+        print(f"{args.robots} EDMOs listening on UDP port {DISCOVERY_PORT}")
+    else:
+        for device in fleet.startPty():
+            print(device)
+
+    try:
+        while True:
+            await asyncio.sleep(5)
+            stats = fleet.stats()
+            sent = sum(robot["telemetrySent"] for robot in stats["robots"].values())
+            requests = sum(robot["timeRequests"] for robot in stats["robots"].values())
+            print(f"Sent {sent} packets, answered {requests} time requests, simulator CPU {stats['cpu']:.0%}")
+            fleet.resetStats()
+    finally:
+        fleet.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,350 @@
+# Publishes the telemetry of a session into shared memory, so processes on the same machine can read it without copies or serialization
+#
+# Each record kind of a session has its own ring of fixed size slots, in a shared memory block named edmo_<robot>_<record>
+#
+#   header (64 bytes): MAGIC | instruction (uint8) | record size | slot size | capacity | owner process id (uint32) | ... | written (uint64, at byte 32)
+#   slots: sequence (uint64) | monotonic time in nanoseconds (uint64) | raw data of the packet, padded to 8 bytes
+#
+# "written" is the number of records ever written, the record with sequence n is in slot n % capacity.
+# A slot is written before "written" is increased, so readers only see complete records.
+# The slot of the oldest record is the next one to be overwritten, so readers should only rely on the newest capacity - 1 records.
+#
+# A block left behind by a server that didn't shut down cleanly is reclaimed, but only once the process that owned it is gone.
+# Readers map the blocks read only.
+#
+# Usage (reading):
+#   python TelemetryBus.py <robot> [record]
+
+import mmap
+import os
+import re
+import struct
+import sys
+import time
+import weakref
+from multiprocessing import shared_memory
+
+# Used by SharedMemory itself to open blocks by name, which is needed to map them read only
+if os.name != "nt":
+    import _posixshmem
+
+from EDMOCodecs import CODECS
+from TelemetryLog import NUMPY_FORMATS
+
+MAGIC = b"EDMOBUS1"
+HEADER = struct.Struct("<8sB3xIIII")
+WRITTEN = struct.Struct("<Q")
+WRITTEN_OFFSET = 32
+HEADER_SIZE = 64
+
+SLOT_HEADER = struct.Struct("<QQ")
+
+
+def busName(identifier: str, record: str):
+    # Shared memory names can't contain slashes, and are best kept short and simple
+    return f"edmo_{re.sub(r"[^A-Za-z0-9]", "_", identifier)}_{record}"
+
+
+def slotSize(recordSize: int):
+    return SLOT_HEADER.size + -(-recordSize // 8) * 8
+
+
+def processAlive(pid: int):
+    if pid <= 0:
+        return False
+
+    # Windows removes shared memory once no process has it open, so a block that exists always has a live owner
+    # (os.kill would also terminate the process there, rather than check it)
+    if pid == os.getpid() or os.name == "nt":
+        return True
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def liveOwner(name: str):
+    """The id of the live process that owns the block, or None if it was left behind"""
+    memory = ReadOnlyMemory(name)
+
+    try:
+        magic, *_, owner = HEADER.unpack_from(memory.buf, 0)
+    finally:
+        memory.close()
+
+    if magic != MAGIC:
+        raise FileExistsError(f"{name} exists, and is not a telemetry bus")
+
+    return owner if processAlive(owner) else None
+
+
+class TelemetryRing:
+    """The writing end of the ring of a single record kind"""
+
+    # The rings of this process by name
+    # A session that starts before the previous session of its robot has closed takes over the rings of that session
+    owned = dict[str, "TelemetryRing"]()
+
+    def __init__(self, name: str, instruction: int, capacity: int):
+        recordSize = CODECS[instruction].struct.size
+        self.name = name
+        self.slotSize = slotSize(recordSize)
+        self.capacity = capacity
+        self.written = 0
+
+        self.memory = self.create(name, HEADER_SIZE + capacity * self.slotSize)
+        self.owned[name] = self
+
+        HEADER.pack_into(
+            self.memory.buf, 0, MAGIC, instruction, recordSize, self.slotSize, capacity, os.getpid()
+        )
+
+    def create(self, name: str, size: int):
+        try:
+            return shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            pass
+
+        if name not in self.owned:
+            owner = liveOwner(name)
+            if owner is not None:
+                raise FileExistsError(f"{name} is in use by process {owner}")
+
+        # Left behind by a server that didn't shut down cleanly, or by a session of this process that is closing
+        stale = shared_memory.SharedMemory(name)
+        stale.close()
+        stale.unlink()
+
+        return shared_memory.SharedMemory(name, create=True, size=size)
+
+    def write(self, timestamp: int, data: bytes | memoryview):
+        buffer = self.memory.buf
+        sequence = self.written
+        offset = HEADER_SIZE + (sequence % self.capacity) * self.slotSize
+
+        buffer[offset + SLOT_HEADER.size : offset + SLOT_HEADER.size + len(data)] = data
+        SLOT_HEADER.pack_into(buffer, offset, sequence, timestamp)
+
+        # Published last, the record is complete once readers can see it
+        self.written = sequence + 1
+        WRITTEN.pack_into(buffer, WRITTEN_OFFSET, self.written)
+
+    def close(self):
+        self.memory.close()
+
+        # A ring that was taken over leaves the shared memory to its new owner
+        if self.owned.get(self.name) is self:
+            del self.owned[self.name]
+            self.memory.unlink()
+
+
+class TelemetryBus:
+    """Publishes the decoded telemetry of a session into shared memory rings, one per record kind"""
+
+    # The number of records kept per record kind
+    CAPACITY = 4096
+
+    def __init__(self, identifier: str):
+        self.identifier = identifier
+
+        # Record kinds that can't be published (another process publishes them) have no ring
+        self.rings = dict[int, TelemetryRing | None]()
+
+    def publish(self, instruction: int, data: bytes | memoryview):
+        if instruction not in self.rings:
+            self.rings[instruction] = self.createRing(instruction)
+
+        ring = self.rings[instruction]
+        if ring is not None:
+            ring.write(time.monotonic_ns(), data)
+
+    def createRing(self, instruction: int):
+        name = busName(self.identifier, CODECS[instruction].name)
+
+        try:
+            return TelemetryRing(name, instruction, self.CAPACITY)
+        except FileExistsError as e:
+            print(f"Telemetry of {self.identifier} is not published to shared memory: {e}")
+            return None
+
+    def close(self):
+        for ring in self.rings.values():
+            if ring is not None:
+                ring.close()
+
+        self.rings.clear()
+
+
+class MappedBuffer:
+    """
+    The buffer of shared memory, as the base of NumPy views.
+
+    NumPy doesn't hold on to the buffer of the memory itself, it would let the memory be unmapped from under its views.
+    Every view made from this (directly or not) keeps it alive instead, so whether any view is left can be checked.
+    """
+
+    def __init__(self, memory: "ReadOnlyMemory"):
+        self.memory = memory
+
+    def __buffer__(self, flags: int):
+        return memoryview(self.memory.buf)
+
+
+class TelemetryBusReader:
+    """
+    Reads the ring of a record kind published by the server.
+
+    Records are exposed as read only NumPy views of the shared memory, without copying them.
+    Views may be overwritten by the server once they're older than the capacity of the ring,
+    use isValid to check whether the records were still intact after using them.
+
+    The memory can't be unmapped while views of it are still alive, so views returned by poll must be dropped before calling close.
+    Records that are kept around for longer should be polled as copies instead.
+    """
+
+    def __init__(self, identifier: str, record: str = "AllData"):
+        import numpy as np
+
+        self.memory = ReadOnlyMemory(busName(identifier, record))
+        buffer = self.memory.buf
+
+        magic, self.instruction, self.recordSize, self.slotSize, self.capacity, _ = (
+            HEADER.unpack_from(buffer, 0)
+        )
+
+        if magic != MAGIC:
+            self.memory.close()
+            raise ValueError(f"{self.memory.name} is not a telemetry bus")
+
+        layout = CODECS[self.instruction].layout()
+        dtype = np.dtype(
+            {
+                "names": ["sequence", "timestamp"] + [name for name, _, _ in layout],
+                "formats": ["<u8", "<u8"] + [NUMPY_FORMATS[format] for _, format, _ in layout],
+                "offsets": [0, 8] + [SLOT_HEADER.size + offset for _, _, offset in layout],
+                "itemsize": self.slotSize,
+            }
+        )
+
+        self.records = np.ndarray(
+            (self.capacity,), dtype=dtype, buffer=MappedBuffer(self.memory), offset=HEADER_SIZE
+        )
+        self.records.flags.writeable = False
+
+        # Only records written after attaching are returned by poll
+        self.nextSequence = self.written()
+        self.missed = 0
+
+        self.mappedBuffer = weakref.ref(self.records.base)
+
+    def written(self) -> int:
+        return WRITTEN.unpack_from(self.memory.buf, WRITTEN_OFFSET)[0]
+
+    def oldestValid(self, written: int):
+        # The slot of the oldest record may be being overwritten
+        return max(0, written - self.capacity + 1)
+
+    def isValid(self, sequence: int):
+        """Whether the record with the sequence number hasn't been overwritten yet"""
+        return sequence >= self.oldestValid(self.written())
+
+    def poll(self, copy: bool = False):
+        """
+        Returns views of the records written since the last poll (two views if they wrap around the end of the ring), and the sequence number of the first one.
+        Records that were overwritten before being polled are skipped and counted in missed.
+
+        With copy, the records are copied out of the shared memory, and stay intact and usable after close.
+        """
+        written = self.written()
+        first = self.nextSequence
+        oldest = self.oldestValid(written)
+
+        if first < oldest:
+            self.missed += oldest - first
+            first = oldest
+
+        self.nextSequence = written
+
+        start = first % self.capacity
+        end = start + (written - first)
+
+        if end <= self.capacity:
+            views = [self.records[start:end]]
+        else:
+            views = [self.records[start:], self.records[: end - self.capacity]]
+
+        if copy:
+            views = [view.copy() for view in views]
+
+        return views, first
+
+    def close(self):
+        self.records = None
+
+        # Reading a view after the memory is unmapped would crash the process
+        if self.mappedBuffer() is not None:
+            raise BufferError(
+                f"{self.memory.name} can't be closed while views returned by poll are still in use, drop them (or poll copies) first"
+            )
+
+        self.memory.close()
+
+
+class ReadOnlyMemory:
+    """
+    An existing shared memory block, mapped read only so readers can't damage the rings of the server.
+
+    SharedMemory always maps blocks for writing (and before Python 3.13, removes blocks it attached to when the process exits).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+        if os.name == "nt":
+            # Opening the block through SharedMemory checks that it exists, and finds its size
+            memory = shared_memory.SharedMemory(name)
+            self.mmap = mmap.mmap(-1, memory.size, tagname=name, access=mmap.ACCESS_READ)
+            memory.close()
+        else:
+            descriptor = _posixshmem.shm_open("/" + name, os.O_RDONLY, mode=0o600)
+            try:
+                self.mmap = mmap.mmap(descriptor, os.fstat(descriptor).st_size, access=mmap.ACCESS_READ)
+            finally:
+                os.close(descriptor)
+
+        self.buf = memoryview(self.mmap)
+
+    def close(self):
+        self.buf.release()
+        self.mmap.close()
+
+
+def main():
+    identifier = sys.argv[1]
+    record = sys.argv[2] if len(sys.argv) > 2 else "AllData"
+
+    reader = TelemetryBusReader(identifier, record)
+    print(f"Reading {record} of {identifier}, capacity {reader.capacity}")
+
+    def received():
+        # The views are dropped as soon as they're counted, so the reader can be closed at any time
+        views, _ = reader.poll()
+        return sum(len(view) for view in views)
+
+    try:
+        while True:
+            time.sleep(1)
+            print(f"{received()} records/s, {reader.missed} missed in total")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
+
+
+if __name__ == "__main__":
+    main()
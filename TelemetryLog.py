@@ -0,0 +1,104 @@
+import json
+import os
+import struct
+from datetime import datetime
+
+from EDMOCodecs import EDMOCodec
+from Utilities.Compression import isCompressed, openFile
+
+# Telemetry files start with a small header describing the layout of the records
+# The header is followed by fixed width records, each being a monotonic timestamp and the raw data of a packet
+#
+#   MAGIC | header length (uint32) | JSON header | records...
+#
+# The JSON header is padded so that the records start at an 8 byte aligned offset
+# Records are packed without padding between them, so only the first one is aligned (NumPy reads unaligned records fine)
+MAGIC = b"EDMOTLM1"
+HEADER_LENGTH = struct.Struct("<I")
+TIMESTAMP = struct.Struct("<Q")
+
+FILE_EXTENSION = "tlm"
+
+# Conversion from struct formats to NumPy dtypes
+NUMPY_FORMATS = {
+    "B": "u1",
+    "H": "<u2",
+    "L": "<u4",
+    "Q": "<u8",
+    "f": "<f4",
+}
+
+
+def createHeader(
+    instruction: int, codec: EDMOCodec, startTime: datetime, startMonotonicNs: int
+):
+    """Creates the header for a telemetry file containing the packets decoded by the codec"""
+    fields = [["timestamp", NUMPY_FORMATS["Q"], 0]]
+    fields += [
+        [name, NUMPY_FORMATS[format], TIMESTAMP.size + offset]
+        for name, format, offset in codec.layout()
+    ]
+
+    header = {
+        "record": codec.name,
+        "instruction": instruction,
+        "recordSize": TIMESTAMP.size + codec.struct.size,
+        "fields": fields,
+        "startTime": startTime.isoformat(),
+        "startMonotonicNs": startMonotonicNs,
+    }
+
+    content = json.dumps(header).encode()
+    prefixLength = len(MAGIC) + HEADER_LENGTH.size
+    content += b" " * (-(prefixLength + len(content)) % 8)
+
+    return MAGIC + HEADER_LENGTH.pack(len(content)) + content
+
+
+def readHeader(path: str):
+    """Reads the header of a telemetry file, returning the header and the offset at which the records start"""
+    with openFile(path) as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a telemetry file")
+
+        (length,) = HEADER_LENGTH.unpack(file.read(HEADER_LENGTH.size))
+        header = json.loads(file.read(length))
+
+    return header, len(MAGIC) + HEADER_LENGTH.size + length
+
+
+def loadTelemetry(path: str, memoryMap: bool = True):
+    """
+    Loads a telemetry file as a NumPy structured array, with one field per decoded value and a "timestamp" field holding the monotonic time in nanoseconds.
+
+    By default the file is memory mapped rather than read. Compressed (rotated) files are always read into memory.
+    """
+    import numpy as np
+
+    header, offset = readHeader(path)
+
+    fields = header["fields"]
+    dtype = np.dtype(
+        {
+            "names": [name for name, _, _ in fields],
+            "formats": [format for _, format, _ in fields],
+            "offsets": [fieldOffset for _, _, fieldOffset in fields],
+            "itemsize": header["recordSize"],
+        }
+    )
+
+    if isCompressed(path):
+        with openFile(path) as file:
+            content = file.read()[offset:]
+
+        count = len(content) // dtype.itemsize
+        return np.frombuffer(content, dtype=dtype, count=count)
+
+    # A record may have been partially written if the server was stopped abruptly
+    count = (os.path.getsize(path) - offset) // dtype.itemsize
+
+    # Empty files can't be memory mapped
+    if memoryMap and count > 0:
+        return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+
+    return np.fromfile(path, dtype=dtype, count=count, offset=offset)
@@ -0,0 +1,135 @@
+import asyncio
+import json
+import struct
+import time
+
+from aiohttp import web
+
+from EDMOCodecs import CODECS
+from EDMOCommands import EDMOCommands
+
+# Every sample is sent as a single binary WebSocket message
+#
+#   instruction (uint8) | monotonic time in nanoseconds (uint64) | raw data of the packet
+#
+# The layout of the raw data of each instruction is sent as a JSON text message when subscribing
+FRAME_HEADER = struct.Struct("<BQ")
+
+
+class TelemetrySubscriber:
+    """A WebSocket client receiving the telemetry of a session"""
+
+    # The maximum number of frames waiting to be sent
+    # Frames published while the queue is full are dropped, so a slow client never holds up the session
+    MAX_QUEUED_FRAMES = 64
+
+    def __init__(self, socket: web.WebSocketResponse, decimation: int):
+        self.socket = socket
+
+        # Only every nth sample of each instruction is sent
+        self.decimation = decimation
+        self.sampleCounts = dict[int, int]()
+
+        self.queue = asyncio.Queue[bytes](self.MAX_QUEUED_FRAMES)
+        self.sentFrames = 0
+        self.droppedFrames = 0
+
+    def offer(self, instruction: int, frame: bytes):
+        count = self.sampleCounts.get(instruction, 0)
+        self.sampleCounts[instruction] = count + 1
+
+        if count % self.decimation != 0:
+            return
+
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            self.droppedFrames += 1
+
+    async def sendLoop(self):
+        while True:
+            frame = await self.queue.get()
+
+            try:
+                await self.socket.send_bytes(frame)
+            except (ConnectionError, RuntimeError):
+                # The client went away, the socket is closed so serve() stops waiting on it
+                await self.socket.close()
+                return
+
+            self.sentFrames += 1
+
+
+class TelemetryStream:
+    """Fans out the telemetry of a session to any number of WebSocket subscribers"""
+
+    def __init__(self):
+        self.subscribers = list[TelemetrySubscriber]()
+
+    def publish(self, instruction: int, data: bytes | memoryview):
+        """Encodes a sample once, and queues it for every subscriber. Never blocks."""
+        if len(self.subscribers) == 0:
+            return
+
+        frame = b"".join((FRAME_HEADER.pack(instruction, time.monotonic_ns()), data))
+
+        for subscriber in self.subscribers:
+            subscriber.offer(instruction, frame)
+
+    async def serve(self, socket: web.WebSocketResponse, decimation: int):
+        """Streams telemetry to a prepared WebSocket until it is closed"""
+        await socket.send_str(json.dumps(self.describe()))
+
+        subscriber = TelemetrySubscriber(socket, decimation)
+        self.subscribers.append(subscriber)
+        sender = asyncio.create_task(subscriber.sendLoop())
+
+        # Nothing more is queued for a subscriber once sending to it failed
+        sender.add_done_callback(lambda _: self.unsubscribe(subscriber))
+
+        try:
+            # Nothing is expected from the client, this only waits for the socket to close
+            async for _ in socket:
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            self.unsubscribe(subscriber)
+            sender.cancel()
+
+        return subscriber
+
+    def unsubscribe(self, subscriber: TelemetrySubscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+
+    def describe(self):
+        """The layout of the frames of every instruction"""
+        return {
+            "header": [["instruction", "B", 0], ["timestamp", "Q", 1]],
+            "headerSize": FRAME_HEADER.size,
+            "records": {
+                instruction: {
+                    "name": codec.name,
+                    "size": codec.struct.size,
+                    "fields": codec.layout(),
+                }
+                for instruction, codec in CODECS.items()
+                if instruction != EDMOCommands.GET_TIME
+            },
+        }
+
+    async def close(self):
+        for subscriber in list(self.subscribers):
+            await subscriber.socket.close()
+
+    def stats(self):
+        return [
+            {
+                "decimation": subscriber.decimation,
+                "queued": subscriber.queue.qsize(),
+                "sent": subscriber.sentFrames,
+                "dropped": subscriber.droppedFrames,
+            }
+            for subscriber in self.subscribers
+        ]
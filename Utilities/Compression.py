@@ -0,0 +1,53 @@
+import gzip
+import os
+import shutil
+from typing import IO
+
+# zstd compresses faster and smaller than gzip, but is an optional dependency
+try:
+    import zstandard  # type: ignore
+except ImportError:
+    zstandard = None
+
+COMPRESSED_EXTENSIONS = (".gz", ".zst")
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def compressFile(path: str):
+    """Compresses a file in a streaming fashion, replacing it with the compressed file. Returns the path of the compressed file."""
+    extension = ".zst" if zstandard is not None else ".gz"
+    destination = path + extension
+    temporary = destination + ".tmp"
+
+    with open(path, "rb") as source:
+        if zstandard is not None:
+            with open(temporary, "wb") as output:
+                zstandard.ZstdCompressor().copy_stream(source, output)
+        else:
+            with gzip.open(temporary, "wb") as output:
+                shutil.copyfileobj(source, output, CHUNK_SIZE)
+
+    # The original is only removed once the compressed file is complete
+    os.replace(temporary, destination)
+    os.remove(path)
+
+    return destination
+
+
+def isCompressed(path: str):
+    return path.endswith(COMPRESSED_EXTENSIONS)
+
+
+def openFile(path: str) -> IO[bytes]:
+    """Opens a file for binary reading, decompressing it on the fly if needed"""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")  # type: ignore
+
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise ImportError(f"zstandard is required to read {path}")
+
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+
+    return open(path, "rb")
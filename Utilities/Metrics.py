@@ -0,0 +1,185 @@
+# Metrics in the Prometheus text format, as served on /metrics
+#
+# Hot paths only increment plain numbers on objects that are looked up once, when the module is loaded.
+# Everything that can be read from existing state (sessions, queues, buffers) is gathered when the metrics are scraped.
+
+from bisect import bisect_left
+from typing import Callable
+
+# Suitable for anything from a single packet to a slow scan of the serial ports (in seconds)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+
+        # One count per bucket, plus one for values above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float):
+        """Estimates a quantile by interpolating within its bucket, like Prometheus' histogram_quantile"""
+        if self.count == 0:
+            return None
+
+        rank = q * self.count
+        cumulative = 0
+
+        for index, count in enumerate(self.counts):
+            if cumulative + count >= rank and count > 0:
+                # Values above the largest bucket can't be located any more precisely than that
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - cumulative) / count
+
+            cumulative += count
+
+        return self.buckets[-1]
+
+
+class Exposition:
+    """Builds the text format, one metric family at a time"""
+
+    def __init__(self):
+        self.lines = list[str]()
+
+    def family(self, name: str, kind: str, help: str):
+        self.lines.append(f"# HELP {name} {help}")
+        self.lines.append(f"# TYPE {name} {kind}")
+
+    def sample(self, name: str, value: float, labels: dict[str, str] | None = None):
+        self.lines.append(f"{name}{formatLabels(labels)} {formatValue(value)}")
+
+    def histogram(self, name: str, histogram: Histogram, labels: dict[str, str] | None = None):
+        labels = labels or {}
+        cumulative = 0
+
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            self.sample(f"{name}_bucket", cumulative, labels | {"le": formatValue(bound)})
+
+        self.sample(f"{name}_bucket", histogram.count, labels | {"le": "+Inf"})
+        self.sample(f"{name}_sum", histogram.sum, labels)
+        self.sample(f"{name}_count", histogram.count, labels)
+
+    def text(self):
+        return "\n".join(self.lines) + "\n"
+
+
+FAMILIES = list["Family"]()
+
+
+class Family[T: Counter | Histogram]:
+    """A metric that is updated as things happen, with one child per combination of label values"""
+
+    def __init__(
+        self,
+        name: str,
+        kind: str,
+        help: str,
+        labelNames: tuple[str, ...],
+        create: Callable[[], T],
+    ):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.labelNames = labelNames
+        self.create = create
+        self.children = dict[tuple[str, ...], T]()
+
+        FAMILIES.append(self)
+
+    def labels(self, *values: str):
+        """The child for the given label values. Look it up once, and keep it around on hot paths."""
+        child = self.children.get(values)
+
+        if child is None:
+            child = self.children[values] = self.create()
+
+        return child
+
+    def collect(self, exposition: Exposition):
+        exposition.family(self.name, self.kind, self.help)
+
+        for values, child in list(self.children.items()):
+            labels = dict(zip(self.labelNames, values))
+
+            if isinstance(child, Histogram):
+                exposition.histogram(self.name, child, labels)
+            else:
+                exposition.sample(self.name, child.value, labels)
+
+
+def counter(name: str, help: str, labelNames: tuple[str, ...] = ()) -> Family[Counter]:
+    return Family(name, "counter", help, labelNames, Counter)
+
+
+def histogram(
+    name: str, help: str, labelNames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS
+) -> Family[Histogram]:
+    return Family(name, "histogram", help, labelNames, lambda: Histogram(buckets))
+
+
+# Called on every scrape, for metrics that are read from existing state
+COLLECTORS = list[Callable[[Exposition], None]]()
+
+
+def register(collect: Callable[[Exposition], None]):
+    COLLECTORS.append(collect)
+    return collect
+
+
+def render(*collectors: Callable[[Exposition], None]):
+    """The text of every metric family, along with whatever the registered and given collectors add when they are called"""
+    exposition = Exposition()
+
+    for family in FAMILIES:
+        family.collect(exposition)
+
+    for collect in COLLECTORS + list(collectors):
+        collect(exposition)
+
+    return exposition.text()
+
+
+def formatLabels(labels: dict[str, str] | None):
+    if not labels:
+        return ""
+
+    escaped = (
+        f'{key}="{str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")}"'
+        for key, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def formatValue(value: float):
+    if isinstance(value, int):
+        return str(value)
+
+    if value != value:
+        return "NaN"
+
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+
+    return repr(value)
@@ -0,0 +1,105 @@
+import asyncio
+from typing import Awaitable, Callable, Optional
+
+from Utilities import Metrics
+
+TICK_DURATION = Metrics.histogram(
+    "edmo_tick_duration_seconds", "Time taken by each tick of a periodic task", ("task",)
+)
+TICK_OVERRUNS = Metrics.counter(
+    "edmo_tick_overruns_total", "Ticks that didn't finish before the next tick was due", ("task",)
+)
+
+
+class PeriodicTask:
+    """Runs a coroutine function at a fixed rate, independently of any other periodic task"""
+
+    def __init__(
+        self,
+        callback: Callable[[], Awaitable[None]],
+        interval: float,
+        name: Optional[str] = None,
+    ):
+        self.callback = callback
+        self.interval = interval
+        self.task: Optional[asyncio.Task] = None
+
+        # Named tasks are reported on /metrics, tasks with the same name are reported together
+        self.durationMetric = TICK_DURATION.labels(name) if name is not None else None
+        self.overrunMetric = TICK_OVERRUNS.labels(name) if name is not None else None
+
+        self.ticks = 0
+
+        # A tick overruns when it doesn't finish before the next tick is due
+        # The ticks that should've started in the meantime are skipped, rather than run back to back
+        self.overruns = 0
+        self.skippedTicks = 0
+
+        self.lastDuration = 0.0
+        self.maxDuration = 0.0
+        self.totalDuration = 0.0
+
+        # How late a tick started compared to when it was due
+        self.maxLateness = 0.0
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+        return self
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        nextTick = loop.time()
+
+        while True:
+            start = loop.time()
+            self.maxLateness = max(self.maxLateness, start - nextTick)
+
+            try:
+                await self.callback()
+            except Exception as e:
+                # A single failing tick shouldn't stop all future ticks
+                print(f"Periodic task {self.callback} failed: {e!r}")
+
+            end = loop.time()
+            duration = self.lastDuration = end - start
+            self.maxDuration = max(self.maxDuration, duration)
+            self.totalDuration += duration
+            self.ticks += 1
+
+            if self.durationMetric is not None:
+                self.durationMetric.observe(duration)
+
+            # Ticks are scheduled relative to the first tick, rather than the end of the previous one
+            # This prevents the rate from drifting due to the time taken by each tick
+            nextTick += self.interval
+
+            if end > nextTick:
+                missed = int((end - nextTick) // self.interval) + 1
+                nextTick += missed * self.interval
+
+                self.overruns += 1
+                self.skippedTicks += missed
+
+                if self.overrunMetric is not None:
+                    self.overrunMetric.inc()
+
+            await asyncio.sleep(nextTick - loop.time())
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "skippedTicks": self.skippedTicks,
+            "lastDuration": self.lastDuration,
+            "meanDuration": self.totalDuration / self.ticks if self.ticks > 0 else 0,
+            "maxDuration": self.maxDuration,
+            "maxLateness": self.maxLateness,
+        }
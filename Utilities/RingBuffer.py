@@ -0,0 +1,144 @@
+import math
+from typing import Iterable
+
+import numpy as np
+
+
+class RingBuffer:
+    """
+    A fixed size buffer of the most recent samples, with one column per value.
+
+    The buffer is split into blocks. The mean, sum of squared deviations from it (M2) and activity (absolute change from the previous sample)
+    of every column are computed once per block as it fills up, and dropped once it starts being overwritten.
+    The blocks are combined with Chan's parallel formula when the statistics are requested.
+    This keeps the statistics up to date at a low cost per sample, without accumulating rounding errors,
+    and keeps the variance precise for values far from zero (such as gravity, or the offset of a motor).
+    """
+
+    BLOCK_SIZE = 64
+
+    def __init__(self, columns: Iterable[str], capacity: int):
+        self.columns = tuple(columns)
+
+        # The capacity is rounded up to whole blocks
+        blocks = max(1, -(-capacity // self.BLOCK_SIZE))
+        self.capacity = blocks * self.BLOCK_SIZE
+
+        width = len(self.columns)
+        self.samples = np.zeros((self.capacity, width))
+        self.times = np.zeros(self.capacity)
+
+        # The number of samples in each complete block, and the mean, M2 and sum of changes of every column in it
+        self.blockCounts = np.zeros(blocks)
+        self.blockStats = np.zeros((blocks, 3, width))
+
+        # The position the next sample is written to, the number of samples in the buffer, and the number of samples ever added
+        self.head = 0
+        self.count = 0
+        self.total = 0
+
+    def append(self, time: float, values: Iterable[float]):
+        index = self.head
+
+        # The block is about to be overwritten, its old samples no longer count
+        if index % self.BLOCK_SIZE == 0:
+            self.blockCounts[index // self.BLOCK_SIZE] = 0
+            self.blockStats[index // self.BLOCK_SIZE] = 0
+
+        self.samples[index] = values
+        self.times[index] = time
+
+        self.count = min(self.count + 1, self.capacity)
+        self.total += 1
+        self.head = (index + 1) % self.capacity
+
+        if (index + 1) % self.BLOCK_SIZE == 0:
+            self.blockCounts[index // self.BLOCK_SIZE] = self.BLOCK_SIZE
+            self.blockStats[index // self.BLOCK_SIZE] = self.summarize(
+                index + 1 - self.BLOCK_SIZE, index + 1
+            )
+
+    def summarize(self, start: int, end: int):
+        rows = self.samples[start:end]
+
+        # The change of the first row is relative to the sample before it, if there is one
+        previous = self.samples[start - 1] if self.total > end - start else rows[0]
+        changes = np.abs(np.diff(rows, axis=0, prepend=previous[np.newaxis]))
+
+        mean = rows.mean(axis=0)
+        return np.stack([mean, np.square(rows - mean).sum(axis=0), changes.sum(axis=0)])
+
+    def windowRange(self):
+        """The position of the oldest sample in the statistics, and the number of samples in them"""
+        filled = self.head % self.BLOCK_SIZE
+
+        if self.count < self.capacity:
+            return 0, self.count
+
+        # The samples of the block currently being overwritten are no longer part of the statistics
+        if filled == 0:
+            return self.head, self.capacity
+
+        oldest = (self.head - filled + self.BLOCK_SIZE) % self.capacity
+        return oldest, self.capacity - self.BLOCK_SIZE + filled
+
+    def window(self):
+        """The samples and their times, from oldest to newest"""
+        oldest, count = self.windowRange()
+        order = (np.arange(count) + oldest) % self.capacity
+
+        return self.times[order], self.samples[order]
+
+    def stats(self):
+        oldest, count = self.windowRange()
+
+        if count == 0:
+            return {"samples": 0, "timeSpan": 0, "columns": {}}
+
+        # The complete blocks have been summarized already, only the block being filled is summarized now
+        counts = self.blockCounts.copy()
+        blockStats = self.blockStats.copy()
+        filled = self.head % self.BLOCK_SIZE
+        if filled > 0:
+            counts[self.head // self.BLOCK_SIZE] = filled
+            blockStats[self.head // self.BLOCK_SIZE] = self.summarize(self.head - filled, self.head)
+
+        blockMeans, blockM2, blockChanges = blockStats.transpose(1, 0, 2)
+        weights = counts[:, np.newaxis]
+
+        # Chan's parallel formula, the deviations of the block means are taken from the overall mean rather than from zero
+        mean = (weights * blockMeans).sum(axis=0) / count
+        m2 = blockM2.sum(axis=0) + (weights * np.square(blockMeans - mean)).sum(axis=0)
+
+        variance = m2 / count
+        activity = blockChanges.sum(axis=0) / count
+
+        # Minima and maxima can't be kept when samples are removed, so they are computed on request
+        _, samples = self.window()
+        minimum = samples.min(axis=0)
+        maximum = samples.max(axis=0)
+
+        newest = self.times[self.head - 1]
+
+        columns = {
+            name: {
+                "mean": finite(mean[i]),
+                "variance": finite(variance[i]),
+                "min": finite(minimum[i]),
+                "max": finite(maximum[i]),
+                "activity": finite(activity[i]),
+            }
+            for i, name in enumerate(self.columns)
+        }
+
+        return {
+            "samples": count,
+            "timeSpan": newest - self.times[oldest],
+            "columns": columns,
+        }
+
+
+def finite(value: float):
+    """NaN and infinity aren't valid JSON, they're reported as null instead"""
+    value = float(value)
+    return value if math.isfinite(value) else None
@@ -0,0 +1,45 @@
+from typing import Callable
+
+
+class Versioned[T]:
+    """
+    A value that is only rebuilt after it changed, along with anything derived from it (such as its JSON or a message).
+
+    Whoever changes what the value is built from calls changed(), which also invalidates the values that depend on this one.
+    The value and whatever is derived from it are shared between callers, and must not be modified.
+    """
+
+    def __init__(self, build: Callable[[], T], dependsOn: tuple["Versioned", ...] = ()):
+        self.build = build
+        self.version = 0
+
+        self.cachedVersion = -1
+        self.cachedValue: T | None = None
+        self.derived = dict[str, object]()
+
+        self.dependents = list[Versioned]()
+        for dependency in dependsOn:
+            dependency.dependents.append(self)
+
+    def changed(self):
+        self.version += 1
+
+        for dependent in self.dependents:
+            dependent.changed()
+
+    def get(self) -> T:
+        if self.cachedVersion != self.version:
+            self.cachedValue = self.build()
+            self.cachedVersion = self.version
+            self.derived = {}
+
+        return self.cachedValue  # type: ignore
+
+    def derive[U](self, key: str, make: Callable[[T], U]) -> U:
+        """Something made from the value, made once per version"""
+        value = self.get()
+
+        if key not in self.derived:
+            self.derived[key] = make(value)
+
+        return self.derived[key]  # type: ignore
@@ -1,3 +1,4 @@
+import time
 from typing import Callable, cast
 from aiortc import (
     RTCPeerConnection,
@@ -6,6 +7,9 @@ from aiortc import (
     RTCIceCandidate,
 )
 
+import PlayerProtocol
+from PlayerProtocol import PlayerMessage
+
 
 class WebRTCPeer:
     def __init__(self, ip: str | None):
@@ -20,14 +24,21 @@ class WebRTCPeer:
         self._pc.on("iceconnectionstatechange", self.onICEStateChange)
         self._pc.on("icecandidate", self.onICECandidate)
 
-        self.onMessage = list[Callable[[str], None]]()
+        self.onMessage = list[Callable[[str | bytes], None]]()
         self.onDisconnectCallbacks = list[Callable[[], None]]()
         self.onConnectCallbacks = list[Callable[[], None]]()
         self.onClosedCallbacks = list[Callable[[], None]]()
 
         self.closed = False
         self.connected = False
-        self.sendBuffer = []
+        self.sendBuffer = list[str | PlayerMessage]()
+
+        # Whether the client asked for binary messages when it opened the data channel
+        # Messages sent before that are buffered, so they can still be encoded accordingly
+        self.binary = False
+
+        # When the message being handled was received, for tracing its latency (see LatencyTrace)
+        self.lastMessageTime: float | None = None
 
         pass
 
@@ -38,15 +49,32 @@ class WebRTCPeer:
         await self._pc.setLocalDescription(answer)
         return self._pc.localDescription
 
-    def send(self, message: str):
+    def send(self, message: str | PlayerMessage):
         if self._dataChannel is None:
             self.sendBuffer.append(message)
             return  # Might want to buffer instead
 
-        self._dataChannel.send(message)
+        encoded = self.encode(message)
+        if encoded is not None:
+            self._dataChannel.send(encoded)
+
+    def encode(self, message: str | PlayerMessage):
+        if isinstance(message, str):
+            return message
+
+        return message.binary() if self.binary else message.text()
+
+    def bufferedAmount(self):
+        """The bytes waiting to be sent, including messages sent before the data channel was created"""
+        if self._dataChannel is None:
+            return sum(len(self.encode(message) or "") for message in self.sendBuffer)
+
+        return self._dataChannel.bufferedAmount
+
+    async def onMessageReceived(self, message: str | bytes):
+        self.lastMessageTime = time.perf_counter()
 
-    async def onMessageReceived(self, message: str):
-        if message == "CLOSE":
+        if message == "CLOSE" or message == PlayerProtocol.CLOSE_MESSAGE:
             await self.close()
             return
 
@@ -75,10 +103,13 @@ class WebRTCPeer:
 
     def onDataChannel(self, channel: RTCDataChannel):
         self._dataChannel = channel
-        print(f"ICE {self._identifier} data channel created")
+        self.binary = channel.protocol == PlayerProtocol.BINARY_PROTOCOL
+        print(f"ICE {self._identifier} data channel created{" (binary)" if self.binary else ""}")
         channel.on("message", self.onMessageReceived)
         for s in self.sendBuffer:
-            channel.send(s)
+            encoded = self.encode(s)
+            if encoded is not None:
+                channel.send(encoded)
 
         self.sendBuffer = []
 